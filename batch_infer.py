@@ -0,0 +1,304 @@
+"""
+Cached Batch Inference and Validation
+Runs a model over a directory of images (predict) or a dataset split (val)
+through the result cache, so only new or changed images, or a new model,
+cost inference time. Confidence thresholds, the IoU match threshold and
+the metrics are applied to cached raw detections, so re-running with other
+thresholds, or sweeping them, takes seconds.
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+import yaml
+
+from dataset_cache import label_path, list_images, read_labels
+from result_cache import (CONF_FLOOR, DEFAULT_CACHE_PATH, DEFAULT_MAX_BYTES, ResultCache,
+                          file_hash, filter_boxes, pack_boxes)
+
+# Images per predict() call, and per cache commit
+BATCH_SIZE = 16
+
+# IoU at which a detection matches a labeled box (mAP50)
+MATCH_IOU = 0.5
+
+DEFAULT_SWEEP = [0.1, 0.2, 0.25, 0.3, 0.4, 0.5, 0.6, 0.7]
+
+
+def _numpy(values):
+    """Tensor (or array/list) as a numpy array"""
+    if hasattr(values, 'cpu'):
+        values = values.cpu().numpy()
+    return np.asarray(values)
+
+
+def run_model(model_path, image_files, cache, imgsz=416, iou=0.7, device='cpu'):
+    """Raw detections of every image: {path: (boxes, (h, w))}
+
+    Cached results are used where the image, model and parameters match;
+    the model is only loaded when something is missing.
+    """
+    model_hash = file_hash(model_path)
+    params = {'imgsz': imgsz, 'iou': iou, 'conf': CONF_FLOOR}
+    results = {}
+    missing = []
+    for path in image_files:
+        image_hash = file_hash(path)
+        key = cache.make_key(image_hash, model_hash, params)
+        cached = cache.get(key)
+        if cached is None:
+            missing.append((path, image_hash, key))
+        else:
+            results[path] = cached
+
+    if missing:
+        from ultralytics import YOLO
+
+        model = YOLO(model_path, task='detect')
+        for start in range(0, len(missing), BATCH_SIZE):
+            batch = missing[start:start + BATCH_SIZE]
+            predictions = model.predict(source=[path for path, _, _ in batch], imgsz=imgsz,
+                                        conf=CONF_FLOOR, iou=iou, device=device,
+                                        verbose=False, stream=True)
+            for (path, image_hash, key), result in zip(batch, predictions):
+                boxes = pack_boxes(_numpy(result.boxes.xyxy), _numpy(result.boxes.conf),
+                                   _numpy(result.boxes.cls))
+                shape = result.orig_shape[:2]
+                cache.put(key, image_hash, model_hash, params, boxes, shape)
+                results[path] = (boxes, shape)
+            cache.flush()
+    cache.flush()
+    return results
+
+
+def box_iou(a, b):
+    """IoU matrix of (n, 4) and (m, 4) xyxy boxes"""
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(br - tl, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def labeled_boxes(image_path, shape):
+    """Labels of an image as (classes, xyxy pixel boxes)"""
+    labels = read_labels(label_path(image_path))
+    h, w = shape
+    xy, wh = labels[:, 1:3], labels[:, 3:5]
+    xyxy = np.concatenate([xy - wh / 2, xy + wh / 2], axis=1) * [w, h, w, h]
+    return labels[:, 0].astype(int), xyxy
+
+
+def match(results, match_iou=MATCH_IOU):
+    """Match detections to labels, greedily by confidence
+
+    Returns (conf, cls, tp) over all detections and the labeled class of
+    every ground truth box. Since higher confidence detections are matched
+    first, the matches of the detections above any threshold don't depend
+    on the ones below it, so one matching serves every threshold.
+    """
+    confs, classes, tps, gt_classes = [], [], [], []
+    for path, (boxes, shape) in results.items():
+        gt_cls, gt_xyxy = labeled_boxes(path, shape)
+        gt_classes.append(gt_cls)
+        order = np.argsort(-boxes['conf'], kind='stable')
+        boxes = boxes[order]
+        tp = np.zeros(len(boxes), dtype=bool)
+        if len(boxes) and len(gt_cls):
+            ious = box_iou(boxes['xyxy'], gt_xyxy)
+            ious[boxes['cls'][:, None] != gt_cls[None, :]] = 0
+            taken = np.zeros(len(gt_cls), dtype=bool)
+            for i in range(len(boxes)):
+                candidates = np.where(taken, 0, ious[i])
+                j = int(np.argmax(candidates))
+                if candidates[j] >= match_iou:
+                    taken[j] = True
+                    tp[i] = True
+        confs.append(boxes['conf'])
+        classes.append(boxes['cls'].astype(int))
+        tps.append(tp)
+    return (np.concatenate(confs) if confs else np.zeros(0),
+            np.concatenate(classes) if classes else np.zeros(0, int),
+            np.concatenate(tps) if tps else np.zeros(0, bool),
+            np.concatenate(gt_classes) if gt_classes else np.zeros(0, int))
+
+
+def average_precision(conf, tp, n_gt):
+    """AP of one class: area under the interpolated precision-recall curve
+    (101 points, like COCO and ultralytics)"""
+    if n_gt == 0 or len(conf) == 0:
+        return 0.0
+    order = np.argsort(-conf, kind='stable')
+    hits = np.cumsum(tp[order])
+    recall = hits / n_gt
+    precision = hits / np.arange(1, len(hits) + 1)
+    # Precision envelope: best precision at this recall or higher
+    precision = np.flip(np.maximum.accumulate(np.flip(precision)))
+    points = np.linspace(0, 1, 101)
+    index = np.searchsorted(recall, points, side='left')
+    sampled = np.where(index < len(precision), precision[np.minimum(index, len(precision) - 1)], 0)
+    return float(sampled.mean())
+
+
+def evaluate(conf, cls, tp, gt_classes, names, threshold):
+    """Per-class and overall AP50, plus precision and recall at threshold"""
+    per_class = {}
+    for c, name in enumerate(names):
+        selected = cls == c
+        n_gt = int((gt_classes == c).sum())
+        kept = selected & (conf >= threshold)
+        per_class[name] = {
+            'labels': n_gt,
+            'ap50': average_precision(conf[selected], tp[selected], n_gt),
+            'precision': float(tp[kept].mean()) if kept.any() else 0.0,
+            'recall': float(tp[kept].sum() / n_gt) if n_gt else 0.0
+        }
+    present = [m for m in per_class.values() if m['labels']]
+    return {
+        'map50': float(np.mean([m['ap50'] for m in present])) if present else 0.0,
+        'precision': float(np.mean([m['precision'] for m in present])) if present else 0.0,
+        'recall': float(np.mean([m['recall'] for m in present])) if present else 0.0,
+        'classes': per_class
+    }
+
+
+def sweep(conf, tp, n_gt, thresholds):
+    """Overall precision, recall and F1 at each confidence threshold"""
+    rows = []
+    for threshold in thresholds:
+        kept = conf >= threshold
+        precision = float(tp[kept].mean()) if kept.any() else 0.0
+        recall = float(tp[kept].sum() / n_gt) if n_gt else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        rows.append({'conf': threshold, 'detections': int(kept.sum()),
+                     'precision': precision, 'recall': recall, 'f1': f1})
+    return rows
+
+
+def read_dataset(data_yaml):
+    """(dataset root, data.yaml contents, class names)"""
+    with open(data_yaml) as f:
+        data = yaml.safe_load(f)
+    names = data.get('names', [])
+    if isinstance(names, dict):
+        names = [names[i] for i in sorted(names)]
+    return data.get('path') or os.path.dirname(data_yaml), data, names
+
+
+def predictions_json(results, names, threshold):
+    output = {}
+    for path, (boxes, _) in results.items():
+        boxes = filter_boxes(boxes, threshold)
+        output[os.path.relpath(path)] = [
+            {
+                'class': names[int(b['cls'])] if int(b['cls']) < len(names) else int(b['cls']),
+                'confidence': round(float(b['conf']), 4),
+                'box': [round(float(v), 1) for v in b['xyxy']]
+            }
+            for b in boxes
+        ]
+    return output
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Cached batch inference and validation')
+    parser.add_argument('command', choices=['predict', 'val', 'cache'],
+                       help='predict: detect in --source; val: metrics on a dataset split; '
+                            'cache: show (or --clear) the result cache')
+    parser.add_argument('--model', type=str, default=None,
+                       help='Model file (default: latest runs/train/*/weights/best.pt)')
+    parser.add_argument('--source', type=str, default=None,
+                       help='predict: image directory')
+    parser.add_argument('--data', type=str, default='data/data.yaml',
+                       help='Dataset YAML with the class names, and for val the split (default: data/data.yaml)')
+    parser.add_argument('--split', type=str, default='val',
+                       help='val: split key in the dataset YAML (default: val)')
+    parser.add_argument('--imgsz', type=int, default=416,
+                       help='Inference size (default: 416)')
+    parser.add_argument('--conf', type=float, default=0.25,
+                       help='Confidence threshold (default: 0.25)')
+    parser.add_argument('--iou', type=float, default=0.7,
+                       help='NMS IoU threshold (default: 0.7)')
+    parser.add_argument('--sweep', type=float, nargs='*', default=None,
+                       help=f'val: also show P/R/F1 at these thresholds (default: {DEFAULT_SWEEP})')
+    parser.add_argument('--output', type=str, default=None,
+                       help='Write predictions or metrics as JSON to this file')
+    parser.add_argument('--cache', type=str, default=DEFAULT_CACHE_PATH,
+                       help=f'Result cache database (default: {DEFAULT_CACHE_PATH})')
+    parser.add_argument('--cache-size-mb', type=int, default=DEFAULT_MAX_BYTES // 1024**2,
+                       help=f'Result cache size limit (default: {DEFAULT_MAX_BYTES // 1024**2})')
+    parser.add_argument('--clear', action='store_true',
+                       help='cache: delete all cached results')
+    args = parser.parse_args()
+
+    cache = ResultCache(args.cache, args.cache_size_mb * 1024**2)
+    if args.command == 'cache':
+        if args.clear:
+            cache.clear()
+        stats = cache.stats()
+        print(f"{args.cache}: {stats['entries']} result(s) from {stats['models']} model(s), "
+              f"{stats['bytes'] / 1024**2:.1f} of {stats['max_bytes'] / 1024**2:.0f} MB")
+        cache.close()
+        return
+
+    model_path = args.model
+    if model_path is None:
+        from export_for_pi import find_best_model
+        model_path = find_best_model()
+        if model_path is None:
+            return
+
+    root, data, names = read_dataset(args.data)
+    if args.command == 'predict':
+        if not args.source:
+            parser.error('predict needs --source')
+        image_files = list_images(args.source)
+    else:
+        image_files = list_images(os.path.join(root, data[args.split]))
+
+    start = time.time()
+    results = run_model(model_path, image_files, cache, args.imgsz, args.iou)
+    elapsed = time.time() - start
+    stats = cache.stats()
+    cache.close()
+    print(f"{len(results)} image(s) in {elapsed:.1f}s: {stats['hits']} cached, "
+          f"{stats['misses']} inferred ({stats['evicted']} evicted)")
+
+    if args.command == 'predict':
+        predictions = predictions_json(results, names, args.conf)
+        count = sum(len(v) for v in predictions.values())
+        print(f"{count} detection(s) at conf >= {args.conf}")
+        output = args.output or 'predictions.json'
+        with open(output, 'w') as f:
+            json.dump(predictions, f, indent=2)
+        print(f"✓ Predictions written to {output}")
+        return
+
+    conf, cls, tp, gt_classes = match(results)
+    metrics = evaluate(conf, cls, tp, gt_classes, names, args.conf)
+    print(f"\n{'class':15s} {'labels':>6s} {'AP50':>6s} {'P':>6s} {'R':>6s}   (P/R at conf {args.conf})")
+    for name, m in metrics['classes'].items():
+        print(f"{name:15s} {m['labels']:6d} {m['ap50']:6.3f} {m['precision']:6.3f} {m['recall']:6.3f}")
+    print(f"{'all':15s} {len(gt_classes):6d} {metrics['map50']:6.3f} "
+          f"{metrics['precision']:6.3f} {metrics['recall']:6.3f}")
+
+    if args.sweep is not None:
+        metrics['sweep'] = sweep(conf, tp, len(gt_classes), args.sweep or DEFAULT_SWEEP)
+        print(f"\n{'conf':>6s} {'dets':>6s} {'P':>6s} {'R':>6s} {'F1':>6s}")
+        for row in metrics['sweep']:
+            print(f"{row['conf']:6.2f} {row['detections']:6d} {row['precision']:6.3f} "
+                  f"{row['recall']:6.3f} {row['f1']:6.3f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(metrics, f, indent=2)
+        print(f"\n✓ Metrics written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Dataloader Throughput Benchmark
+Compares reading training images by decoding and resizing the JPEGs (what
+every epoch did before) with reading them from the memory-mapped dataset
+cache
+"""
+
+import argparse
+import os
+import time
+
+import cv2
+
+from dataset_cache import list_images, open_cache, resize_long_side
+
+try:
+    import torch
+    from torch.utils.data import DataLoader, Dataset
+    TORCH_AVAILABLE = True
+except ImportError:
+    TORCH_AVAILABLE = False
+
+
+def load_jpeg(image_path, imgsz):
+    """Decode and resize one image the way training does without the cache"""
+    return resize_long_side(cv2.imread(image_path), imgsz)
+
+
+if TORCH_AVAILABLE:
+    class BenchDataset(Dataset):
+        """Returns one fixed-size image per index from either source"""
+
+        def __init__(self, image_files, imgsz, cache=None):
+            self.image_files = image_files
+            self.imgsz = imgsz
+            self.cache = cache
+
+        def __len__(self):
+            return len(self.image_files)
+
+        def __getitem__(self, i):
+            if self.cache is not None:
+                im, _ = self.cache.image(i)
+            else:
+                im = load_jpeg(self.image_files[i], self.imgsz)
+            # Pad to a square so images can be batched
+            padded = cv2.copyMakeBorder(im, 0, self.imgsz - im.shape[0], 0, self.imgsz - im.shape[1],
+                                        cv2.BORDER_CONSTANT, value=(114, 114, 114))
+            return torch.from_numpy(padded)
+
+
+def run(image_files, imgsz, cache, workers, batch):
+    """Images per second for one pass over the dataset"""
+    start = time.time()
+    if TORCH_AVAILABLE and workers > 0:
+        loader = DataLoader(BenchDataset(image_files, imgsz, cache), batch_size=batch,
+                            num_workers=workers, shuffle=True)
+        count = sum(len(images) for images in loader)
+    else:
+        count = 0
+        for i, image_path in enumerate(image_files):
+            if cache is not None:
+                cache.image(i)
+            else:
+                load_jpeg(image_path, imgsz)
+            count += 1
+    return count / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark dataloader throughput')
+    parser.add_argument('--images', type=str, default='data/train/images',
+                       help='Image directory (default: data/train/images)')
+    parser.add_argument('--imgsz', type=int, default=416,
+                       help='Image size (default: 416)')
+    parser.add_argument('--workers', type=int, default=4,
+                       help='DataLoader workers, 0 for a plain loop (default: 4)')
+    parser.add_argument('--batch', type=int, default=4,
+                       help='Batch size (default: 4)')
+    parser.add_argument('--epochs', type=int, default=2,
+                       help='Passes per source (default: 2)')
+    args = parser.parse_args()
+
+    image_files = list_images(args.images)
+
+    print("=" * 60)
+    print("Dataloader Throughput Benchmark")
+    print("=" * 60)
+    print(f"Images: {len(image_files)} in {args.images}")
+    print(f"Workers: {args.workers if TORCH_AVAILABLE else '0 (torch not installed)'}, "
+          f"batch: {args.batch}")
+
+    build_start = time.time()
+    cache = open_cache(image_files, args.imgsz)
+    print(f"Cache ready in {time.time() - build_start:.1f}s "
+          f"({os.path.getsize(cache.data_path) / 1024**2:.0f} MB)")
+    print("=" * 60)
+
+    results = {}
+    for name, source in [('JPEG decode + resize', None), ('Memory-mapped cache', cache)]:
+        rates = [run(image_files, args.imgsz, source, args.workers, args.batch)
+                 for _ in range(args.epochs)]
+        results[name] = max(rates)
+        print(f"{name:22s} {results[name]:8.1f} images/s  "
+              f"({len(image_files) / results[name]:.1f}s per epoch)")
+
+    speedup = results['Memory-mapped cache'] / results['JPEG decode + resize']
+    print(f"\nSpeedup: {speedup:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Dashboard HTTP Load Test
+Hammers dashboard API endpoints from several threads and reports requests
+per second and bytes transferred, with and without conditional GETs/gzip
+"""
+
+import argparse
+import http.client
+import threading
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_PATHS = ['/api/detections', '/api/stats', '/api/current-location']
+
+
+def worker(host, port, paths, duration, conditional, gzip_enabled, results, lock):
+    """Send requests on one keep-alive connection until duration expires"""
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    etags = {}
+    count = 0
+    not_modified = 0
+    errors = 0
+    received = 0
+    deadline = time.time() + duration
+
+    while time.time() < deadline:
+        for path in paths:
+            headers = {}
+            if gzip_enabled:
+                headers['Accept-Encoding'] = 'gzip'
+            if conditional and path in etags:
+                headers['If-None-Match'] = etags[path]
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection(host, port, timeout=10)
+                continue
+
+            count += 1
+            received += len(body)
+            if response.status == 304:
+                not_modified += 1
+            elif response.status != 200:
+                errors += 1
+            etag = response.getheader('ETag')
+            if etag:
+                etags[path] = etag
+
+    conn.close()
+    with lock:
+        results['requests'] += count
+        results['not_modified'] += not_modified
+        results['errors'] += errors
+        results['bytes'] += received
+
+
+def run(url, paths, clients, duration, conditional, gzip_enabled):
+    """Run one load test configuration and return its results"""
+    parts = urlsplit(url)
+    results = {'requests': 0, 'not_modified': 0, 'errors': 0, 'bytes': 0}
+    lock = threading.Lock()
+    threads = [threading.Thread(target=worker, args=(parts.hostname, parts.port or 80, paths,
+                                                     duration, conditional, gzip_enabled,
+                                                     results, lock))
+               for _ in range(clients)]
+
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    results['rps'] = results['requests'] / elapsed
+    results['kb_per_request'] = results['bytes'] / max(results['requests'], 1) / 1024
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the dashboard API')
+    parser.add_argument('--url', type=str, default='http://localhost:5000',
+                       help='Dashboard base URL (default: http://localhost:5000)')
+    parser.add_argument('--paths', type=str, nargs='+', default=DEFAULT_PATHS,
+                       help='Endpoints to request in turn')
+    parser.add_argument('--clients', type=int, default=8,
+                       help='Concurrent clients (default: 8)')
+    parser.add_argument('--duration', type=float, default=10,
+                       help='Seconds per configuration (default: 10)')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Dashboard HTTP Load Test")
+    print("=" * 60)
+    print(f"URL: {args.url}")
+    print(f"Endpoints: {', '.join(args.paths)}")
+    print(f"Clients: {args.clients}, {args.duration:.0f}s per run")
+    print("=" * 60)
+
+    configs = [
+        ('Plain requests', False, False),
+        ('Gzip', False, True),
+        ('Conditional GET + gzip', True, True),
+    ]
+    for name, conditional, gzip_enabled in configs:
+        r = run(args.url, args.paths, args.clients, args.duration, conditional, gzip_enabled)
+        print(f"{name:24s} {r['rps']:8.1f} req/s  {r['kb_per_request']:8.2f} KB/req  "
+              f"304s: {r['not_modified']}  errors: {r['errors']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""
+INT8 Calibration Set Builder
+Picks a representative sample of data/train, stratified by class and by
+brightness, letterboxes it to the export image size and stores it as a
+memory-mapped uint8 RGB array for export_for_pi.py's INT8 calibration
+"""
+
+import json
+import os
+import random
+from collections import defaultdict
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+import yaml
+
+from dataset_cache import label_path, list_images, read_labels
+
+CALIBRATION_DIR = 'data/calibration'
+DEFAULT_COUNT = 256
+
+# Brightness strata (mean gray level quantiles over the training set)
+BRIGHTNESS_BINS = ['dark', 'normal', 'bright']
+
+PAD_VALUE = 114
+
+
+def calibration_paths(imgsz, output_dir=CALIBRATION_DIR):
+    """(array file, manifest file, data yaml) for an image size"""
+    base = os.path.join(output_dir, f'calib_{imgsz}')
+    return base + '.npy', base + '.json', base + '.yaml'
+
+
+def letterbox(im, imgsz):
+    """Resize keeping the aspect ratio and pad to imgsz x imgsz, centered"""
+    h0, w0 = im.shape[:2]
+    r = min(imgsz / h0, imgsz / w0)
+    w, h = int(round(w0 * r)), int(round(h0 * r))
+    if (w, h) != (w0, h0):
+        im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+    top = (imgsz - h) // 2
+    left = (imgsz - w) // 2
+    return cv2.copyMakeBorder(im, top, imgsz - h - top, left, imgsz - w - left,
+                              cv2.BORDER_CONSTANT, value=(PAD_VALUE,) * 3)
+
+
+def scan_images(image_files):
+    """Stream over the images: (path, classes, brightness) per image
+
+    Images are decoded at 1/8 resolution in grayscale, which is plenty for a
+    brightness estimate and avoids full-size decodes.
+    """
+    for image_path in image_files:
+        gray = cv2.imread(image_path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if gray is None:
+            continue
+        classes = sorted({int(c) for c in read_labels(label_path(image_path))[:, 0]})
+        yield image_path, classes, float(gray.mean())
+
+
+def stratify(records, count, seed=0):
+    """Pick count images spread evenly over (class, brightness) strata
+
+    Each image is filed under its rarest class so rare classes aren't
+    crowded out. Strata are filled round-robin, so every stratum gets at
+    least one image before any gets a second.
+    """
+    if not records:
+        return []
+    rng = random.Random(seed)
+    class_freq = defaultdict(int)
+    for _, classes, _ in records:
+        for c in classes:
+            class_freq[c] += 1
+
+    levels = sorted(brightness for _, _, brightness in records)
+    cuts = [levels[len(levels) * i // len(BRIGHTNESS_BINS)] for i in range(1, len(BRIGHTNESS_BINS))]
+
+    strata = defaultdict(list)
+    for path, classes, brightness in records:
+        cls = min(classes, key=lambda c: class_freq[c]) if classes else -1
+        level = sum(brightness >= cut for cut in cuts)
+        strata[(cls, BRIGHTNESS_BINS[level])].append(path)
+
+    for paths in strata.values():
+        rng.shuffle(paths)
+
+    selected = []
+    keys = sorted(strata)
+    while len(selected) < count and any(strata[k] for k in keys):
+        for key in keys:
+            if strata[key] and len(selected) < count:
+                selected.append((strata[key].pop(), key))
+    return selected
+
+
+def build_calibration_set(data_dir='data', imgsz=416, count=DEFAULT_COUNT,
+                          output_dir=CALIBRATION_DIR, seed=0):
+    """Build the calibration array, manifest and data yaml; returns the manifest"""
+    image_files = list_images(os.path.join(data_dir, 'train', 'images'))
+    records = list(scan_images(image_files))
+    if not records:
+        raise ValueError(f"No training images found in {data_dir}/train/images")
+    selected = stratify(records, count, seed)
+
+    os.makedirs(output_dir, exist_ok=True)
+    array_path, manifest_path, yaml_path = calibration_paths(imgsz, output_dir)
+    images = np.lib.format.open_memmap(array_path, mode='w+', dtype=np.uint8,
+                                       shape=(len(selected), imgsz, imgsz, 3))
+    for i, (image_path, _) in enumerate(selected):
+        im = cv2.imread(image_path)
+        # RGB, like ultralytics' calibration batches
+        images[i] = cv2.cvtColor(letterbox(im, imgsz), cv2.COLOR_BGR2RGB)
+    images.flush()
+    del images
+
+    with open(os.path.join(data_dir, 'data.yaml')) as f:
+        data = yaml.safe_load(f)
+    names = data.get('names', [])
+
+    strata = defaultdict(int)
+    for _, (cls, level) in selected:
+        label = names[cls] if 0 <= cls < len(names) else 'background'
+        strata[f"{label}/{level}"] += 1
+
+    # Data yaml over the same images, for exporters that read image files
+    list_path = os.path.splitext(yaml_path)[0] + '.txt'
+    with open(list_path, 'w') as f:
+        f.writelines(os.path.abspath(path) + '\n' for path, _ in selected)
+    with open(yaml_path, 'w') as f:
+        yaml.safe_dump({'train': os.path.abspath(list_path), 'val': os.path.abspath(list_path),
+                        'nc': data.get('nc', len(names)), 'names': names}, f)
+
+    manifest = {
+        'imgsz': imgsz,
+        'count': len(selected),
+        'color': 'RGB',
+        'array': os.path.basename(array_path),
+        'data_yaml': os.path.basename(yaml_path),
+        'source_images': len(records),
+        'strata': dict(sorted(strata.items())),
+        'files': [os.path.relpath(path, data_dir) for path, _ in selected]
+    }
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class CalibrationSet:
+    """A built calibration set: images (memmap, N x imgsz x imgsz x 3 RGB)"""
+
+    def __init__(self, imgsz, output_dir=CALIBRATION_DIR):
+        array_path, manifest_path, self.data_yaml = calibration_paths(imgsz, output_dir)
+        with open(manifest_path) as f:
+            self.manifest = json.load(f)
+        self.images = np.load(array_path, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.images)
+
+
+def load_calibration_set(imgsz, count=DEFAULT_COUNT, output_dir=CALIBRATION_DIR, data_dir='data'):
+    """Open the calibration set for imgsz, building it if missing or too small"""
+    try:
+        calibration = CalibrationSet(imgsz, output_dir)
+        if calibration.manifest['count'] >= count:
+            return calibration
+    except (OSError, ValueError, KeyError):
+        pass
+
+    print(f"Building INT8 calibration set ({count} images at {imgsz}x{imgsz})...")
+    build_calibration_set(data_dir, imgsz, count, output_dir)
+    return CalibrationSet(imgsz, output_dir)
+
+
+@contextmanager
+def calibration_feed(calibration, batch=32):
+    """Make ultralytics' exporter calibrate on the calibration array
+
+    Yields True when the exporter's calibration dataloader was replaced;
+    with older ultralytics versions it yields False and callers should pass
+    calibration.data_yaml as the export data instead.
+    """
+    try:
+        import torch
+        from ultralytics.engine.exporter import Exporter
+    except ImportError:
+        yield False
+        return
+    if not hasattr(Exporter, 'get_int8_calibration_dataloader'):
+        yield False
+        return
+
+    def dataloader(self, prefix=''):
+        images = calibration.images
+        return [{'img': torch.from_numpy(np.ascontiguousarray(images[i:i + batch])).permute(0, 3, 1, 2)}
+                for i in range(0, len(images), batch)]
+
+    original = Exporter.get_int8_calibration_dataloader
+    Exporter.get_int8_calibration_dataloader = dataloader
+    try:
+        yield True
+    finally:
+        Exporter.get_int8_calibration_dataloader = original
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build the INT8 calibration set')
+    parser.add_argument('--data', type=str, default='data',
+                       help='Dataset directory (default: data)')
+    parser.add_argument('--imgsz', type=int, nargs='+', default=[416],
+                       help='Export image sizes (default: 416)')
+    parser.add_argument('--count', type=int, default=DEFAULT_COUNT,
+                       help=f'Calibration images (default: {DEFAULT_COUNT})')
+    parser.add_argument('--output', type=str, default=CALIBRATION_DIR,
+                       help=f'Output directory (default: {CALIBRATION_DIR})')
+    args = parser.parse_args()
+
+    for imgsz in args.imgsz:
+        manifest = build_calibration_set(args.data, imgsz, args.count, args.output)
+        print(f"\nCalibration set {imgsz}x{imgsz}: {manifest['count']} of "
+              f"{manifest['source_images']} training images")
+        for stratum, n in manifest['strata'].items():
+            print(f"  {stratum:28s} {n}")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,8 +4,7 @@ Clear or archive old detection files
 """
 import os
 import glob
-import shutil
-from datetime import datetime
+from session_archive import ARCHIVE_DIR, archive_file
 
 def clear_detections(archive=True):
     """Clear detection files, optionally archiving them first"""
@@ -20,18 +19,21 @@ def clear_detections(archive=True):
     print(f"Found {len(detection_files)} detection file(s)")
     
     if archive:
-        # Create archive directory with timestamp
-        archive_dir = f"detections_archive_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        os.makedirs(archive_dir, exist_ok=True)
-        print(f"\nArchiving to: {archive_dir}/")
+        print(f"\nArchiving to: {ARCHIVE_DIR}/")
         
-        # Move files to archive
+        # Compress each file into the session archive
+        kept = 0
         for file in detection_files:
-            dest = os.path.join(archive_dir, os.path.basename(file))
-            shutil.move(file, dest)
-            print(f"  Archived: {file}")
+            entry = archive_file(file, ARCHIVE_DIR)
+            print(f"  Archived: {file} ({entry['count']} detections, "
+                  f"{entry['original_size'] / 1024:.1f} KB -> {entry['size'] / 1024:.1f} KB)")
+            if entry['leftover_bytes']:
+                kept += 1
+                print(f"  Kept: {file} ({entry['leftover_bytes']} bytes could not be parsed)")
         
-        print(f"\n✓ {len(detection_files)} file(s) archived to {archive_dir}/")
+        print(f"\n✓ {len(detection_files) - kept} file(s) archived to {ARCHIVE_DIR}/")
+        if kept:
+            print(f"⚠ {kept} file(s) kept: check them and run again")
     else:
         # Delete files permanently
         for file in detection_files:
@@ -1,76 +1,177 @@
-from flask import Flask, render_template, jsonify
+from flask import Flask, render_template, jsonify, request
 from flask_socketio import SocketIO, emit
-import paho.mqtt.client as mqtt
-import json
-from datetime import datetime
-from collections import Counter
+import os
+import time
+from collections import deque
+from itertools import islice
 import threading
 
+from detection_store import DetectionStore
+from fleet_ingest import DEFAULT_BROKER, FLEET_DB_PATH, FleetIngestor, connect_fleet
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'chili-detection-secret'
 socketio = SocketIO(app, cors_allowed_origins="*")
 
-# Store recent detections (last 100)
-recent_detections = []
-detection_stats = Counter()
-
-def on_connect(client, userdata, flags, rc):
-    print(f"MQTT Connected! Code: {rc}")
-    client.subscribe("chili/detections")
-    print("Subscribed to: chili/detections")
-
-def on_message(client, userdata, msg):
-    try:
-        data = json.loads(msg.payload.decode())
-        
-        # Add to recent detections
-        recent_detections.insert(0, data)
-        if len(recent_detections) > 100:
-            recent_detections.pop()
-        
-        # Update statistics
-        detection_stats[data['class']] += 1
-        
-        # Emit to all connected clients
-        socketio.emit('new_detection', data, namespace='/dashboard')
-        
-        print(f"[{data['datetime']}] {data['class']} - Confidence: {data['confidence']:.2f}")
-    except Exception as e:
-        print(f"Error processing message: {e}")
-
-# Setup MQTT client
-mqtt_client = mqtt.Client()
-mqtt_client.on_connect = on_connect
-mqtt_client.on_message = on_message
+# Seconds between broadcasts; detections arriving in between go out as one batch
+EMIT_INTERVAL = 0.25
+
+# Detections kept for batches and snapshots (ring buffer)
+BUFFER_SIZE = 1000
+
+# Detections sent in a snapshot and by /api/detections
+RECENT_LIMIT = 50
+
+# A client that hasn't acknowledged a batch within this many seconds is
+# considered stalled and gets a snapshot once it answers again
+ACK_TIMEOUT = 10
+
+# Detections from all Pis are parsed and stored in the database by the
+# ingestion workers, which also keep per-device and per-class totals
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), FLEET_DB_PATH)
+ingestor = FleetIngestor(DetectionStore(DB_PATH))
+
+# Received detections as (seq, data), oldest first; ingestion only appends
+# here, the emitter thread does all the Socket.IO work
+detection_buffer = deque(maxlen=BUFFER_SIZE)
+detection_seq = 0
+buffer_lock = threading.Lock()
+
+# Delivery state per connected browser (keyed by Socket.IO session id)
+clients = {}
+clients_lock = threading.Lock()
+
+def record_detections(device, detections):
+    """Ingestion listener: queue stored detections for the next broadcast"""
+    global detection_seq
+    with buffer_lock:
+        for data in detections:
+            data.setdefault('device', device)
+            detection_seq += 1
+            detection_buffer.append((detection_seq, data))
+
+ingestor.listeners.append(record_detections)
 
 def start_mqtt():
-    print("Connecting to broker.hivemq.com...")
-    mqtt_client.connect("broker.hivemq.com", 1883, 60)
+    print(f"Connecting to {DEFAULT_BROKER}...")
+    mqtt_client = connect_fleet(ingestor, DEFAULT_BROKER)
     mqtt_client.loop_forever()
 
+def fleet_state():
+    """Class totals and device liveness across the fleet"""
+    stats = ingestor.stats.snapshot()
+    return {'stats': stats['class_counts'], 'devices': stats['devices']}
+
+def snapshot():
+    """Latest state: newest detections first, totals, devices and sequence number"""
+    state = fleet_state()
+    with buffer_lock:
+        state['recent'] = [data for _, data in islice(reversed(detection_buffer), RECENT_LIMIT)]
+        state['seq'] = detection_seq
+    return state
+
+def detections_since(seq):
+    """Batch of detections after seq, or None if they left the ring buffer"""
+    state = fleet_state()
+    with buffer_lock:
+        if detection_buffer and detection_buffer[0][0] > seq + 1:
+            return None
+        state['detections'] = [data for s, data in detection_buffer if s > seq]
+        state['seq'] = detection_seq
+    return state
+
+def make_ack(sid):
+    """Ack callback marking a client ready for the next batch"""
+    def ack(*args):
+        with clients_lock:
+            state = clients.get(sid)
+            if state is not None:
+                state['waiting'] = False
+    return ack
+
+def broadcast_tick():
+    """Send each ready client what it missed since its last batch
+
+    Events:
+      detections - detections since the client's last batch, plus totals
+      snapshot   - latest state, for clients that fell too far behind
+    A client gets nothing new until it acknowledges the previous event, so
+    slow browsers never build up a queue of batches.
+    """
+    with buffer_lock:
+        current_seq = detection_seq
+
+    now = time.time()
+    payloads = {}
+    sends = []
+    with clients_lock:
+        for sid, state in clients.items():
+            if state['waiting']:
+                if now - state['sent_at'] < ACK_TIMEOUT:
+                    continue
+                # Batch or ack lost: resume with a snapshot
+                state['waiting'] = False
+                state['stale'] = True
+            if state['seq'] == current_seq and not state['stale']:
+                continue
+
+            # Clients at the same position share one serialized batch
+            key = 'snapshot' if state['stale'] else state['seq']
+            if key not in payloads:
+                batch = None if state['stale'] else detections_since(state['seq'])
+                payloads[key] = ('detections', batch) if batch else ('snapshot', snapshot())
+            event, payload = payloads[key]
+
+            state.update(waiting=True, stale=False, sent_at=now, seq=payload['seq'])
+            sends.append((sid, event, payload))
+
+    for sid, event, payload in sends:
+        socketio.emit(event, payload, namespace='/dashboard', to=sid, callback=make_ack(sid))
+
+def emitter_loop():
+    """Broadcast new detections every EMIT_INTERVAL"""
+    while True:
+        socketio.sleep(EMIT_INTERVAL)
+        try:
+            broadcast_tick()
+        except Exception as e:
+            print(f"Error broadcasting detections: {e}")
+
 @app.route('/')
 def index():
     return render_template('dashboard.html')
 
 @app.route('/api/detections')
 def get_detections():
+    state = snapshot()
     return jsonify({
-        'recent': recent_detections[:50],
-        'stats': dict(detection_stats)
+        'recent': state['recent'],
+        'stats': state['stats'],
+        'devices': state['devices']
     })
 
 @socketio.on('connect', namespace='/dashboard')
 def handle_connect():
     print('Client connected')
-    emit('initial_data', {
-        'recent': recent_detections[:50],
-        'stats': dict(detection_stats)
-    })
+    state = snapshot()
+    with clients_lock:
+        clients[request.sid] = {'seq': state['seq'], 'waiting': False,
+                                'stale': False, 'sent_at': 0}
+    emit('initial_data', state)
+
+@socketio.on('disconnect', namespace='/dashboard')
+def handle_disconnect(*args):
+    with clients_lock:
+        clients.pop(request.sid, None)
 
 if __name__ == '__main__':
-    # Start MQTT in a separate thread
+    # Start ingestion workers and MQTT in a separate thread
+    ingestor.start()
     mqtt_thread = threading.Thread(target=start_mqtt, daemon=True)
     mqtt_thread.start()
-    
+
+    # Batched broadcasting to browsers
+    socketio.start_background_task(emitter_loop)
+
     print("Starting dashboard server on http://localhost:5000")
     socketio.run(app, host='0.0.0.0', port=5000, debug=True, allow_unsafe_werkzeug=True)
@@ -1,117 +1,477 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, Response
 import json
 import os
 import glob
-import shutil
+import threading
+import time
 from datetime import datetime
+from itertools import chain, islice
+from detection_cache import DetectionCache, has_gps, iter_records
+from detection_store import DetectionStore, decode_cursor
+from detection_tiles import TileAggregator
+from detection_stats import DetectionStats
+import session_archive
+from preview_stream import PreviewStream, PREVIEW_FPS, BOUNDARY
+import http_cache
 
 app = Flask(__name__)
+http_cache.init_app(app)
 
 # Get the project root directory
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 
+# Compressed archive of old detection files
+ARCHIVE_PATH = os.path.join(PROJECT_ROOT, session_archive.ARCHIVE_DIR)
+
+# Parsed detection files shared by all endpoints; only new records are
+# parsed when a file grows
+detection_cache = DetectionCache()
+
+# Map clusters and statistics for the current session, updated as
+# detections arrive
+session_tiles = TileAggregator()
+session_stats = DetectionStats()
+
+# Live camera preview from inference_pi.py (encoded only while watched)
+preview = PreviewStream()
+
+# Most recent detections sent when a stream (re)starts; older ones are
+# shown on the map as clusters
+SNAPSHOT_LIMIT = 500
+
+# Detection database written by inference_pi.py (opened on first query)
+detection_store = None
+
+def get_detection_store():
+    """Get the shared detection database"""
+    global detection_store
+    if detection_store is None:
+        detection_store = DetectionStore(os.path.join(PROJECT_ROOT, 'detections.db'))
+    return detection_store
+
 def get_current_session_file():
     """Get the current session detection file"""
     return os.path.join(PROJECT_ROOT, 'current_session.json')
 
-def load_detections(filename=None):
-    """Load detections from JSON file"""
+def get_view(filename=None):
+    """Get the cached view of a detection file (current session by default)"""
     if not filename:
         filename = get_current_session_file()
-    
-    if not filename or not os.path.exists(filename):
-        return []
-    
+    return detection_cache.get(filename)
+
+def load_detections(filename=None):
+    """Load detections with valid GPS coordinates"""
+    return list(get_view(filename).gps_records)
+
+def view_version(view):
+    """Data version of a detection view, used for ETags"""
+    return (view.path, view.generation, len(view.records))
+
+# Single background poller for the current session; stream clients wait on
+# the cache instead of each re-reading the file
+_watcher_lock = threading.Lock()
+_watcher_started = False
+
+def watch_current_session(interval=0.5):
+    """Background thread: refresh the current session view periodically"""
+    while True:
+        get_view()
+        time.sleep(interval)
+
+def ensure_session_watcher():
+    """Start the current session watcher on first use"""
+    global _watcher_started
+    with _watcher_lock:
+        if not _watcher_started:
+            detection_cache.pin(get_current_session_file())
+            threading.Thread(target=watch_current_session, daemon=True).start()
+            _watcher_started = True
+
+def session_key(records):
+    """Identity of a session that survives server restarts (view generations
+    restart at 1): its first detection's time in milliseconds"""
     try:
-        with open(filename, 'r') as f:
-            detections = json.load(f)
-        
-        # Filter detections with valid GPS coordinates
-        valid_detections = []
-        for det in detections:
-            if det.get('location') and det['location'].get('latitude') and det['location'].get('longitude'):
-                valid_detections.append(det)
-        
-        return valid_detections
-    except Exception as e:
-        print(f"Error loading detections: {e}")
-        return []
+        return str(int(float(records[0]['timestamp']) * 1000))
+    except (IndexError, KeyError, TypeError, ValueError):
+        return '0'
+
+def make_cursor(records, generation, count):
+    """Stream cursor for the first count records of a view generation"""
+    return f"{session_key(records)}-{generation}-{count}"
+
+def parse_cursor(cursor):
+    """Parse a '<session>-<generation>-<count>' stream cursor"""
+    try:
+        session, generation, count = cursor.split('-')
+        return session, int(generation), int(count)
+    except (AttributeError, ValueError):
+        return None, None, None
+
+def sse_event(event, data, event_id=None):
+    """Format one server-sent event"""
+    message = ''
+    if event_id:
+        message += f"id: {event_id}\n"
+    return message + f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def recent_gps_detections(records, count, limit=SNAPSHOT_LIMIT):
+    """The newest GPS detections among the first count records, oldest first"""
+    recent = []
+    for det in reversed(records[:count]):
+        if has_gps(det):
+            recent.append(det)
+            if len(recent) >= limit:
+                break
+    recent.reverse()
+    return recent
+
+def latest_location(records):
+    """Location of the most recent detection with GPS data"""
+    for det in reversed(records):
+        if has_gps(det):
+            return det['location']
+    return None
 
 @app.route('/')
 def index():
     """Main dashboard with map and detection list"""
     return render_template('dashboard.html')
 
+def select_detections(records, since=None, limit=None):
+    """GPS detections newer than since, at most limit of them"""
+    selected = (det for det in records if has_gps(det) and
+                (since is None or det.get('timestamp', 0) > since))
+    return islice(selected, limit) if limit is not None else selected
+
+def json_array_chunks(records, head='[', tail=lambda count: ']'):
+    """Serialize records as a JSON array a few hundred at a time
+
+    tail(count) is called after the last record, so a total can follow the
+    array without holding the records in memory.
+    """
+    buffer = [head]
+    count = 0
+    for det in records:
+        buffer.append((',' if count else '') + json.dumps(det))
+        count += 1
+        if len(buffer) >= 500:
+            yield ''.join(buffer)
+            buffer = []
+    buffer.append(tail(count))
+    yield ''.join(buffer)
+
 @app.route('/api/detections')
 def get_detections():
-    """API endpoint to get all detections with GPS data"""
+    """API endpoint to get all detections with GPS data
+
+    Optional parameters: file (a detection file, streamed from disk),
+    since (unix timestamp), limit (maximum number of detections)
+    """
     filename = request.args.get('file')
-    detections = load_detections(filename)
-    
-    return jsonify({
-        'detections': detections,
-        'total': len(detections)
+    since = request.args.get('since', type=float)
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 0:
+        return jsonify({'error': 'limit must not be negative'}), 400
+
+    if not filename:
+        # Current session: already parsed by the shared cache
+        view = get_view()
+        def build():
+            detections = list(select_detections(view.gps_records, since, limit))
+            return {'detections': detections, 'total': len(detections)}
+        return http_cache.cached_json(view_version(view), build)
+
+    # Session files can be hours long: parse, filter and send them in
+    # chunks instead of building the whole list in memory
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return jsonify({'detections': [], 'total': 0})
+
+    records = select_detections(iter_records(filename), since, limit)
+    chunks = json_array_chunks(records, head='{"detections":[',
+                               tail=lambda count: f'],"total":{count}}}')
+    return http_cache.streamed(chunks, version=(st.st_mtime, st.st_size))
+
+@app.route('/api/stream')
+def stream_detections():
+    """Server-sent events stream of new detections and location changes
+
+    Events:
+      reset      - newest GPS detections and session totals (first connect or
+                   new session)
+      detections - only the detections added since the last event
+      location   - current location when it changes
+    Every event carries a cursor as its id; EventSource sends it back as
+    Last-Event-ID on reconnect so the stream resumes without a full reload.
+    """
+    ensure_session_watcher()
+    session_file = get_current_session_file()
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('cursor')
+    session, generation, count = parse_cursor(cursor)
+
+    def reset_event():
+        """Recent detections plus session totals for a (re)starting client"""
+        nonlocal generation, count
+        summary = session_tiles.sync(get_view())
+        generation, count = summary['generation'], summary['count']
+        snapshot = recent_gps_detections(summary['records'], count)
+        event = sse_event('reset', {
+            'detections': snapshot,
+            'total': summary['total'],
+            # Session tiles only aggregate detections with a GPS fix
+            'with_gps': summary['total'],
+            'class_counts': summary['class_counts']
+        }, make_cursor(summary['records'], generation, count))
+        return event, snapshot
+
+    def generate():
+        nonlocal generation, count
+        view = get_view()
+        records = view.records
+        last_location = None
+
+        if (session != session_key(records) or generation != view.generation
+                or count > len(records)):
+            # Unknown or stale cursor (or another session, e.g. from before a
+            # server restart): start from a session snapshot
+            event, new_records = reset_event()
+            yield event
+        else:
+            # Resume: send only what was missed while disconnected
+            new_records = [det for det in records[count:] if has_gps(det)]
+            count = len(records)
+            if new_records:
+                yield sse_event('detections', {'detections': new_records},
+                                make_cursor(records, generation, count))
+
+        location = latest_location(new_records)
+        if location:
+            last_location = location
+            yield sse_event('location', location)
+
+        while True:
+            change = detection_cache.wait_for_change(session_file, generation, count, timeout=15)
+            if change is None:
+                yield ": keepalive\n\n"
+                continue
+
+            new_generation, records = change
+            if new_generation == generation and len(records) == count:
+                # Keep the connection alive through proxies
+                yield ": keepalive\n\n"
+                continue
+
+            if new_generation != generation:
+                # New inference session started
+                event, new_records = reset_event()
+                yield event
+            else:
+                new_records = [det for det in records[count:] if has_gps(det)]
+                count = len(records)
+                if new_records:
+                    yield sse_event('detections', {'detections': new_records},
+                                    make_cursor(records, generation, count))
+
+            location = latest_location(new_records)
+            if location and location != last_location:
+                last_location = location
+                yield sse_event('location', location)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def parse_bbox(value):
+    """Parse a 'min_lon,min_lat,max_lon,max_lat' query parameter"""
+    bbox = [float(v) for v in value.split(',')]
+    if len(bbox) != 4:
+        raise ValueError("bbox must be min_lon,min_lat,max_lon,max_lat")
+    return bbox
+
+@app.route('/api/clusters')
+def get_clusters():
+    """Detection clusters with per-class counts for the visible map area
+
+    Parameters: zoom, bbox (min_lon,min_lat,max_lon,max_lat)
+    """
+    try:
+        zoom = request.args.get('zoom', type=int)
+        if zoom is None:
+            raise ValueError("zoom is required")
+        bbox = parse_bbox(request.args.get('bbox', ''))
+        view = get_view()
+        session_tiles.sync(view)
+        zoom, clusters = session_tiles.clusters(zoom, bbox)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return http_cache.cached_json(view_version(view), lambda: {
+        'zoom': zoom,
+        'clusters': clusters,
+        'total': len(clusters)
     })
 
-@app.route('/api/detection-files')
-def get_detection_files():
-    """Get list of available detection files"""
-    detection_files = glob.glob(os.path.join(PROJECT_ROOT, 'detections_*.json'))
-    
+@app.route('/api/tiles/<int:zoom>/<int:x>/<int:y>.json')
+def get_tile(zoom, x, y):
+    """Detection clusters inside one map tile (heatmap/cluster layer)"""
+    view = get_view()
+    session_tiles.sync(view)
+    return http_cache.cached_json(view_version(view), lambda: {
+        'clusters': session_tiles.tile(zoom, x, y)
+    })
+
+@app.route('/api/query/detections')
+def query_detections():
+    """Query the detection database
+
+    Parameters (all optional):
+      start, end - unix timestamps
+      bbox       - min_lon,min_lat,max_lon,max_lat
+      class      - comma-separated class names
+      session    - session name
+      limit      - page size
+      cursor     - next_cursor from the previous page
+      order      - asc (default) or desc
+    """
+    args = request.args
+    try:
+        bbox = parse_bbox(args['bbox']) if args.get('bbox') else None
+        classes = [c for c in args.get('class', '').split(',') if c]
+        cursor = args.get('cursor')
+        if cursor:
+            decode_cursor(cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    store = get_detection_store()
+
+    def build():
+        detections, next_cursor = store.query(
+            start=args.get('start', type=float),
+            end=args.get('end', type=float),
+            bbox=bbox,
+            classes=classes,
+            session=args.get('session'),
+            cursor=cursor,
+            limit=args.get('limit', 500, type=int),
+            descending=args.get('order') == 'desc'
+        )
+        return {
+            'detections': detections,
+            'count': len(detections),
+            'next_cursor': next_cursor
+        }
+
+    # Results only change when detections are added to the database
+    return http_cache.cached_json(store.version(), build)
+
+# Listing of detections_*.json files, refreshed when any of them changes
+_live_files_cache = (None, [])
+
+def list_live_files():
+    """Detection files not yet archived (cached by each file's stat, since
+    appending to a file doesn't change the directory's mtime)"""
+    global _live_files_cache
+    entries = []
+    for entry in os.scandir(PROJECT_ROOT):
+        if entry.name.startswith('detections_') and entry.name.endswith('.json'):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((entry, st))
+    entries.sort(key=lambda item: item[0].name)
+    key = tuple((entry.name, st.st_mtime_ns, st.st_size) for entry, st in entries)
+    if _live_files_cache[0] == key:
+        return _live_files_cache[1]
+
     files_info = []
-    for filepath in detection_files:
-        filename = os.path.basename(filepath)
+    for entry, st in entries:
+        filename = entry.name
         # Extract timestamp from filename
         try:
             timestamp = int(filename.replace('detections_', '').replace('.json', ''))
             date_str = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
-        except:
+        except ValueError:
+            timestamp = 0
             date_str = 'Unknown'
-        
+
         files_info.append({
             'filename': filename,
-            'filepath': filepath,
+            'filepath': entry.path,
             'date': date_str,
-            'size': os.path.getsize(filepath)
+            'size': st.st_size,
+            'archived': False,
+            'timestamp': timestamp
         })
-    
+
+    _live_files_cache = (key, files_info)
+    return files_info
+
+@app.route('/api/detection-files')
+def get_detection_files():
+    """Get list of available detection files and archived sessions"""
+    live_files = list_live_files()
+    index_path = os.path.join(ARCHIVE_PATH, session_archive.INDEX_FILE)
+    index_mtime = os.path.getmtime(index_path) if os.path.exists(index_path) else None
+    version = (_live_files_cache[0], index_mtime)
+    return http_cache.cached_json(version, lambda: detection_files_payload(live_files))
+
+def detection_files_payload(live_files):
+    """Build the detection file listing"""
+    files_info = list(live_files)
+
+    for session in session_archive.list_sessions(ARCHIVE_PATH):
+        start = session['start']
+        files_info.append({
+            'filename': session['file'],
+            'session': session['session'],
+            'date': datetime.fromtimestamp(start).strftime('%Y-%m-%d %H:%M:%S') if start else 'Unknown',
+            'size': session['size'],
+            'count': session['count'],
+            'start': start,
+            'end': session['end'],
+            'class_counts': session['class_counts'],
+            'archived': True,
+            'timestamp': start or 0
+        })
+
     # Sort by date descending
-    files_info.sort(key=lambda x: x['filename'], reverse=True)
-    
-    return jsonify({
+    files_info.sort(key=lambda x: x['timestamp'], reverse=True)
+
+    return {
         'files': files_info,
         'total': len(files_info)
-    })
+    }
+
+@app.route('/api/archive/<session>')
+def stream_archived_session(session):
+    """Stream an archived session as a JSON array, one chunk at a time
+
+    Optional parameters: start, end (unix timestamps)
+    """
+    start = request.args.get('start', type=float)
+    end = request.args.get('end', type=float)
+    records = session_archive.iter_session(session, ARCHIVE_PATH, start=start, end=end)
+
+    try:
+        first = next(records, None)
+    except KeyError:
+        return jsonify({'error': f'Unknown session: {session}'}), 404
+
+    if first is not None:
+        records = chain([first], records)
+    return http_cache.streamed(json_array_chunks(records))
 
 @app.route('/api/stats')
 def get_stats():
-    """Get detection statistics"""
-    detections = load_detections()
-    
-    if not detections:
-        return jsonify({
-            'total_detections': 0,
-            'disease_counts': {},
-            'gps_enabled_count': 0
-        })
-    
-    # Calculate statistics
-    disease_counts = {}
-    gps_enabled = 0
-    
-    for det in detections:
-        class_name = det.get('class', 'unknown')
-        disease_counts[class_name] = disease_counts.get(class_name, 0) + 1
-        
-        if det.get('location'):
-            gps_enabled += 1
-    
-    return jsonify({
-        'total_detections': len(detections),
-        'disease_counts': disease_counts,
-        'gps_enabled_count': gps_enabled,
-        'latest_detection': detections[-1] if detections else None
-    })
+    """Get detection statistics (all detections, with or without GPS)"""
+    view = get_view()
+    session_stats.sync(view)
+    # Rolling windows move with the clock, so the version includes the second
+    now = int(time.time())
+    return http_cache.cached_json((view_version(view), now),
+                                  lambda: session_stats.snapshot(now))
 
 @app.route('/api/clear-detections', methods=['POST'])
 def clear_detections():
@@ -126,22 +486,26 @@ def clear_detections():
                 'archived_count': 0
             })
         
-        # Create archive directory
-        archive_dir = os.path.join(PROJECT_ROOT, f"detections_archive_{int(datetime.now().timestamp())}")
-        os.makedirs(archive_dir, exist_ok=True)
-        
-        # Move files to archive
+        # Compress each file into the session archive; files that couldn't
+        # be fully parsed are kept
         archived_count = 0
+        kept = []
         for file in detection_files:
-            dest = os.path.join(archive_dir, os.path.basename(file))
-            shutil.move(file, dest)
-            archived_count += 1
+            entry = session_archive.archive_file(file, ARCHIVE_PATH)
+            if entry['leftover_bytes']:
+                kept.append(os.path.basename(file))
+            else:
+                archived_count += 1
         
+        message = f'Archived {archived_count} detection file(s)'
+        if kept:
+            message += f"; kept {', '.join(kept)} (could not be fully parsed)"
         return jsonify({
             'success': True,
-            'message': f'Archived {archived_count} detection file(s)',
+            'message': message,
             'archived_count': archived_count,
-            'archive_dir': os.path.basename(archive_dir)
+            'kept': kept,
+            'archive_dir': session_archive.ARCHIVE_DIR
         })
     
     except Exception as e:
@@ -150,34 +514,64 @@ def clear_detections():
             'message': str(e)
         }), 500
 
+@app.route('/api/preview.mjpg')
+def stream_preview():
+    """MJPEG stream of the annotated camera frames
+
+    Optional parameter: fps (default 5, capped by the encoder)
+    """
+    if not preview.available():
+        return jsonify({'error': 'Preview not available (inference_pi.py not running on this host)'}), 503
+
+    fps = request.args.get('fps', default=PREVIEW_FPS, type=float)
+    return Response(preview.frames(fps), mimetype=f'multipart/x-mixed-replace; boundary={BOUNDARY}',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/current-location')
 def get_current_location():
     """Get current GPS location from the latest detection"""
-    detections = load_detections()
+    view = get_view()
+    return http_cache.cached_json(view_version(view), lambda: current_location(view))
+
+def current_location(view):
+    """Location of the latest GPS detection in a view"""
+    detections = view.gps_records
     
     if detections and len(detections) > 0:
         # Get the most recent detection with GPS data
         latest = detections[-1]
         location = latest.get('location')
         if location:
-            return jsonify(location)
+            return location
     
-    return jsonify({
+    return {
         'latitude': None,
         'longitude': None,
         'altitude': None,
         'satellites': 0
-    })
+    }
 
 if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Plant Disease Detection Dashboard')
+    parser.add_argument('--port', type=int, default=5000,
+                       help='Port to listen on (default: 5000)')
+    parser.add_argument('--threads', type=int, default=16,
+                       help='Server threads; each open dashboard stream uses one (default: 16)')
+    parser.add_argument('--debug', action='store_true',
+                       help='Run the Flask development server with debug/reload enabled')
+    args = parser.parse_args()
+
     print("=" * 60)
     print("Plant Disease Detection Dashboard")
     print("=" * 60)
-    print("Starting server on http://0.0.0.0:5000")
+    print(f"Starting server on http://0.0.0.0:{args.port}")
     print("Access from browser at:")
-    print("  - Local: http://localhost:5000")
-    print("  - Network: http://raspberrypi.local:5000")
-    print("  - Or: http://<pi-ip>:5000")
+    print(f"  - Local: http://localhost:{args.port}")
+    print(f"  - Network: http://raspberrypi.local:{args.port}")
+    print(f"  - Or: http://<pi-ip>:{args.port}")
     print("=" * 60)
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    http_cache.run_server(app, host='0.0.0.0', port=args.port, debug=args.debug,
+                          threads=args.threads)
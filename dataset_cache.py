@@ -0,0 +1,295 @@
+"""
+Preprocessed Dataset Cache
+Decodes and resizes the training images once into a single memory-mapped
+file of fixed-size uint8 slots (plus labels), so training epochs read
+ready-made 416 images instead of re-decoding full-size JPEGs. The cache is
+rebuilt in parallel, and only for images whose content hash changed.
+"""
+
+import hashlib
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+CACHE_VERSION = 1
+
+# Padding value of the unused part of each slot (YOLO letterbox gray)
+PAD_VALUE = 114
+
+# Images per task handed to a build worker
+BUILD_CHUNK = 32
+
+
+def cache_paths(image_dir, imgsz):
+    """(data file, manifest file) for an image directory"""
+    base = os.path.normpath(image_dir) + f'_{imgsz}'
+    return base + '.memmap', base + '.json'
+
+
+def label_path(image_path):
+    """YOLO label file for an image (images/x.jpg -> labels/x.txt)"""
+    directory, name = os.path.split(image_path)
+    labels_dir = os.path.join(os.path.dirname(directory), 'labels')
+    return os.path.join(labels_dir, os.path.splitext(name)[0] + '.txt')
+
+
+def content_hash(image_path, labels_path):
+    """Hash of an image file and its label file"""
+    h = hashlib.sha1()
+    with open(image_path, 'rb') as f:
+        h.update(f.read())
+    h.update(b'\0')
+    if os.path.exists(labels_path):
+        with open(labels_path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def read_labels(labels_path):
+    """YOLO labels as an (n, 5) float32 array of class, x, y, w, h"""
+    if not os.path.exists(labels_path):
+        return np.zeros((0, 5), dtype=np.float32)
+    rows = []
+    with open(labels_path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 5:
+                rows.append([float(v) for v in parts[:5]])
+    return np.array(rows, dtype=np.float32).reshape(-1, 5)
+
+
+def resize_long_side(im, imgsz, interpolation=cv2.INTER_LINEAR):
+    """Resize so the long side is imgsz, keeping the aspect ratio
+
+    Matches ultralytics' load_image, so cached images are interchangeable
+    with freshly decoded ones.
+    """
+    h0, w0 = im.shape[:2]
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        w, h = min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz)
+        im = cv2.resize(im, (w, h), interpolation=interpolation)
+    return im
+
+
+def _encode_chunk(args):
+    """Build worker: decode, resize and store a range of images"""
+    data_path, count, imgsz, interpolation, items = args
+    images = np.memmap(data_path, dtype=np.uint8, mode='r+', shape=(count, imgsz, imgsz, 3))
+    shapes = []
+    for index, image_path in items:
+        im = cv2.imread(image_path)
+        if im is None:
+            raise ValueError(f"Cannot read image: {image_path}")
+        h0, w0 = im.shape[:2]
+        im = resize_long_side(im, imgsz, interpolation)
+        h, w = im.shape[:2]
+        # Image in the top-left corner, padding to the right and bottom
+        slot = images[index]
+        slot[:h, :w] = im
+        slot[h:, :] = PAD_VALUE
+        slot[:h, w:] = PAD_VALUE
+        shapes.append((index, (h0, w0), (h, w)))
+    images.flush()
+    del images
+    return shapes
+
+
+class DatasetCache:
+    """Memory-mapped cache of one image directory at one image size
+
+    File layout: N slots of imgsz x imgsz x 3 uint8 (BGR), then all labels as
+    float32 rows. The JSON manifest holds file names, content hashes, image
+    shapes and label offsets, and is written last, so an interrupted build
+    is never mistaken for a valid cache.
+    """
+
+    def __init__(self, image_dir, imgsz=416, interpolation=cv2.INTER_LINEAR):
+        self.image_dir = image_dir
+        self.imgsz = imgsz
+        self.interpolation = interpolation
+        self.data_path, self.manifest_path = cache_paths(image_dir, imgsz)
+        self.manifest = None
+        self._index = {}
+        self._images = None
+        self._labels = None
+
+    def __getstate__(self):
+        # Dataloader workers re-open the memmap instead of pickling its data
+        state = self.__dict__.copy()
+        state['_images'] = None
+        state['_labels'] = None
+        return state
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (manifest.get('version') != CACHE_VERSION or manifest.get('imgsz') != self.imgsz or
+                manifest.get('interpolation') != self.interpolation or
+                not os.path.exists(self.data_path)):
+            return None
+        return manifest
+
+    def _use(self, manifest):
+        self.manifest = manifest
+        self._index = {name: i for i, name in enumerate(manifest['files'])}
+        self._images = None
+        self._labels = None
+
+    def build(self, image_files, workers=None):
+        """Make the cache match image_files, re-encoding only changed images
+
+        Returns the number of images (re)encoded.
+        """
+        image_files = [os.path.abspath(p) for p in image_files]
+        names = [os.path.relpath(p, self.image_dir) for p in image_files]
+        labels_paths = [label_path(p) for p in image_files]
+        workers = workers or os.cpu_count() or 1
+
+        with ThreadPoolExecutor(max_workers=min(16, workers * 2)) as pool:
+            hashes = list(pool.map(content_hash, image_files, labels_paths))
+
+        manifest = self._load_manifest()
+        if manifest and manifest['files'] == names:
+            stale = [i for i, (old, new) in enumerate(zip(manifest['hashes'], hashes)) if old != new]
+            if not stale:
+                self._use(manifest)
+                return 0
+        else:
+            # Different file list or image size: start over
+            stale = list(range(len(image_files)))
+            manifest = None
+
+        count = len(image_files)
+        slot_bytes = self.imgsz * self.imgsz * 3
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+        mode = 'r+b' if manifest else 'wb'
+        with open(self.data_path, mode) as f:
+            f.truncate(count * slot_bytes)
+
+        shapes0 = manifest['shapes0'] if manifest else [None] * count
+        shapes = manifest['shapes'] if manifest else [None] * count
+        chunks = [(self.data_path, count, self.imgsz, self.interpolation,
+                   [(i, image_files[i]) for i in stale[start:start + BUILD_CHUNK]])
+                  for start in range(0, len(stale), BUILD_CHUNK)]
+        if chunks:
+            if workers > 1 and len(chunks) > 1:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    results = list(pool.map(_encode_chunk, chunks))
+            else:
+                results = [_encode_chunk(chunk) for chunk in chunks]
+            for result in results:
+                for index, shape0, shape in result:
+                    shapes0[index] = list(shape0)
+                    shapes[index] = list(shape)
+
+        # Labels are small: always rewrite them after the image slots
+        labels = [read_labels(p) for p in labels_paths]
+        offsets = np.cumsum([0] + [len(l) for l in labels]).tolist()
+        all_labels = (np.concatenate(labels) if labels else
+                      np.zeros((0, 5), dtype=np.float32)).astype(np.float32)
+        with open(self.data_path, 'r+b') as f:
+            f.seek(count * slot_bytes)
+            f.truncate()
+            f.write(all_labels.tobytes())
+
+        manifest = {
+            'version': CACHE_VERSION,
+            'imgsz': self.imgsz,
+            'interpolation': self.interpolation,
+            'files': names,
+            'hashes': hashes,
+            'shapes0': shapes0,
+            'shapes': shapes,
+            'label_offsets': offsets
+        }
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+        self._use(manifest)
+        return len(stale)
+
+    def _open(self):
+        if self._images is None:
+            count = len(self.manifest['files'])
+            self._images = np.memmap(self.data_path, dtype=np.uint8, mode='r',
+                                     shape=(count, self.imgsz, self.imgsz, 3))
+            num_labels = self.manifest['label_offsets'][-1]
+            self._labels = np.memmap(self.data_path, dtype=np.float32, mode='r',
+                                     offset=count * self.imgsz * self.imgsz * 3,
+                                     shape=(num_labels, 5)) if num_labels else np.zeros((0, 5), np.float32)
+
+    def __len__(self):
+        return len(self.manifest['files']) if self.manifest else 0
+
+    def index_of(self, image_path):
+        """Slot index of an image file, or None if it isn't cached"""
+        return self._index.get(os.path.relpath(os.path.abspath(image_path), self.image_dir))
+
+    def image(self, index):
+        """(resized image copy, original (h, w)) for a slot"""
+        self._open()
+        h, w = self.manifest['shapes'][index]
+        return np.array(self._images[index, :h, :w]), tuple(self.manifest['shapes0'][index])
+
+    def letterboxed(self, index):
+        """The full imgsz x imgsz slot (image top-left, padded)"""
+        self._open()
+        return self._images[index]
+
+    def labels(self, index):
+        """(n, 5) labels of a slot: class, x, y, w, h (normalized)"""
+        self._open()
+        start, end = self.manifest['label_offsets'][index:index + 2]
+        return np.array(self._labels[start:end])
+
+
+def open_cache(image_files, imgsz=416, interpolation=cv2.INTER_LINEAR, workers=None):
+    """Build or refresh the cache for a list of images from one directory"""
+    image_dir = os.path.dirname(os.path.abspath(image_files[0]))
+    cache = DatasetCache(image_dir, imgsz, interpolation)
+    updated = cache.build(image_files, workers=workers)
+    if updated:
+        print(f"Dataset cache: encoded {updated} image(s) into {cache.data_path}")
+    else:
+        print(f"Dataset cache: {len(cache)} image(s) up to date in {cache.data_path}")
+    return cache
+
+
+def list_images(image_dir):
+    """Image files in a directory, sorted"""
+    exts = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+    return sorted(os.path.join(image_dir, name) for name in os.listdir(image_dir)
+                  if name.lower().endswith(exts))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build the preprocessed dataset cache')
+    parser.add_argument('--data', type=str, default='data',
+                       help='Dataset directory (default: data)')
+    parser.add_argument('--imgsz', type=int, default=416,
+                       help='Image size (default: 416)')
+    parser.add_argument('--workers', type=int, default=None,
+                       help='Build processes (default: CPU count)')
+    args = parser.parse_args()
+
+    # Only training reads from the cache (see train.CachedDetectionTrainer)
+    image_dir = os.path.join(args.data, 'train', 'images')
+    if os.path.isdir(image_dir):
+        open_cache(list_images(image_dir), args.imgsz, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+"""
+Dataset Near-Duplicate Removal
+Hashes every image in data/*/images with perceptual hashes (in a process
+pool), clusters near-duplicates such as burst shots of the same plant,
+reports clusters that leak across the train/valid/test splits and writes a
+deduplicated, pre-resized copy of the dataset with its own data.yaml
+"""
+
+import json
+import os
+import shutil
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+import yaml
+
+from dataset_cache import label_path, list_images, read_labels, resize_long_side
+
+SPLITS = ['train', 'valid', 'test']
+DEFAULT_OUTPUT = 'data_dedup'
+
+# Combined pHash + dHash (128 bits) Hamming distance at or below which two
+# images are near-duplicates. On this dataset burst shots of the same plant
+# are within ~26 bits and distinct photos start above ~32.
+DEFAULT_THRESHOLD = 28
+
+# Images per task handed to a hashing or writing worker
+WORK_CHUNK = 32
+
+JPEG_QUALITY = 95
+
+# Written into every output directory; only directories holding it (or an
+# older run's dedup_report.json) are ever deleted
+MARKER_FILE = '.dedup_dataset'
+
+
+def perceptual_hash(gray):
+    """(pHash, dHash) of a grayscale image as two uint64 values
+
+    pHash: signs of the 8x8 low-frequency DCT of a 32x32 thumbnail against
+    their median; dHash: horizontal gradient signs of a 9x8 thumbnail.
+    """
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    dct = cv2.dct(small)[:8, :8].flatten()
+    phash = np.packbits(dct > np.median(dct[1:])).view('>u8')[0]
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    dhash = np.packbits(small[:, 1:] > small[:, :-1]).view('>u8')[0]
+    return int(phash), int(dhash)
+
+
+def _hash_chunk(image_files):
+    """Hash worker: (path, (phash, dhash), (h, w)) per readable image"""
+    results = []
+    for image_path in image_files:
+        # Quarter-resolution decode: hashes only look at a 32x32 thumbnail
+        gray = cv2.imread(image_path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        if gray is None:
+            continue
+        h, w = gray.shape[:2]
+        results.append((image_path, perceptual_hash(gray), (h * 4, w * 4)))
+    return results
+
+
+def _run_chunks(worker, items, workers):
+    """Map worker over WORK_CHUNK-sized slices of items, in a process pool
+    when there is more than one worker; returns the concatenated results"""
+    chunks = [items[i:i + WORK_CHUNK] for i in range(0, len(items), WORK_CHUNK)]
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(worker, chunks))
+    else:
+        results = [worker(chunk) for chunk in chunks]
+    return [item for result in results for item in result]
+
+
+def scan_dataset(data_dir='data', workers=None):
+    """Hash every image of every split
+
+    Returns a list of records: {'path', 'split', 'hash', 'shape', 'labels'}.
+    """
+    workers = workers or os.cpu_count() or 1
+    splits = {}
+    for split in SPLITS:
+        image_dir = os.path.join(data_dir, split, 'images')
+        if os.path.isdir(image_dir):
+            for image_path in list_images(image_dir):
+                splits[image_path] = split
+
+    records = []
+    for image_path, hashes, shape in _run_chunks(_hash_chunk, list(splits), workers):
+        records.append({
+            'path': image_path,
+            'split': splits[image_path],
+            'hash': hashes,
+            'shape': shape,
+            'labels': len(read_labels(label_path(image_path)))
+        })
+    return records
+
+
+def hamming_pairs(hashes, threshold, block=128):
+    """Index pairs (i, j), i < j, whose hashes differ in at most threshold bits
+
+    hashes is an (n, k) uint64 array; distances are summed over the k words.
+    Compared in row blocks, so memory stays at block x n x k words.
+    """
+    n = len(hashes)
+    pairs = []
+    for start in range(0, n, block):
+        diff = hashes[start:start + block, None, :] ^ hashes[None, :, :]
+        bits = np.unpackbits(diff.view(np.uint8), axis=-1).sum(axis=-1)
+        rows, cols = np.nonzero(bits <= threshold)
+        rows += start
+        keep = rows < cols
+        pairs.extend(zip(rows[keep].tolist(), cols[keep].tolist(), bits[rows[keep] - start, cols[keep]].tolist()))
+    return pairs
+
+
+def cluster(records, threshold=DEFAULT_THRESHOLD):
+    """Group near-duplicates (union-find over close pairs)
+
+    Returns clusters as lists of record indices, largest first, and the
+    matched pairs as (i, j, distance).
+    """
+    hashes = np.array([r['hash'] for r in records], dtype=np.uint64).reshape(len(records), -1)
+    pairs = hamming_pairs(hashes, threshold)
+
+    parent = list(range(len(records)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j, _ in pairs:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    groups = defaultdict(list)
+    for i in range(len(records)):
+        groups[find(i)].append(i)
+    clusters = sorted(groups.values(), key=lambda members: (-len(members), members[0]))
+    return clusters, pairs
+
+
+def choose_representative(records, members):
+    """Keep the image with the most labeled objects, then the largest one"""
+    return max(members, key=lambda i: (records[i]['labels'],
+                                       records[i]['shape'][0] * records[i]['shape'][1],
+                                       -i))
+
+
+def home_split(records, members):
+    """Split a cross-split cluster is moved into: where most of it already is"""
+    counts = defaultdict(int)
+    for i in members:
+        counts[records[i]['split']] += 1
+    return max(SPLITS, key=lambda split: (counts[split], -SPLITS.index(split)))
+
+
+def plan(records, clusters):
+    """One (record index, output split) per cluster, plus leakage details"""
+    keep = []
+    leaks = []
+    for members in clusters:
+        split = home_split(records, members)
+        keep.append((choose_representative(records, members), split))
+        splits = sorted({records[i]['split'] for i in members}, key=SPLITS.index)
+        if len(splits) > 1:
+            leaks.append({'splits': splits, 'kept_in': split,
+                          'files': [os.path.relpath(records[i]['path']) for i in members]})
+    return keep, leaks
+
+
+def _write_chunk(items):
+    """Write worker: resize and re-encode images, copy their labels"""
+    written = []
+    for src, dst, imgsz in items:
+        im = cv2.imread(src)
+        if im is None:
+            continue
+        if max(im.shape[:2]) > imgsz:
+            # INTER_AREA for downscaling; never upscale small images
+            im = resize_long_side(im, imgsz, cv2.INTER_AREA)
+        cv2.imwrite(dst, im, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        src_labels = label_path(src)
+        if os.path.exists(src_labels):
+            shutil.copyfile(src_labels, label_path(dst))
+        written.append(dst)
+    return written
+
+
+def check_output_dir(data_dir, output_dir):
+    """Raise ValueError unless output_dir is safe to replace
+
+    It must not be, contain or lie inside the source dataset, and an existing
+    non-empty directory must be one this tool wrote.
+    """
+    data = os.path.realpath(data_dir)
+    output = os.path.realpath(output_dir)
+    if os.path.commonpath([data, output]) in (data, output):
+        raise ValueError(f"Output {output_dir} overlaps the dataset {data_dir}")
+    if os.path.isdir(output_dir) and os.listdir(output_dir) and not any(
+            os.path.exists(os.path.join(output_dir, name))
+            for name in (MARKER_FILE, 'dedup_report.json')):
+        raise ValueError(f"{output_dir} exists and wasn't written by dedup_dataset.py")
+
+
+def write_dataset(records, keep, data_dir='data', output_dir=DEFAULT_OUTPUT, imgsz=416, workers=None):
+    """Write the kept images (resized so the long side is imgsz) and data.yaml
+
+    Labels are normalized YOLO boxes, so they are copied unchanged.
+    """
+    workers = workers or os.cpu_count() or 1
+    check_output_dir(data_dir, output_dir)
+    if os.path.isdir(output_dir):
+        shutil.rmtree(output_dir)
+    os.makedirs(output_dir)
+    open(os.path.join(output_dir, MARKER_FILE), 'w').close()
+
+    items = []
+    for index, split in keep:
+        for sub in ('images', 'labels'):
+            os.makedirs(os.path.join(output_dir, split, sub), exist_ok=True)
+        src = records[index]['path']
+        name = os.path.splitext(os.path.basename(src))[0] + '.jpg'
+        items.append((src, os.path.join(output_dir, split, 'images', name), imgsz))
+    written = _run_chunks(_write_chunk, items, workers)
+
+    with open(os.path.join(data_dir, 'data.yaml')) as f:
+        data = yaml.safe_load(f)
+    dedup_yaml = {
+        'path': os.path.abspath(output_dir),
+        'train': 'train/images',
+        'val': 'valid/images',
+        'nc': data.get('nc', len(data.get('names', []))),
+        'names': data.get('names', [])
+    }
+    if os.path.isdir(os.path.join(output_dir, 'test', 'images')):
+        dedup_yaml['test'] = 'test/images'
+    with open(os.path.join(output_dir, 'data.yaml'), 'w') as f:
+        yaml.safe_dump(dedup_yaml, f, sort_keys=False)
+    return len(written)
+
+
+def split_counts(splits):
+    counts = defaultdict(int)
+    for split in splits:
+        counts[split] += 1
+    return {split: counts[split] for split in SPLITS if counts[split]}
+
+
+def main():
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Find near-duplicate images and write a deduplicated dataset')
+    parser.add_argument('--data', type=str, default='data',
+                       help='Dataset directory (default: data)')
+    parser.add_argument('--output', type=str, default=DEFAULT_OUTPUT,
+                       help=f'Deduplicated dataset directory (default: {DEFAULT_OUTPUT})')
+    parser.add_argument('--threshold', type=int, default=DEFAULT_THRESHOLD,
+                       help=f'Max Hamming distance of 128-bit hashes (default: {DEFAULT_THRESHOLD})')
+    parser.add_argument('--imgsz', type=int, default=416,
+                       help='Long side of the written images (default: 416)')
+    parser.add_argument('--workers', type=int, default=None,
+                       help='Worker processes (default: CPU count)')
+    parser.add_argument('--report-only', action='store_true',
+                       help="Only report duplicates and leakage, don't write a dataset")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Dataset Near-Duplicate Removal")
+    print("=" * 60)
+
+    if not args.report_only:
+        # Before hashing, so a bad --output fails fast
+        try:
+            check_output_dir(args.data, args.output)
+        except ValueError as e:
+            raise SystemExit(f"Error: {e}")
+
+    start = time.time()
+    records = scan_dataset(args.data, args.workers)
+    print(f"Hashed {len(records)} images in {time.time() - start:.1f}s")
+
+    clusters, pairs = cluster(records, args.threshold)
+    keep, leaks = plan(records, clusters)
+    duplicates = [members for members in clusters if len(members) > 1]
+
+    print(f"Near-duplicate pairs: {len(pairs)} (threshold {args.threshold} bits)")
+    print(f"Clusters with duplicates: {len(duplicates)} "
+          f"({sum(len(m) for m in duplicates)} images)")
+    print(f"Unique images: {len(clusters)} of {len(records)}")
+    print(f"\nCross-split leakage: {len(leaks)} cluster(s)")
+    for leak in leaks:
+        print(f"  {' + '.join(leak['splits'])} -> kept in {leak['kept_in']}")
+        for path in leak['files']:
+            print(f"    {path}")
+
+    before = split_counts(r['split'] for r in records)
+    after = split_counts(split for _, split in keep)
+    print("\nImages per split (before -> after):")
+    for split in SPLITS:
+        if split in before:
+            print(f"  {split:6s} {before[split]:5d} -> {after.get(split, 0)}")
+
+    report = {
+        'threshold': args.threshold,
+        'images': len(records),
+        'unique': len(clusters),
+        'splits_before': before,
+        'splits_after': after,
+        'clusters': [[os.path.relpath(records[i]['path']) for i in members] for members in duplicates],
+        'leakage': leaks
+    }
+
+    if args.report_only:
+        return
+
+    start = time.time()
+    written = write_dataset(records, keep, args.data, args.output, args.imgsz, args.workers)
+    with open(os.path.join(args.output, 'dedup_report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    size = sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(args.output) for name in names)
+    print(f"\nWrote {written} images ({size / 1024**2:.1f} MB) to {args.output}/ "
+          f"in {time.time() - start:.1f}s")
+    print(f"Train on it with: python train.py --data {os.path.join(args.output, 'data.yaml')}")
+
+
+if __name__ == '__main__':
+    main()
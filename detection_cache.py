@@ -0,0 +1,280 @@
+"""
+Detection File Cache
+Keeps an in-memory view of detection files (current_session.json and backups)
+and only parses the records that were added since the last read
+"""
+
+import codecs
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# Bytes compared around the last parse position to detect rewritten files
+CHECK_BYTES = 64
+
+# Maximum number of detection files kept in memory
+MAX_CACHED_FILES = 8
+
+# Read size and largest single record when streaming a file
+READ_CHUNK_SIZE = 64 * 1024
+MAX_RECORD_SIZE = 1024 * 1024
+
+_decoder = json.JSONDecoder()
+
+
+def has_gps(det):
+    """Check if a detection has valid GPS coordinates"""
+    location = det.get('location')
+    return bool(location and location.get('latitude') and location.get('longitude'))
+
+
+def iter_records(path, chunk_size=READ_CHUNK_SIZE):
+    """Yield the records of a detection file (JSON array or JSON lines)
+
+    The file is read chunk by chunk, so memory use does not depend on the
+    file size. A truncated last record (file still being written) is skipped.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    text = ''
+    pos = 0
+    fmt = None
+    eof = False
+
+    with open(path, 'rb') as f:
+        while True:
+            # Keep only the unparsed part of the buffer, then read more
+            text = text[pos:]
+            pos = 0
+            if not eof:
+                data = f.read(chunk_size)
+                eof = not data
+                text += decoder.decode(data, final=eof)
+            end = len(text)
+
+            if fmt is None:
+                while pos < end and text[pos].isspace():
+                    pos += 1
+                if pos == end:
+                    if eof:
+                        return
+                    continue
+                if text[pos] == '[':
+                    fmt = 'array'
+                    pos += 1
+                else:
+                    fmt = 'jsonl'
+
+            while True:
+                while pos < end and (text[pos].isspace() or text[pos] == ','):
+                    pos += 1
+                if pos >= end:
+                    break
+                if fmt == 'array' and text[pos] == ']':
+                    return
+
+                if fmt == 'jsonl':
+                    newline = text.find('\n', pos)
+                    if newline < 0 and not eof:
+                        break
+                    line_end = end if newline < 0 else newline
+                    try:
+                        det = json.loads(text[pos:line_end])
+                    except ValueError:
+                        # Skip malformed lines
+                        det = None
+                    pos = line_end
+                else:
+                    try:
+                        det, pos = _decoder.raw_decode(text, pos)
+                    except ValueError:
+                        # Record continues in the next chunk
+                        break
+
+                if isinstance(det, dict):
+                    yield det
+
+            if eof or end - pos > MAX_RECORD_SIZE:
+                # Nothing more to read, or a record that can never complete
+                return
+
+
+class DetectionView:
+    """Parsed contents of one detection file, extended as the file grows"""
+
+    def __init__(self, path):
+        self.path = path
+        self.records = []
+        self.gps_records = []
+        self.generation = 0
+        self.reset()
+
+    def reset(self):
+        """Forget everything parsed so far (file was replaced or truncated)"""
+        self.mtime = None
+        self.size = 0
+        self.offset = 0
+        self.format = None
+        self.head = b''
+        self.tail = b''
+        self.records = []
+        self.gps_records = []
+        self.generation += 1
+
+    def _unchanged_prefix(self, f):
+        """Check the bytes we already parsed are still the same"""
+        if not self.offset:
+            return True
+        f.seek(0)
+        if f.read(len(self.head)) != self.head:
+            return False
+        f.seek(self.offset - len(self.tail))
+        return f.read(len(self.tail)) == self.tail
+
+    def refresh(self, final=False):
+        """Parse any new records; returns the number of records added
+
+        With final, the file is known to be complete and a JSON lines file's
+        last line counts as a record even without a trailing newline.
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            if self.records or self.offset:
+                self.reset()
+            return 0
+
+        if st.st_mtime == self.mtime and st.st_size == self.size:
+            return 0
+
+        with open(self.path, 'rb') as f:
+            if st.st_size < self.offset or not self._unchanged_prefix(f):
+                self.reset()
+
+            f.seek(self.offset)
+            data = f.read()
+
+        added = self._parse(data, final)
+        self.mtime = st.st_mtime
+        self.size = st.st_size
+        return added
+
+    def _parse(self, data, final=False):
+        """Parse complete records from data, which starts at self.offset"""
+        # surrogateescape keeps character offsets convertible back to bytes
+        text = data.decode('utf-8', errors='surrogateescape')
+        pos = 0
+        end = len(text)
+
+        # Detect the file format on first read: JSON array or JSON lines
+        if self.format is None:
+            while pos < end and text[pos].isspace():
+                pos += 1
+            if pos == end:
+                return 0
+            if text[pos] == '[':
+                self.format = 'array'
+                pos += 1
+            else:
+                self.format = 'jsonl'
+
+        consumed = pos
+        added = 0
+        while True:
+            # Skip whitespace and separators between records
+            while pos < end and (text[pos].isspace() or text[pos] == ','):
+                pos += 1
+            if pos >= end or text[pos] == ']':
+                break
+            if self.format == 'jsonl' and not final and text.find('\n', pos) < 0:
+                # Last line may still be being written
+                break
+            try:
+                det, pos = _decoder.raw_decode(text, pos)
+            except ValueError:
+                # Incomplete record at the end of the file
+                break
+            consumed = pos
+            if isinstance(det, dict):
+                self._add(det)
+                added += 1
+
+        if consumed:
+            consumed_bytes = text[:consumed].encode('utf-8', errors='surrogateescape')
+            if not self.offset:
+                self.head = consumed_bytes[:CHECK_BYTES]
+            self.tail = (self.tail + consumed_bytes)[-CHECK_BYTES:]
+            self.offset += len(consumed_bytes)
+        return added
+
+    def _add(self, det):
+        """Append one parsed record to the view"""
+        self.records.append(det)
+        if has_gps(det):
+            self.gps_records.append(det)
+
+
+class DetectionCache:
+    """Shared cache of DetectionView objects keyed by file path
+
+    Pinned files (the current session, which streams wait on) are never
+    evicted: a re-created view would start over and look like a new session.
+    """
+
+    def __init__(self, max_files=MAX_CACHED_FILES):
+        self.max_files = max_files
+        self._views = OrderedDict()
+        self._pinned = set()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def get(self, path):
+        """Return the up-to-date view for a detection file"""
+        path = os.path.abspath(path)
+        with self._lock:
+            view = self._views.get(path)
+            if view is None:
+                view = DetectionView(path)
+                self._views[path] = view
+                if len(self._views) > self.max_files:
+                    for old_path in self._views:
+                        if old_path not in self._pinned:
+                            del self._views[old_path]
+                            break
+            else:
+                self._views.move_to_end(path)
+
+            before = (view.generation, len(view.records))
+            try:
+                view.refresh()
+            except Exception as e:
+                print(f"Error loading detections: {e}")
+            if (view.generation, len(view.records)) != before:
+                self._changed.notify_all()
+            return view
+
+    def pin(self, path):
+        """Keep a file's view cached for good"""
+        with self._lock:
+            self._pinned.add(os.path.abspath(path))
+
+    def wait_for_change(self, path, generation, count, timeout=None):
+        """Block until a cached view differs from (generation, count)
+
+        Returns (generation, records) for the view at that point, or None if
+        the file has no view yet (nothing changed). Records lists are
+        append-only, so callers can slice records[count:] without locking.
+        """
+        path = os.path.abspath(path)
+
+        def changed():
+            view = self._views.get(path)
+            return view is not None and (view.generation != generation or
+                                         len(view.records) != count)
+
+        with self._changed:
+            self._changed.wait_for(changed, timeout=timeout)
+            view = self._views.get(path)
+            if view is None:
+                return None
+            return view.generation, view.records
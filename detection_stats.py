@@ -0,0 +1,130 @@
+"""
+Detection Statistics
+Running aggregates for /api/stats, updated once per ingested record so
+reads don't rescan the session
+"""
+
+import threading
+import time
+from collections import Counter, deque
+
+from detection_cache import has_gps
+
+# Confidence histogram bins over [0, 1]
+CONFIDENCE_BINS = 10
+
+# Rolling windows: name -> (window length, bucket length) in seconds
+ROLLING_WINDOWS = {
+    '1m': (60, 1),
+    '1h': (3600, 60),
+    '1d': (86400, 3600)
+}
+
+
+class RollingCounter:
+    """Per-class counts over a sliding time window, kept in fixed-size buckets"""
+
+    def __init__(self, window, bucket):
+        self.window = window
+        self.bucket = bucket
+        self._buckets = deque()
+        self.counts = Counter()
+
+    def add(self, timestamp, class_name):
+        """Count one detection at timestamp"""
+        start = timestamp - timestamp % self.bucket
+        if self._buckets and start <= self._buckets[-1][0]:
+            # Same bucket (late records are counted in the newest bucket)
+            self._buckets[-1][1][class_name] += 1
+        else:
+            self._buckets.append((start, Counter({class_name: 1})))
+        self.counts[class_name] += 1
+
+    def expire(self, now):
+        """Drop buckets that fell out of the window"""
+        cutoff = now - self.window
+        while self._buckets and self._buckets[0][0] + self.bucket <= cutoff:
+            _, counts = self._buckets.popleft()
+            self.counts.subtract(counts)
+        self.counts = +self.counts
+
+    def snapshot(self, now):
+        """Counts inside the window ending at now"""
+        self.expire(now)
+        return {
+            'total': sum(self.counts.values()),
+            'counts': dict(self.counts)
+        }
+
+
+class DetectionStats:
+    """Totals, confidence histograms and rolling windows for one detection file"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._source = None
+        self.reset()
+
+    def reset(self):
+        """Drop all aggregates"""
+        self.total = 0
+        self.gps_enabled = 0
+        self.class_counts = Counter()
+        self.histograms = {}
+        self.windows = {name: RollingCounter(window, bucket)
+                        for name, (window, bucket) in ROLLING_WINDOWS.items()}
+        self.latest = None
+        self._generation = None
+        self._consumed = 0
+
+    def sync(self, view):
+        """Ingest records added to a DetectionView since the last sync"""
+        with self._lock:
+            if (view.path, view.generation) != (self._source, self._generation):
+                self.reset()
+                self._source = view.path
+                self._generation = view.generation
+
+            records = view.records
+            count = len(records)
+            for det in records[self._consumed:count]:
+                self._add(det)
+            self._consumed = count
+
+    def _add(self, det):
+        """Update every aggregate with one detection"""
+        class_name = det.get('class', 'unknown')
+        self.total += 1
+        self.class_counts[class_name] += 1
+        if has_gps(det):
+            self.gps_enabled += 1
+
+        confidence = det.get('confidence')
+        if confidence is not None:
+            histogram = self.histograms.setdefault(class_name, [0] * CONFIDENCE_BINS)
+            index = min(int(confidence * CONFIDENCE_BINS), CONFIDENCE_BINS - 1)
+            histogram[max(index, 0)] += 1
+
+        timestamp = det.get('timestamp')
+        if timestamp is not None:
+            for window in self.windows.values():
+                window.add(timestamp, class_name)
+
+        self.latest = det
+
+    def snapshot(self, now=None):
+        """Current statistics (cost does not depend on the number of records)"""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            return {
+                'total_detections': self.total,
+                'disease_counts': dict(self.class_counts),
+                'gps_enabled_count': self.gps_enabled,
+                'confidence_histograms': {
+                    'bins': [round(i / CONFIDENCE_BINS, 2) for i in range(CONFIDENCE_BINS + 1)],
+                    'counts': {name: list(hist) for name, hist in self.histograms.items()}
+                },
+                'windows': {name: window.snapshot(now) for name, window in self.windows.items()},
+                'latest_detection': self.latest
+            }
@@ -0,0 +1,351 @@
+"""
+SQLite Detection Store
+Embedded database of all detections, indexed by time, class and location
+(geohash), so historical queries don't need to load whole JSON files
+"""
+
+import glob
+import os
+import sqlite3
+import threading
+import time
+
+# Default database file next to the session files
+DEFAULT_DB_PATH = 'detections.db'
+
+# Geohash precision stored per detection (~5 m cells)
+GEOHASH_PRECISION = 9
+
+# Maximum number of geohash cells used to cover a bounding box query
+MAX_COVER_CELLS = 32
+
+# Page size limits for queries
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS detections (
+    id INTEGER PRIMARY KEY,
+    session TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    datetime TEXT,
+    class TEXT NOT NULL,
+    confidence REAL,
+    latitude REAL,
+    longitude REAL,
+    altitude REAL,
+    satellites INTEGER,
+    geohash TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_detections_time ON detections(timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_detections_class_time ON detections(class, timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_detections_geohash ON detections(geohash);
+CREATE INDEX IF NOT EXISTS idx_detections_session ON detections(session);
+"""
+
+
+def session_for_file(path):
+    """Store session of a detection file: detections_<ts>.json backups hold
+    the live session_<ts> that inference_pi.py stored as it ran"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if stem.startswith('detections_') and stem[len('detections_'):].isdigit():
+        return 'session_' + stem[len('detections_'):]
+    return stem
+
+
+def geohash_encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Encode a coordinate as a geohash string"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(chars) < precision:
+        rng, value = (lon_range, longitude) if even else (lat_range, latitude)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision):
+    """Return (lat_degrees, lon_degrees) covered by one geohash cell"""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = (5 * precision) // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+
+def geohash_cover(min_lon, min_lat, max_lon, max_lat, max_cells=MAX_COVER_CELLS):
+    """Geohash prefixes covering a bounding box with at most max_cells cells"""
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        cell_lat, cell_lon = geohash_cell_size(precision)
+        rows = int((max_lat - min_lat) / cell_lat) + 2
+        cols = int((max_lon - min_lon) / cell_lon) + 2
+        if rows * cols <= max_cells:
+            break
+
+    cells = set()
+    lat = min_lat
+    while True:
+        lon = min_lon
+        while True:
+            cells.add(geohash_encode(lat, lon, precision))
+            if lon >= max_lon:
+                break
+            lon = min(lon + cell_lon, max_lon)
+        if lat >= max_lat:
+            break
+        lat = min(lat + cell_lat, max_lat)
+
+    return sorted(cells)
+
+
+def encode_cursor(timestamp, row_id):
+    """Opaque pagination cursor for the last row of a page"""
+    return f"{timestamp!r}:{row_id}"
+
+
+def decode_cursor(cursor):
+    """Decode a pagination cursor into (timestamp, id)"""
+    try:
+        timestamp, row_id = cursor.rsplit(':', 1)
+        return float(timestamp), int(row_id)
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def row_to_detection(row):
+    """Convert a database row to the JSON detection format"""
+    location = None
+    if row['latitude'] is not None and row['longitude'] is not None:
+        location = {
+            'latitude': row['latitude'],
+            'longitude': row['longitude'],
+            'altitude': row['altitude'],
+            'satellites': row['satellites']
+        }
+    return {
+        'id': row['id'],
+        'session': row['session'],
+        'timestamp': row['timestamp'],
+        'datetime': row['datetime'],
+        'class': row['class'],
+        'confidence': row['confidence'],
+        'location': location
+    }
+
+
+class DetectionStore:
+    """SQLite (WAL mode) store of detections; safe to share between threads"""
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        """Per-thread connection (WAL lets readers run alongside the writer)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def add(self, detection, session):
+        """Insert one detection record"""
+        self.add_many([detection], session)
+
+    def add_many(self, detections, session):
+        """Insert detection records in a single transaction"""
+        rows = []
+        for det in detections:
+            location = det.get('location') or {}
+            lat = location.get('latitude')
+            lon = location.get('longitude')
+            geohash = geohash_encode(lat, lon) if lat and lon else None
+            rows.append((
+                session,
+                det.get('timestamp', time.time()),
+                det.get('datetime'),
+                det.get('class', 'unknown'),
+                det.get('confidence'),
+                lat,
+                lon,
+                location.get('altitude'),
+                location.get('satellites'),
+                geohash
+            ))
+
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT INTO detections (session, timestamp, datetime, class, confidence, "
+                "latitude, longitude, altitude, satellites, geohash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def version(self):
+        """Changes whenever detections are added (used for HTTP ETags)"""
+        row = self._conn().execute("SELECT MAX(id) FROM detections").fetchone()
+        return row[0] or 0
+
+    def has_session(self, session):
+        """Check if any detections were stored for a session"""
+        row = self._conn().execute(
+            "SELECT 1 FROM detections WHERE session = ? LIMIT 1", (session,)).fetchone()
+        return row is not None
+
+    def has_timestamp(self, timestamp):
+        """Check if a detection with this timestamp was stored"""
+        row = self._conn().execute(
+            "SELECT 1 FROM detections WHERE timestamp = ? LIMIT 1", (timestamp,)).fetchone()
+        return row is not None
+
+    def query(self, start=None, end=None, bbox=None, classes=None, session=None,
+              cursor=None, limit=DEFAULT_PAGE_SIZE, descending=False):
+        """Query detections page by page
+
+        bbox is (min_lon, min_lat, max_lon, max_lat). Returns (detections,
+        next_cursor); next_cursor is None on the last page.
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        where = []
+        params = []
+
+        if start is not None:
+            where.append("timestamp >= ?")
+            params.append(float(start))
+        if end is not None:
+            where.append("timestamp <= ?")
+            params.append(float(end))
+        if classes:
+            where.append(f"class IN ({', '.join('?' * len(classes))})")
+            params.extend(classes)
+        if session:
+            where.append("session = ?")
+            params.append(session)
+        if bbox:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            # Geohash ranges use the index, the exact box filters the cell edges
+            ranges = []
+            for prefix in geohash_cover(min_lon, min_lat, max_lon, max_lat):
+                ranges.append("(geohash >= ? AND geohash < ?)")
+                params.extend([prefix, prefix + '{'])
+            where.append(f"({' OR '.join(ranges)})")
+            where.append("latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?")
+            params.extend([min_lat, max_lat, min_lon, max_lon])
+        if cursor:
+            timestamp, row_id = decode_cursor(cursor)
+            where.append("(timestamp, id) < (?, ?)" if descending else "(timestamp, id) > (?, ?)")
+            params.extend([timestamp, row_id])
+
+        order = "DESC" if descending else "ASC"
+        sql = "SELECT * FROM detections"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY timestamp {order}, id {order} LIMIT ?"
+        params.append(limit + 1)
+
+        rows = self._conn().execute(sql, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['timestamp'], rows[-1]['id'])
+
+        return [row_to_detection(row) for row in rows], next_cursor
+
+    def import_file(self, path):
+        """Import a detections JSON/JSONL file as its own session"""
+        from detection_cache import DetectionView
+
+        session = session_for_file(path)
+        if self.has_session(session):
+            return 0
+
+        view = DetectionView(path)
+        view.refresh()
+        return self._import_records(view.records, session)
+
+    def import_archived(self, name, archive_dir=None):
+        """Import a session of the compressed archive (session_archive.py)"""
+        import session_archive
+
+        session = session_for_file(name)
+        if self.has_session(session):
+            return 0
+        records = list(session_archive.iter_session(name, archive_dir or session_archive.ARCHIVE_DIR))
+        return self._import_records(records, session)
+
+    def _import_records(self, records, session):
+        """Store records as a session unless they were already stored live"""
+        # Older backups are named after the session's end: skip them when
+        # their detections were already stored live
+        if records and self.has_timestamp(records[0].get('timestamp')):
+            return 0
+        if records:
+            self.add_many(records, session)
+        return len(records)
+
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Detection database tools')
+    parser.add_argument('--db', type=str, default=DEFAULT_DB_PATH,
+                       help=f'Database file (default: {DEFAULT_DB_PATH})')
+    parser.add_argument('files', nargs='*',
+                       help='Detection JSON files to import (default: detections_*.json and archives)')
+    args = parser.parse_args()
+
+    import session_archive
+
+    files = args.files or sorted(glob.glob('detections_*.json') +
+                                 glob.glob('detections_archive_*/detections_*.json'))
+    # Compacted sessions are only in the compressed archive
+    archived = [] if args.files else [s['session'] for s in session_archive.list_sessions()]
+
+    print("=" * 60)
+    print("Importing detection files")
+    print("=" * 60)
+
+    store = DetectionStore(args.db)
+    total = 0
+    for path in files:
+        count = store.import_file(path)
+        total += count
+        print(f"  {path}: {count} detection(s)" if count else f"  {path}: already imported or empty")
+    for name in archived:
+        count = store.import_archived(name)
+        total += count
+        label = f"{session_archive.ARCHIVE_DIR}/{name}"
+        print(f"  {label}: {count} detection(s)" if count else f"  {label}: already imported or empty")
+
+    print(f"\n✓ Imported {total} detection(s) into {args.db}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Detection Map Tiles
+Aggregates GPS detections into zoom-dependent grid clusters with per-class
+counts, served per map tile so the map payload depends on the viewport
+instead of on the number of detections
+"""
+
+import math
+import threading
+from collections import Counter
+
+from detection_cache import has_gps
+
+# Web map tile size in pixels (Leaflet / OpenStreetMap)
+TILE_SIZE = 256
+
+# Cluster cell size in screen pixels (4x4 cells per tile)
+CELL_SIZE = 64
+CELLS_PER_TILE = TILE_SIZE // CELL_SIZE
+
+# Zoom levels that are aggregated
+MIN_ZOOM = 0
+MAX_ZOOM = 19
+
+# Maximum number of tiles returned by a single viewport query
+MAX_VIEWPORT_TILES = 128
+
+
+def lonlat_to_pixel(longitude, latitude, zoom):
+    """Web Mercator world pixel coordinates of a point at a zoom level"""
+    scale = TILE_SIZE * (2 ** zoom)
+    siny = math.sin(math.radians(latitude))
+    siny = min(max(siny, -0.9999), 0.9999)
+    x = (longitude + 180.0) / 360.0 * scale
+    y = (0.5 - math.log((1 + siny) / (1 - siny)) / (4 * math.pi)) * scale
+    return x, y
+
+
+def bbox_tiles(min_lon, min_lat, max_lon, max_lat, zoom):
+    """List the (x, y) tiles covering a bounding box at a zoom level"""
+    max_index = 2 ** zoom - 1
+    left, top = lonlat_to_pixel(min_lon, max_lat, zoom)
+    right, bottom = lonlat_to_pixel(max_lon, min_lat, zoom)
+    x0 = max(0, int(left // TILE_SIZE))
+    x1 = min(max_index, int(right // TILE_SIZE))
+    y0 = max(0, int(top // TILE_SIZE))
+    y1 = min(max_index, int(bottom // TILE_SIZE))
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+class TileAggregator:
+    """Grid clusters for every zoom level, updated as detections arrive
+
+    Each new detection updates one cell per zoom level and invalidates only
+    the cached tiles that contain those cells.
+    """
+
+    def __init__(self, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM):
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self._lock = threading.Lock()
+        self._source = None
+        self.reset()
+
+    def reset(self):
+        """Drop all aggregated data"""
+        # zoom -> (tile_x, tile_y) -> (cell_x, cell_y) -> cell
+        self._tiles = {zoom: {} for zoom in range(self.min_zoom, self.max_zoom + 1)}
+        self._tile_cache = {}
+        self.class_counts = Counter()
+        self.total = 0
+        self._generation = None
+        self._consumed = 0
+
+    def sync(self, view):
+        """Ingest records added to a DetectionView since the last sync
+
+        Returns a summary of what has been aggregated: the view generation,
+        the records list and how many of its records were consumed, plus
+        per-class totals of the GPS detections among them.
+        """
+        with self._lock:
+            generation = view.generation
+            records = view.records
+            if (view.path, generation) != (self._source, self._generation):
+                self.reset()
+                self._source = view.path
+                self._generation = generation
+
+            count = len(records)
+            for det in records[self._consumed:count]:
+                self._add(det)
+            self._consumed = count
+
+            return {
+                'generation': generation,
+                'records': records,
+                'count': count,
+                'class_counts': dict(self.class_counts),
+                'total': self.total
+            }
+
+    def _add(self, det):
+        """Add one detection to the cell it falls in at every zoom level"""
+        if not has_gps(det):
+            return
+
+        location = det['location']
+        lat = location['latitude']
+        lon = location['longitude']
+        class_name = det.get('class', 'unknown')
+        self.class_counts[class_name] += 1
+        self.total += 1
+
+        for zoom, tiles in self._tiles.items():
+            px, py = lonlat_to_pixel(lon, lat, zoom)
+            cell_key = (int(px // CELL_SIZE), int(py // CELL_SIZE))
+            tile_key = (cell_key[0] // CELLS_PER_TILE, cell_key[1] // CELLS_PER_TILE)
+
+            cells = tiles.setdefault(tile_key, {})
+            cell = cells.get(cell_key)
+            if cell is None:
+                cell = cells[cell_key] = {'count': 0, 'lat_sum': 0.0, 'lon_sum': 0.0,
+                                          'classes': Counter()}
+            cell['count'] += 1
+            cell['lat_sum'] += lat
+            cell['lon_sum'] += lon
+            cell['classes'][class_name] += 1
+
+            self._tile_cache.pop((zoom, tile_key[0], tile_key[1]), None)
+
+    def _clamp_zoom(self, zoom):
+        return min(max(int(zoom), self.min_zoom), self.max_zoom)
+
+    def tile(self, zoom, x, y):
+        """Clusters inside one map tile (cached until new detections land in it)"""
+        zoom = self._clamp_zoom(zoom)
+        key = (zoom, x, y)
+        with self._lock:
+            payload = self._tile_cache.get(key)
+            if payload is None:
+                cells = self._tiles[zoom].get((x, y))
+                if not cells:
+                    return []
+                payload = []
+                for cell in cells.values():
+                    payload.append({
+                        'latitude': cell['lat_sum'] / cell['count'],
+                        'longitude': cell['lon_sum'] / cell['count'],
+                        'count': cell['count'],
+                        'classes': dict(cell['classes'])
+                    })
+                self._tile_cache[key] = payload
+            return payload
+
+    def clusters(self, zoom, bbox):
+        """Clusters for a viewport (min_lon, min_lat, max_lon, max_lat)"""
+        zoom = self._clamp_zoom(zoom)
+        tiles = bbox_tiles(*bbox, zoom)
+        if len(tiles) > MAX_VIEWPORT_TILES:
+            raise ValueError(f"Viewport covers {len(tiles)} tiles at zoom {zoom} "
+                             f"(max {MAX_VIEWPORT_TILES})")
+
+        clusters = []
+        for x, y in tiles:
+            clusters.extend(self.tile(zoom, x, y))
+        return zoom, clusters
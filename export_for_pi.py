@@ -1,95 +1,296 @@
 """
 Export YOLOv8 Model for Raspberry Pi 4
-Converts trained model to TensorFlow Lite INT8 format for optimal performance
+Exports a matrix of TensorFlow Lite variants (quantization x image size),
+measures accuracy on data/valid and CPU latency for each, and writes a
+manifest with the latency/accuracy Pareto front and the recommended model
 """
 
 from ultralytics import YOLO
-import os
+import argparse
 import glob
+import json
+import os
+import platform
+import shutil
+import statistics
+import time
+from contextlib import nullcontext
+from datetime import datetime
+
+from calibration_set import DEFAULT_COUNT, calibration_feed, load_calibration_set
+
+DATA_YAML = 'data/data.yaml'
+VALID_IMAGES = 'data/valid/images'
+EXPORT_DIR = 'exports'
+MANIFEST_FILE = 'manifest.json'
+
+# TFLite files written by ultralytics' tflite export, by variant name
+VARIANT_SUFFIXES = {
+    'int8': '_int8.tflite',                       # INT8 weights (dynamic range)
+    'full_integer': '_full_integer_quant.tflite', # INT8 weights, activations and I/O
+    'fp16': '_float16.tflite',                    # Half precision weights
+}
+
+DEFAULT_VARIANTS = ['int8', 'full_integer', 'fp16']
+DEFAULT_IMGSZ = [320, 416, 512]
+
+# Frame rate the recommended model has to reach on the Pi
+DEFAULT_TARGET_FPS = 10
+
+# Without --min-map50, a variant meets the accuracy bar when its mAP50 is
+# within this much of the most accurate variant
+MAX_ACCURACY_DROP = 0.02
+
+# Images timed per variant (after warm-up)
+LATENCY_IMAGES = 30
+WARMUP_RUNS = 3
 
 def find_best_model():
     """Find the most recent best.pt model in runs/train"""
     train_runs = glob.glob('runs/train/*/weights/best.pt')
-    
+
     if not train_runs:
         print("ERROR: No trained model found!")
         print("Please train a model first using: python train.py")
         return None
-    
+
     # Get the most recent model
     latest_model = max(train_runs, key=os.path.getctime)
     return latest_model
 
-def export_to_tflite(model_path, output_name='chili_disease_pi'):
-    """Export model to TFLite INT8 format"""
-    
-    print("=" * 60)
-    print("Exporting YOLOv8 Model for Raspberry Pi 4")
-    print("=" * 60)
-    print(f"\nInput model: {model_path}")
-    
-    # Load the trained model
-    model = YOLO(model_path)
-    
-    # Export to TFLite with INT8 quantization
-    print("\nExporting to TensorFlow Lite (INT8)...")
-    print("This will optimize the model for Raspberry Pi performance")
+def export_to_tflite(model_path, imgsz=416, data=DATA_YAML, calibration=None):
+    """Export model to TFLite (float32, float16, INT8 and full-integer files)
+
+    With a calibration set, INT8 ranges come from its stratified images
+    instead of the validation split. Returns the directory holding the
+    exported .tflite files.
+    """
+    print(f"\nExporting {model_path} to TensorFlow Lite at {imgsz}x{imgsz}...")
     print("(This may take a few minutes...)")
-    
-    export_path = model.export(
-        format='tflite',
-        imgsz=416,  # Must match training size
-        int8=True,  # INT8 quantization for 4x speed boost
-        data='data/data.yaml',  # Required for calibration
-    )
-    
+
+    model = YOLO(model_path)
+    with calibration_feed(calibration) if calibration else nullcontext(False) as fed:
+        if calibration and not fed:
+            # Older ultralytics: calibrate from the same images via a data yaml
+            data = calibration.data_yaml
+        export_path = model.export(
+            format='tflite',
+            imgsz=imgsz,  # Must match inference size
+            int8=True,  # INT8 quantization for 4x speed boost
+            data=data,  # Required for calibration
+        )
+    return os.path.dirname(export_path)
+
+def collect_variants(export_dir, model_path, imgsz, variants, output_dir):
+    """Copy the requested variants of one export into output_dir"""
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    collected = []
+    for variant in variants:
+        source = os.path.join(export_dir, stem + VARIANT_SUFFIXES[variant])
+        if not os.path.exists(source):
+            print(f"WARNING: {variant} file not produced by the export ({source})")
+            continue
+        target = os.path.join(output_dir, f"chili_disease_{imgsz}_{variant}.tflite")
+        shutil.copyfile(source, target)
+        collected.append({
+            'name': f"{imgsz}_{variant}",
+            'file': os.path.basename(target),
+            'imgsz': imgsz,
+            'quantization': variant,
+            'size_mb': round(os.path.getsize(target) / (1024 * 1024), 2)
+        })
+    return collected
+
+def evaluate_accuracy(model_file, imgsz, data=DATA_YAML):
+    """mAP50, mAP50-95, precision and recall on the validation split"""
+    model = YOLO(model_file, task='detect')
+    results = model.val(data=data, imgsz=imgsz, batch=1, split='val', plots=False, verbose=False)
+    return {
+        'map50': round(float(results.box.map50), 4),
+        'map50_95': round(float(results.box.map), 4),
+        'precision': round(float(results.box.mp), 4),
+        'recall': round(float(results.box.mr), 4)
+    }
+
+def measure_latency(model_file, imgsz, images, runs=LATENCY_IMAGES):
+    """Median end-to-end CPU latency (ms) of one prediction"""
+    model = YOLO(model_file, task='detect')
+    images = images[:runs]
+    for image in images[:WARMUP_RUNS]:
+        model.predict(source=image, imgsz=imgsz, device='cpu', verbose=False)
+
+    timings = []
+    for image in images:
+        start = time.perf_counter()
+        model.predict(source=image, imgsz=imgsz, device='cpu', verbose=False)
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(timings), 2)
+
+def pareto_front(variants):
+    """Names of variants no other variant beats on both latency and mAP50"""
+    front = []
+    for v in variants:
+        dominated = any(
+            o['latency_ms'] <= v['latency_ms'] and o['map50'] >= v['map50'] and
+            (o['latency_ms'] < v['latency_ms'] or o['map50'] > v['map50'])
+            for o in variants if o is not v)
+        if not dominated:
+            front.append(v['name'])
+    return front
+
+def recommend(variants, target_fps, min_map50=None):
+    """Fastest variant meeting the accuracy bar (and the FPS target if possible)"""
+    if not variants:
+        return None, None
+    if min_map50 is None:
+        min_map50 = max(v['map50'] for v in variants) - MAX_ACCURACY_DROP
+    budget_ms = 1000.0 / target_fps
+
+    accurate = [v for v in variants if v['map50'] >= min_map50]
+    in_budget = [v for v in accurate if v['latency_ms'] <= budget_ms]
+    candidates = in_budget or accurate
+    best = min(candidates, key=lambda v: (v['latency_ms'], -v['map50']))
+    return best, round(min_map50, 4)
+
+def evaluate_variants(variants, output_dir, images, data=DATA_YAML):
+    """Fill in accuracy and latency for each variant"""
+    for i, variant in enumerate(variants, 1):
+        model_file = os.path.join(output_dir, variant['file'])
+        print(f"\n[{i}/{len(variants)}] Evaluating {variant['file']}...")
+        variant.update(evaluate_accuracy(model_file, variant['imgsz'], data))
+        variant['latency_ms'] = measure_latency(model_file, variant['imgsz'], images)
+        variant['fps'] = round(1000.0 / variant['latency_ms'], 1)
+        print(f"  mAP50: {variant['map50']:.4f}, latency: {variant['latency_ms']:.1f} ms "
+              f"({variant['fps']:.1f} FPS)")
+
+def write_manifest(variants, output_dir, model_path, target_fps, min_map50=None):
+    """Mark the Pareto front and the recommended model; returns the manifest"""
+    front = pareto_front(variants)
+    best, accuracy_bar = recommend(variants, target_fps, min_map50)
+    budget_ms = 1000.0 / target_fps
+    for v in variants:
+        v['pareto'] = v['name'] in front
+        v['meets_accuracy_bar'] = v['map50'] >= accuracy_bar
+        v['meets_fps_target'] = v['latency_ms'] <= budget_ms
+
+    manifest = {
+        'created': datetime.now().isoformat(),
+        'source_model': model_path,
+        'latency_host': f"{platform.node()} ({platform.machine()}, {platform.processor() or 'unknown CPU'})",
+        'target_fps': target_fps,
+        'accuracy_bar_map50': accuracy_bar,
+        'recommended': best['file'] if best else None,
+        'recommended_imgsz': best['imgsz'] if best else None,
+        'pareto_front': [v['file'] for v in variants if v['pareto']],
+        'variants': sorted(variants, key=lambda v: v['latency_ms'])
+    }
+
+    tmp_path = os.path.join(output_dir, MANIFEST_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(output_dir, MANIFEST_FILE))
+    return manifest
+
+def print_summary(manifest, output_dir):
+    """Table of variants and deployment instructions"""
     print("\n" + "=" * 60)
-    print("Export completed successfully!")
-    print(f"Model saved at: {export_path}")
-    
-    # Get model size
-    model_size_mb = os.path.getsize(export_path) / (1024 * 1024)
-    print(f"Model size: {model_size_mb:.2f} MB")
-    
+    print("Export Results")
+    print("=" * 60)
+    print(f"{'Variant':22s} {'mAP50':>7s} {'ms':>8s} {'FPS':>6s} {'MB':>6s}")
+    for v in manifest['variants']:
+        marks = ('*' if v['pareto'] else ' ') + ('R' if v['file'] == manifest['recommended'] else ' ')
+        print(f"{v['name']:22s} {v['map50']:7.4f} {v['latency_ms']:8.1f} {v['fps']:6.1f} "
+              f"{v['size_mb']:6.2f} {marks}")
+    print("(* Pareto front, R recommended)")
+    print(f"\nAccuracy bar: mAP50 >= {manifest['accuracy_bar_map50']:.4f}, "
+          f"target: {manifest['target_fps']} FPS")
+    print(f"Latency measured on: {manifest['latency_host']}")
+
+    recommended = manifest['recommended']
+    if not recommended:
+        return
+    chosen = next(v for v in manifest['variants'] if v['file'] == recommended)
+    if not chosen['meets_fps_target']:
+        print(f"WARNING: no variant meeting the accuracy bar reaches {manifest['target_fps']} FPS here")
+
     print("\n" + "=" * 60)
     print("Raspberry Pi Deployment Instructions:")
     print("=" * 60)
-    print("\n1. Transfer the model to your Raspberry Pi:")
-    print(f"   scp {export_path} pi@raspberrypi.local:~/")
-    
+    print("\n1. Transfer the recommended model to your Raspberry Pi:")
+    print(f"   scp {os.path.join(output_dir, recommended)} pi@raspberrypi.local:~/")
     print("\n2. Install required packages on Raspberry Pi:")
     print("   pip install ultralytics opencv-python")
-    
-    print("\n3. Use the model for inference (see inference_pi.py)")
-    
-    print("\n" + "=" * 60)
-    print("Expected Performance on Raspberry Pi 4:")
-    print("  - FPS: 10-15 (with INT8 optimization)")
-    print("  - Resolution: 416x416")
-    print("  - Use cases: Plant disease monitoring, periodic scans")
-    print("\nFor real-time video (25-30 FPS):")
-    print("  - Consider Google Coral USB Accelerator")
+    print("\n3. Run inference (see inference_pi.py):")
+    print(f"   python inference_pi.py --model {recommended} --imgsz {manifest['recommended_imgsz']}")
+    print("\nLatency was measured on this machine; re-run on the Pi for Pi numbers:")
+    print(f"   python export_for_pi.py --evaluate-only --output {output_dir}")
     print("=" * 60)
-    
-    return export_path
 
 def main():
-    # Find the best trained model
-    model_path = find_best_model()
-    
-    if model_path is None:
+    parser = argparse.ArgumentParser(description='Export and evaluate TFLite models for Raspberry Pi')
+    parser.add_argument('--model', type=str, default=None,
+                       help='Trained model (default: latest runs/train/*/weights/best.pt)')
+    parser.add_argument('--imgsz', type=int, nargs='+', default=DEFAULT_IMGSZ,
+                       help=f'Image sizes to export (default: {DEFAULT_IMGSZ})')
+    parser.add_argument('--variants', type=str, nargs='+', default=DEFAULT_VARIANTS,
+                       choices=sorted(VARIANT_SUFFIXES),
+                       help=f'Quantization variants (default: {DEFAULT_VARIANTS})')
+    parser.add_argument('--fps', type=float, default=DEFAULT_TARGET_FPS,
+                       help=f'Target FPS for the recommendation (default: {DEFAULT_TARGET_FPS})')
+    parser.add_argument('--min-map50', type=float, default=None,
+                       help=f'Accuracy bar (default: best mAP50 - {MAX_ACCURACY_DROP})')
+    parser.add_argument('--output', type=str, default=EXPORT_DIR,
+                       help=f'Output directory (default: {EXPORT_DIR})')
+    parser.add_argument('--calibration-count', type=int, default=DEFAULT_COUNT,
+                       help=f'INT8 calibration images (default: {DEFAULT_COUNT}, see calibration_set.py)')
+    parser.add_argument('--no-calibration-set', action='store_true',
+                       help='Calibrate on the validation split instead of the stratified set')
+    parser.add_argument('--evaluate-only', action='store_true',
+                       help='Re-evaluate the variants in an existing manifest (e.g. on the Pi)')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Exporting YOLOv8 Model for Raspberry Pi 4")
+    print("=" * 60)
+
+    images = sorted(glob.glob(os.path.join(VALID_IMAGES, '*.jpg')))
+    if not images:
+        print(f"ERROR: No validation images found in {VALID_IMAGES}")
         return
-    
-    print(f"\nFound trained model: {model_path}")
-    
-    # Ask user to confirm
-    response = input("\nProceed with export? (y/n): ").strip().lower()
-    if response != 'y':
-        print("Export cancelled.")
+
+    if args.evaluate_only:
+        with open(os.path.join(args.output, MANIFEST_FILE)) as f:
+            previous = json.load(f)
+        model_path = previous['source_model']
+        variants = [{k: v[k] for k in ('name', 'file', 'imgsz', 'quantization', 'size_mb')}
+                    for v in previous['variants']]
+    else:
+        model_path = args.model or find_best_model()
+        if model_path is None:
+            return
+        print(f"\nInput model: {model_path}")
+        print(f"Image sizes: {args.imgsz}")
+        print(f"Variants: {args.variants}")
+
+        os.makedirs(args.output, exist_ok=True)
+        variants = []
+        for imgsz in args.imgsz:
+            calibration = None
+            if not args.no_calibration_set:
+                calibration = load_calibration_set(imgsz, args.calibration_count)
+                print(f"INT8 calibration: {len(calibration)} images, "
+                      f"strata {calibration.manifest['strata']}")
+            export_dir = export_to_tflite(model_path, imgsz, calibration=calibration)
+            variants.extend(collect_variants(export_dir, model_path, imgsz, args.variants, args.output))
+
+    if not variants:
+        print("ERROR: No variants were exported")
         return
-    
-    # Export the model
-    export_to_tflite(model_path)
+
+    evaluate_variants(variants, args.output, images)
+    manifest = write_manifest(variants, args.output, model_path, args.fps, args.min_map50)
+    print_summary(manifest, args.output)
+    print(f"\nManifest saved at: {os.path.join(args.output, MANIFEST_FILE)}")
 
 if __name__ == "__main__":
     main()
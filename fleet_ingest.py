@@ -0,0 +1,320 @@
+"""
+Fleet MQTT Ingestion
+Subscribes to detections from every Pi (chili/<device>/detections), parses
+and stores them on worker threads in batches, and keeps per-device and
+per-class aggregates plus device liveness
+"""
+
+import json
+import queue
+import threading
+import time
+from collections import Counter
+
+from detection_store import DetectionStore
+
+try:
+    import paho.mqtt.client as mqtt
+    MQTT_AVAILABLE = True
+except ImportError:
+    MQTT_AVAILABLE = False
+
+DEFAULT_BROKER = 'broker.hivemq.com'
+
+# Fleet detections go to their own database: on a Pi that also runs
+# inference_pi.py, its detections.db already holds the local device's ones
+FLEET_DB_PATH = 'fleet.db'
+
+# Per-device topics; the old single topic is still accepted
+DETECTION_TOPIC = 'chili/{device}/detections'
+STATUS_TOPIC = 'chili/{device}/status'
+HEARTBEAT_TOPIC = 'chili/{device}/heartbeat'
+SUBSCRIPTIONS = ['chili/+/detections', 'chili/+/status', 'chili/+/heartbeat', 'chili/detections']
+
+# Device name used for messages on the old chili/detections topic
+LEGACY_DEVICE = 'default'
+
+# Devices without a status topic count as offline after this many seconds
+# without a message
+DEVICE_TIMEOUT = 120
+
+# Ingestion queue and batching
+QUEUE_SIZE = 20000
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 0.5
+
+
+def parse_topic(topic):
+    """Split a topic into (device, kind); kind is 'detections', 'status' or 'heartbeat'"""
+    parts = topic.split('/')
+    if parts == ['chili', 'detections']:
+        return LEGACY_DEVICE, 'detections'
+    if len(parts) == 3 and parts[0] == 'chili':
+        return parts[1], parts[2]
+    return None, None
+
+
+def create_client(client_id=None):
+    """paho client for both the 1.x and 2.x APIs"""
+    try:
+        # paho-mqtt >= 2.0
+        return mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id)
+    except (AttributeError, TypeError):
+        return mqtt.Client(client_id)
+
+
+class FleetStats:
+    """Per-device and per-class totals and device liveness"""
+
+    def __init__(self, timeout=DEVICE_TIMEOUT):
+        self.timeout = timeout
+        self.class_counts = Counter()
+        self.total = 0
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def _device(self, device):
+        state = self._devices.get(device)
+        if state is None:
+            state = {'count': 0, 'classes': Counter(), 'last_seen': None,
+                     'last_detection': None, 'status': None, 'heartbeat': None}
+            self._devices[device] = state
+        return state
+
+    def record(self, device, detections, now=None):
+        """Count a batch of detections from one device"""
+        now = now or time.time()
+        classes = Counter(det.get('class', 'unknown') for det in detections)
+        with self._lock:
+            state = self._device(device)
+            state['count'] += len(detections)
+            state['classes'].update(classes)
+            state['last_seen'] = now
+            if detections:
+                state['last_detection'] = detections[-1].get('timestamp', now)
+            self.class_counts.update(classes)
+            self.total += len(detections)
+
+    def set_status(self, device, status, now=None):
+        """Record an online/offline status message (offline is the last will)"""
+        with self._lock:
+            state = self._device(device)
+            state['status'] = status
+            state['last_seen'] = now or time.time()
+
+    def set_heartbeat(self, device, heartbeat, now=None):
+        """Record a periodic heartbeat (FPS, counts, thermal state)"""
+        with self._lock:
+            state = self._device(device)
+            state['heartbeat'] = heartbeat
+            state['last_seen'] = now or time.time()
+
+    def _is_online(self, state, now):
+        if state['status'] is not None:
+            return state['status'] == 'online'
+        return state['last_seen'] is not None and now - state['last_seen'] < self.timeout
+
+    def snapshot(self, now=None):
+        """Aggregates for the dashboard"""
+        now = now or time.time()
+        with self._lock:
+            devices = {
+                device: {
+                    'online': self._is_online(state, now),
+                    'count': state['count'],
+                    'class_counts': dict(state['classes']),
+                    'last_seen': state['last_seen'],
+                    'last_detection': state['last_detection'],
+                    'heartbeat': state['heartbeat']
+                }
+                for device, state in self._devices.items()
+            }
+            return {
+                'total': self.total,
+                'class_counts': dict(self.class_counts),
+                'devices': devices,
+                'online_devices': sum(1 for d in devices.values() if d['online'])
+            }
+
+
+class FleetIngestor:
+    """Multi-threaded ingestion of MQTT detection messages
+
+    The MQTT network thread only queues raw payloads (submit); worker threads
+    parse them, write them to the detection database in batches (one
+    transaction per device per batch, with the device id as session) and
+    update the aggregates. Listeners are called as listener(device,
+    detections) on the worker threads after each batch is stored.
+    """
+
+    def __init__(self, store=None, workers=4, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, queue_size=QUEUE_SIZE):
+        self.store = store
+        self.stats = FleetStats()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.listeners = []
+        self.received = 0
+        self.stored = 0
+        self.errors = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._counter_lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._worker, daemon=True)
+                         for _ in range(workers)]
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    def stop(self):
+        """Store everything queued so far and stop the workers"""
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def backlog(self):
+        return self._queue.qsize()
+
+    def submit(self, topic, payload):
+        """Queue a raw message; blocks (backpressure on the broker) when full"""
+        self._queue.put((topic, payload))
+
+    def on_message(self, client, userdata, msg):
+        """paho on_message callback"""
+        self.submit(msg.topic, msg.payload)
+
+    def _worker(self):
+        running = True
+        while running:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = []
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if item is None:
+                running = False
+
+            if batch:
+                self._process(batch)
+
+        if self.store:
+            self.store.close()
+
+    def _process(self, batch):
+        """Parse, store and count one batch of raw messages"""
+        by_device = {}
+        errors = 0
+        for topic, payload in batch:
+            device, kind = parse_topic(topic)
+            try:
+                if kind == 'detections':
+                    det = json.loads(payload)
+                    if not isinstance(det, dict):
+                        raise ValueError('detection is not an object')
+                    by_device.setdefault(device, []).append(det)
+                elif kind == 'status':
+                    status = payload.decode('utf-8', errors='replace').strip()
+                    self.stats.set_status(device, status)
+                elif kind == 'heartbeat':
+                    heartbeat = json.loads(payload)
+                    if not isinstance(heartbeat, dict):
+                        raise ValueError('heartbeat is not an object')
+                    self.stats.set_heartbeat(device, heartbeat)
+                else:
+                    errors += 1
+            except ValueError:
+                errors += 1
+
+        stored = 0
+        for device, detections in by_device.items():
+            if self.store:
+                try:
+                    self.store.add_many(detections, device)
+                except Exception as e:
+                    print(f"Failed to store detections from {device}: {e}")
+                    errors += len(detections)
+                    continue
+            stored += len(detections)
+            self.stats.record(device, detections)
+            for listener in self.listeners:
+                try:
+                    listener(device, detections)
+                except Exception as e:
+                    print(f"Detection listener error: {e}")
+
+        with self._counter_lock:
+            self.received += len(batch)
+            self.stored += stored
+            self.errors += errors
+
+
+def connect_fleet(ingestor, broker=DEFAULT_BROKER, port=1883, client_id=None):
+    """Connect an MQTT client feeding ingestor and subscribe to all devices"""
+    client = create_client(client_id)
+
+    def on_connect(client, userdata, flags, rc):
+        print(f"MQTT Connected! Code: {rc}")
+        for topic in SUBSCRIPTIONS:
+            client.subscribe(topic, qos=1)
+        print(f"Subscribed to: {', '.join(SUBSCRIPTIONS)}")
+
+    client.on_connect = on_connect
+    client.on_message = ingestor.on_message
+    client.connect(broker, port, 60)
+    return client
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Ingest detections from all Pis over MQTT')
+    parser.add_argument('--broker', type=str, default=DEFAULT_BROKER,
+                       help=f'MQTT broker address (default: {DEFAULT_BROKER})')
+    parser.add_argument('--port', type=int, default=1883,
+                       help='MQTT broker port (default: 1883)')
+    parser.add_argument('--db', type=str, default=FLEET_DB_PATH,
+                       help=f'Database file (default: {FLEET_DB_PATH})')
+    parser.add_argument('--workers', type=int, default=4,
+                       help='Ingestion worker threads (default: 4)')
+    args = parser.parse_args()
+
+    if not MQTT_AVAILABLE:
+        print("ERROR: paho-mqtt not available. Install with: pip install paho-mqtt")
+        return
+
+    ingestor = FleetIngestor(DetectionStore(args.db), workers=args.workers)
+    ingestor.start()
+
+    print(f"Connecting to {args.broker}:{args.port}...")
+    client = connect_fleet(ingestor, args.broker, args.port)
+    client.loop_start()
+
+    try:
+        last = 0
+        while True:
+            time.sleep(10)
+            snapshot = ingestor.stats.snapshot()
+            rate = (ingestor.received - last) / 10
+            last = ingestor.received
+            print(f"{rate:8.1f} msg/s | stored {ingestor.stored} | backlog {ingestor.backlog()} | "
+                  f"devices online {snapshot['online_devices']}/{len(snapshot['devices'])}")
+    except KeyboardInterrupt:
+        print("\nShutting down...")
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        ingestor.stop()
+
+
+if __name__ == '__main__':
+    main()
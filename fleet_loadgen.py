@@ -0,0 +1,200 @@
+"""
+Fleet MQTT Load Generator
+Simulates many Pis publishing detections to chili/<device>/detections and
+reports how many messages per second the ingestion path sustains.
+
+By default messages go through an in-process broker stand-in straight into
+FleetIngestor (no network needed); --broker publishes to a real broker
+instead, to be consumed by fleet_ingest.py.
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from detection_store import DetectionStore
+from fleet_ingest import (DETECTION_TOPIC, STATUS_TOPIC, SUBSCRIPTIONS,
+                          FleetIngestor, create_client)
+
+CLASSES = ['antraknosa', 'cabai_normal', 'lalat_buah']
+
+
+class Message:
+    """Minimal stand-in for paho's MQTTMessage"""
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def topic_matches(pattern, topic):
+    """MQTT topic filter match ('+' and '#' wildcards)"""
+    pattern_parts = pattern.split('/')
+    topic_parts = topic.split('/')
+    for i, part in enumerate(pattern_parts):
+        if part == '#':
+            return True
+        if i >= len(topic_parts) or (part != '+' and part != topic_parts[i]):
+            return False
+    return len(pattern_parts) == len(topic_parts)
+
+
+class LocalBroker:
+    """In-process broker stand-in: delivers on the publishing thread, like
+    paho's network thread calling on_message"""
+
+    def __init__(self):
+        self._subscriptions = []
+
+    def subscribe(self, pattern, callback):
+        self._subscriptions.append((pattern, callback))
+
+    def publish(self, topic, payload):
+        for pattern, callback in self._subscriptions:
+            if topic_matches(pattern, topic):
+                callback(None, None, Message(topic, payload))
+                break
+
+
+def make_detection(device, base_lat, base_lon):
+    """Random detection in the format published by inference_pi.py"""
+    now = time.time()
+    return {
+        'timestamp': now,
+        'datetime': datetime.fromtimestamp(now).isoformat(),
+        'class': random.choice(CLASSES),
+        'confidence': round(random.uniform(0.5, 0.99), 3),
+        'device': device,
+        'location': {
+            'latitude': base_lat + random.uniform(-0.001, 0.001),
+            'longitude': base_lon + random.uniform(-0.001, 0.001),
+            'altitude': 100.0,
+            'satellites': 8
+        }
+    }
+
+
+def publisher(publish, devices, rate, deadline, sent, lock):
+    """Publish detections for a group of devices at rate msg/s (0 = as fast as possible)"""
+    origins = {device: (-7.8 + random.uniform(-0.1, 0.1), 110.4 + random.uniform(-0.1, 0.1))
+               for device in devices}
+    for device in devices:
+        publish(STATUS_TOPIC.format(device=device), b'online')
+
+    count = 0
+    start = time.time()
+    while time.time() < deadline:
+        device = devices[count % len(devices)]
+        det = make_detection(device, *origins[device])
+        publish(DETECTION_TOPIC.format(device=device), json.dumps(det).encode('utf-8'))
+        count += 1
+        if rate:
+            delay = start + count / rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+    with lock:
+        sent[0] += count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test fleet MQTT ingestion')
+    parser.add_argument('--devices', type=int, default=50,
+                       help='Simulated Pis (default: 50)')
+    parser.add_argument('--publishers', type=int, default=4,
+                       help='Publishing threads (default: 4)')
+    parser.add_argument('--rate', type=float, default=0,
+                       help='Total messages per second (default: 0 = as fast as possible)')
+    parser.add_argument('--duration', type=float, default=10,
+                       help='Seconds to publish (default: 10)')
+    parser.add_argument('--workers', type=int, default=4,
+                       help='Ingestion worker threads (default: 4)')
+    parser.add_argument('--db', type=str, default=None,
+                       help='Database file (default: a temporary file)')
+    parser.add_argument('--broker', type=str, default=None,
+                       help='Publish to this MQTT broker instead of the in-process stand-in')
+    parser.add_argument('--port', type=int, default=1883,
+                       help='MQTT broker port (default: 1883)')
+    args = parser.parse_args()
+
+    devices = [f"pi-{i:03d}" for i in range(args.devices)]
+    groups = [devices[i::args.publishers] for i in range(args.publishers)]
+    groups = [group for group in groups if group]
+    per_thread_rate = args.rate / len(groups) if args.rate else 0
+
+    print("=" * 60)
+    print("Fleet MQTT Load Generator")
+    print("=" * 60)
+    print(f"Devices: {args.devices}, publishers: {len(groups)}, "
+          f"rate: {args.rate or 'max'} msg/s, duration: {args.duration:.0f}s")
+
+    ingestor = None
+    clients = []
+    tmp_dir = None
+    if args.broker:
+        print(f"Broker: {args.broker}:{args.port} (run fleet_ingest.py to consume)")
+        publishers = []
+        for i in range(len(groups)):
+            client = create_client(f"chili_loadgen_{os.getpid()}_{i}")
+            client.connect(args.broker, args.port, 60)
+            client.loop_start()
+            clients.append(client)
+            publishers.append(lambda topic, payload, c=client: c.publish(topic, payload, qos=1))
+    else:
+        if args.db:
+            db_path = args.db
+        else:
+            tmp_dir = tempfile.TemporaryDirectory()
+            db_path = os.path.join(tmp_dir.name, 'fleet.db')
+        print(f"Broker: in-process stand-in, database: {db_path}, workers: {args.workers}")
+
+        ingestor = FleetIngestor(DetectionStore(db_path), workers=args.workers)
+        ingestor.start()
+        broker = LocalBroker()
+        for pattern in SUBSCRIPTIONS:
+            broker.subscribe(pattern, ingestor.on_message)
+        publishers = [broker.publish] * len(groups)
+    print("=" * 60)
+
+    sent = [0]
+    lock = threading.Lock()
+    deadline = time.time() + args.duration
+    start = time.time()
+    threads = [threading.Thread(target=publisher, args=(publishers[i], group, per_thread_rate,
+                                                        deadline, sent, lock))
+               for i, group in enumerate(groups)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    publish_time = time.time() - start
+
+    for client in clients:
+        client.loop_stop()
+        client.disconnect()
+
+    print(f"Published: {sent[0]} messages in {publish_time:.1f}s "
+          f"({sent[0] / publish_time:.0f} msg/s)")
+
+    if ingestor:
+        backlog = ingestor.backlog()
+        ingestor.stop()
+        total_time = time.time() - start
+        snapshot = ingestor.stats.snapshot()
+        print(f"Backlog at end of publishing: {backlog}")
+        print(f"Stored: {ingestor.stored} detections in {total_time:.1f}s "
+              f"({ingestor.stored / total_time:.0f} msg/s sustained), errors: {ingestor.errors}")
+        print(f"Devices online: {snapshot['online_devices']}/{len(snapshot['devices'])}")
+        print(f"Class counts: {snapshot['class_counts']}")
+
+    if tmp_dir:
+        tmp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Shared-Memory Preview Frame
+The inference process copies its latest annotated frame into a shared-memory
+slot, but only while a viewer (dashboard_server.py's MJPEG stream) has
+checked in recently, so nothing is copied or encoded when nobody is watching
+"""
+
+import struct
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Shared memory segment name (one preview per Pi)
+SHM_NAME = 'chili_preview'
+
+# Largest frame that fits in the slot (larger frames are downscaled)
+MAX_WIDTH = 1280
+MAX_HEIGHT = 720
+
+# A viewer counts as connected for this many seconds after its last check-in
+VIEWER_TIMEOUT = 2.0
+
+# Upper bound on frames copied per second
+MAX_PUBLISH_FPS = 15
+
+# Slot layout: frame header (seq, width, height, channels, frame time),
+# viewer check-in time, then the frame pixels
+FRAME_HEADER = struct.Struct('<QIIId')
+SEQ = struct.Struct('<Q')
+VIEWER = struct.Struct('<d')
+VIEWER_OFFSET = FRAME_HEADER.size
+PIXELS_OFFSET = VIEWER_OFFSET + VIEWER.size
+SLOT_SIZE = PIXELS_OFFSET + MAX_WIDTH * MAX_HEIGHT * 3
+
+
+def _attach(name):
+    """Attach to an existing segment without taking ownership of it"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 registers attached segments with the resource tracker,
+        # which would unlink the inference process's segment on exit
+        shm = shared_memory.SharedMemory(name=name)
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class FramePublisher:
+    """Writer side, used by inference_pi.py
+
+    The slot is guarded by a sequence number: odd while a frame is being
+    written, even once it is complete.
+    """
+
+    def __init__(self, name=SHM_NAME, max_fps=MAX_PUBLISH_FPS):
+        self.max_fps = max_fps
+        self._last_publish = 0
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=SLOT_SIZE)
+        except FileExistsError:
+            # Left behind by a previous run that didn't exit cleanly
+            stale = _attach(name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=SLOT_SIZE)
+        FRAME_HEADER.pack_into(self.shm.buf, 0, 0, 0, 0, 0, 0.0)
+        VIEWER.pack_into(self.shm.buf, VIEWER_OFFSET, 0.0)
+        self._seq = 0
+
+    def viewers_active(self, now=None):
+        """Check if a viewer checked in recently"""
+        (viewer_time,) = VIEWER.unpack_from(self.shm.buf, VIEWER_OFFSET)
+        return (now or time.time()) - viewer_time < VIEWER_TIMEOUT
+
+    def publish(self, frame):
+        """Copy a BGR frame into the slot if anyone is watching
+
+        Costs one header read when nobody is, so inference throughput is
+        unaffected. Returns True if the frame was copied.
+        """
+        now = time.time()
+        if now - self._last_publish < 1.0 / self.max_fps or not self.viewers_active(now):
+            return False
+
+        height, width = frame.shape[:2]
+        if width > MAX_WIDTH or height > MAX_HEIGHT:
+            import cv2
+            scale = min(MAX_WIDTH / width, MAX_HEIGHT / height)
+            frame = cv2.resize(frame, (int(width * scale), int(height * scale)))
+            height, width = frame.shape[:2]
+        channels = frame.shape[2] if frame.ndim == 3 else 1
+
+        self._seq += 1
+        SEQ.pack_into(self.shm.buf, 0, self._seq)
+        slot = np.ndarray(frame.shape, dtype=np.uint8, buffer=self.shm.buf, offset=PIXELS_OFFSET)
+        np.copyto(slot, frame)
+        del slot
+        self._seq += 1
+        FRAME_HEADER.pack_into(self.shm.buf, 0, self._seq, width, height, channels, now)
+        self._last_publish = now
+        return True
+
+    def close(self):
+        """Remove the segment"""
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class FrameReader:
+    """Reader side, used by the dashboard's preview stream"""
+
+    def __init__(self, name=SHM_NAME):
+        self.name = name
+        self.shm = None
+
+    def _connect(self):
+        if self.shm is None:
+            try:
+                self.shm = _attach(self.name)
+            except FileNotFoundError:
+                return False
+        return True
+
+    def reconnect(self):
+        """Drop the mapping (the inference process may have restarted)"""
+        if self.shm is not None:
+            self.shm.close()
+            self.shm = None
+
+    def available(self):
+        """Check if a publisher's shared memory exists, without checking in"""
+        return self._connect()
+
+    def check_in(self):
+        """Tell the publisher a viewer is connected; False if no publisher"""
+        if not self._connect():
+            return False
+        VIEWER.pack_into(self.shm.buf, VIEWER_OFFSET, time.time())
+        return True
+
+    def read(self, last_seq=0):
+        """Return (seq, frame time, frame copy), or None if there is no new frame"""
+        if not self._connect():
+            return None
+
+        for _ in range(3):
+            seq, width, height, channels, frame_time = FRAME_HEADER.unpack_from(self.shm.buf, 0)
+            if seq == last_seq or seq % 2 or not width:
+                return None
+            shape = (height, width, channels) if channels > 1 else (height, width)
+            frame = np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf,
+                               offset=PIXELS_OFFSET).copy()
+            if SEQ.unpack_from(self.shm.buf, 0)[0] == seq:
+                return seq, frame_time, frame
+            # Overwritten while copying; try again
+        return None
+
+    def close(self):
+        self.reconnect()
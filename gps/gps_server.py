@@ -1,46 +1,59 @@
-from flask import Flask, render_template, jsonify
-import threading
+from flask import Flask, render_template, Response
+import json
+import os
+import sys
 import time
-from gps_parser import GPSReader
+from gps_service import GPSService, GPSServiceClient
+
+# Shared HTTP helpers live in the project root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import http_cache
 
 app = Flask(__name__)
+http_cache.init_app(app)
+
+# Position source: a client of the shared GPS service, or an embedded
+# service when no daemon is running (it then owns /dev/serial0 itself)
+gps_source = None
+
+def start_gps_source():
+    """Connect to the shared GPS service, starting one in-process if needed"""
+    global gps_source
+
+    if GPSServiceClient.service_available():
+        client = GPSServiceClient()
+        if client.connect():
+            print("Connected to shared GPS service")
+            gps_source = client
+            return True
+
+    service = GPSService()
+    if service.start():
+        print("GPS service started in-process")
+        gps_source = service
+        return True
+
+    print("Failed to connect to GPS module")
+    return False
+
+def gps_payload(position, last_update):
+    """Build the JSON payload sent to the map page"""
+    position = position or {}
+    return {
+        'latitude': position.get('latitude'),
+        'longitude': position.get('longitude'),
+        'altitude': position.get('altitude'),
+        'satellites': position.get('satellites', 0),
+        'fix_quality': position.get('fix_quality', 0),
+        'last_update': last_update
+    }
 
-# Global GPS data
-gps_data = {
-    'latitude': None,
-    'longitude': None,
-    'altitude': None,
-    'satellites': 0,
-    'fix_quality': 0,
-    'last_update': None
-}
-
-gps_reader = None
-gps_thread_running = False
-
-def gps_reading_thread():
-    """Background thread to continuously read GPS data"""
-    global gps_data, gps_reader, gps_thread_running
-    
-    gps_reader = GPSReader()
-    if not gps_reader.connect():
-        print("Failed to connect to GPS module")
-        return
-    
-    print("GPS reader started")
-    
-    while gps_thread_running:
-        try:
-            data = gps_reader.read_gps_data()
-            if data:
-                gps_data.update(data)
-                gps_data['last_update'] = time.strftime('%Y-%m-%d %H:%M:%S')
-            time.sleep(0.1)  # Read frequently
-        except Exception as e:
-            print(f"Error in GPS thread: {e}")
-            time.sleep(1)
-    
-    gps_reader.close()
+def current_gps():
+    """Latest GPS data and its sequence number (empty if no source is running)"""
+    if gps_source is None:
+        return None, gps_payload(None, None)
+    seq, position, last_update = gps_source.hub.snapshot()
+    return (id(gps_source), seq), gps_payload(position, last_update)
 
 @app.route('/')
 def index():
@@ -50,13 +63,39 @@ def index():
 @app.route('/api/gps')
 def get_gps():
     """API endpoint to get current GPS data"""
-    return jsonify(gps_data)
+    seq, gps_data = current_gps()
+    return http_cache.cached_json(seq, lambda: gps_data)
+
+@app.route('/api/gps/stream')
+def stream_gps():
+    """Server-sent events stream pushing every new GPS fix"""
+    def generate():
+        # Send the current state straight away, then only changes
+        last_seq = -1
+        while True:
+            if gps_source is None:
+                yield f"data: {json.dumps(current_gps()[1])}\n\n"
+                time.sleep(15)
+                continue
+
+            seq, position, last_update = gps_source.hub.wait_for_update(last_seq, timeout=15)
+            if seq == last_seq:
+                # Keep the connection alive through proxies
+                yield ": keepalive\n\n"
+                continue
+
+            last_seq = seq
+            yield f"data: {json.dumps(gps_payload(position, last_update))}\n\n"
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/status')
 def get_status():
     """Check if GPS has a fix"""
+    seq, gps_data = current_gps()
     has_fix = gps_data['latitude'] is not None and gps_data['longitude'] is not None
-    return jsonify({
+    return http_cache.cached_json(seq, lambda: {
         'has_fix': has_fix,
         'satellites': gps_data['satellites'],
         'fix_quality': gps_data['fix_quality'],
@@ -64,17 +103,20 @@ def get_status():
     })
 
 if __name__ == '__main__':
-    # Start GPS reading thread
-    gps_thread_running = True
-    gps_thread = threading.Thread(target=gps_reading_thread, daemon=True)
-    gps_thread.start()
-    
+    # Connect to (or start) the shared GPS service
+    start_gps_source()
+
     # Start Flask server
     print("Starting GPS Map Server on http://0.0.0.0:5000")
     print("Access from browser at http://raspberrypi.local:5000 or http://<pi-ip>:5000")
-    
+
     try:
-        app.run(host='0.0.0.0', port=5000, debug=False)
+        http_cache.run_server(app, host='0.0.0.0', port=5000)
     except KeyboardInterrupt:
         print("\nShutting down...")
-        gps_thread_running = False
+    finally:
+        if gps_source:
+            if isinstance(gps_source, GPSService):
+                gps_source.stop()
+            else:
+                gps_source.close()
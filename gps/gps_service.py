@@ -0,0 +1,275 @@
+"""
+Shared GPS Service
+Owns the GPS serial port and fans position updates out to local consumers
+over a Unix domain socket, so gps_server.py and inference_pi.py can run together
+"""
+
+import errno
+import json
+import os
+import socket
+import threading
+import time
+
+# Unix socket used to publish positions to local consumers
+GPS_SOCKET_PATH = os.environ.get('CHILI_GPS_SOCKET', '/tmp/chili_gps.sock')
+
+
+class PositionHub:
+    """Holds the latest GPS position and wakes up anyone waiting for a new one"""
+
+    def __init__(self):
+        self.position = None
+        self.last_update = None
+        self.seq = 0
+        self._cond = threading.Condition()
+
+    def publish(self, position):
+        """Store a new position and notify waiters"""
+        with self._cond:
+            self.position = dict(position)
+            self.last_update = time.strftime('%Y-%m-%d %H:%M:%S')
+            self.seq += 1
+            self._cond.notify_all()
+
+    def snapshot(self):
+        """Return (seq, position, last_update) for the latest position"""
+        with self._cond:
+            return self.seq, self.position, self.last_update
+
+    def wait_for_update(self, last_seq, timeout=None):
+        """Block until a position newer than last_seq arrives, or timeout"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq != last_seq, timeout=timeout)
+            return self.seq, self.position, self.last_update
+
+    def get_current_position(self):
+        """Get the last known position (same shape as GPSReader)"""
+        with self._cond:
+            if self.position and self.position.get('latitude') and self.position.get('longitude'):
+                return dict(self.position)
+        return None
+
+
+class GPSService:
+    """Reads the serial GPS and broadcasts every fix to Unix socket clients"""
+
+    def __init__(self, port='/dev/serial0', baudrate=9600, socket_path=GPS_SOCKET_PATH):
+        # Only the service needs pyserial/pynmea2; consumers just read the socket
+        from gps_parser import GPSReader
+
+        self.reader = GPSReader(port=port, baudrate=baudrate)
+        self.socket_path = socket_path
+        self.hub = PositionHub()
+        self.running = False
+        self._server = None
+        self._clients = []
+        self._clients_lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        """Open the serial port and socket, then start background threads"""
+        if not self._clear_stale_socket():
+            return False
+        if not self.reader.connect():
+            return False
+
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o666)
+        self._server.listen(8)
+
+        self.running = True
+        for target in (self._read_loop, self._accept_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        print(f"GPS service listening on {self.socket_path}")
+        return True
+
+    def _clear_stale_socket(self):
+        """Remove a socket left behind by a crashed daemon, but not a live one"""
+        if not os.path.exists(self.socket_path):
+            return True
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+        except OSError as e:
+            if e.errno != errno.ECONNREFUSED:
+                print(f"GPS service: cannot use {self.socket_path}: {e}")
+                return False
+            os.remove(self.socket_path)
+            return True
+        finally:
+            probe.close()
+        print(f"GPS service already running on {self.socket_path}")
+        return False
+
+    def _read_loop(self):
+        """Background thread: read serial data and broadcast new fixes"""
+        while self.running:
+            try:
+                data = self.reader.read_gps_data()
+                if data:
+                    self.hub.publish(data)
+                    self._broadcast(data)
+                else:
+                    time.sleep(0.05)
+            except Exception as e:
+                print(f"Error in GPS service: {e}")
+                time.sleep(1)
+
+    def _accept_loop(self):
+        """Background thread: accept consumers and send them the latest fix"""
+        while self.running:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                break
+
+            conn.settimeout(1.0)
+            _, position, _ = self.hub.snapshot()
+            if position and not self._send(conn, position):
+                continue
+
+            with self._clients_lock:
+                self._clients.append(conn)
+
+    def _send(self, conn, position):
+        """Send one JSON line to a consumer, closing it on failure"""
+        try:
+            conn.sendall((json.dumps(position) + '\n').encode('utf-8'))
+            return True
+        except OSError:
+            conn.close()
+            return False
+
+    def _broadcast(self, position):
+        """Send a fix to every connected consumer, dropping dead ones"""
+        # Send outside the lock so a slow consumer doesn't hold up accept()
+        with self._clients_lock:
+            clients = list(self._clients)
+        dead = [c for c in clients if not self._send(c, position)]
+        if dead:
+            with self._clients_lock:
+                self._clients = [c for c in self._clients if c not in dead]
+
+    def stop(self):
+        """Stop threads and release the serial port and socket"""
+        self.running = False
+        if self._server:
+            self._server.close()
+        with self._clients_lock:
+            for conn in self._clients:
+                conn.close()
+            self._clients = []
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.reader.close()
+
+
+class GPSServiceClient:
+    """Consumer side of GPSService with the same interface as GPSReader"""
+
+    def __init__(self, socket_path=GPS_SOCKET_PATH):
+        self.socket_path = socket_path
+        self.hub = PositionHub()
+        self.running = False
+        self._sock = None
+        self._thread = None
+
+    @staticmethod
+    def service_available(socket_path=GPS_SOCKET_PATH):
+        """Check whether a GPS service socket exists"""
+        return os.path.exists(socket_path)
+
+    def connect(self):
+        """Connect to the GPS service and start listening for fixes"""
+        try:
+            self._open()
+        except OSError as e:
+            print(f"Error connecting to GPS service: {e}")
+            return False
+
+        self.running = True
+        self._thread = threading.Thread(target=self._listen_loop, daemon=True)
+        self._thread.start()
+        return True
+
+    def _open(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        self._sock = sock
+
+    def _listen_loop(self):
+        """Background thread: read JSON lines, reconnecting if the service restarts"""
+        while self.running:
+            try:
+                with self._sock.makefile('r', encoding='utf-8') as stream:
+                    for line in stream:
+                        try:
+                            self.hub.publish(json.loads(line))
+                        except ValueError:
+                            pass
+            except OSError:
+                pass
+            finally:
+                self._sock.close()
+
+            # Service went away - retry until it comes back
+            while self.running:
+                time.sleep(1)
+                try:
+                    self._open()
+                    break
+                except OSError:
+                    continue
+
+    def read_gps_data(self):
+        """Return the latest position (fixes are pushed in the background)"""
+        return self.get_current_position()
+
+    def get_current_position(self):
+        """Get the last known position"""
+        return self.hub.get_current_position()
+
+    def close(self):
+        """Disconnect from the GPS service"""
+        self.running = False
+        if self._sock:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Shared GPS service for local consumers')
+    parser.add_argument('--port', type=str, default='/dev/serial0',
+                       help='GPS serial port (default: /dev/serial0)')
+    parser.add_argument('--baudrate', type=int, default=9600,
+                       help='GPS baud rate (default: 9600)')
+    parser.add_argument('--socket', type=str, default=GPS_SOCKET_PATH,
+                       help=f'Unix socket to publish positions on (default: {GPS_SOCKET_PATH})')
+    args = parser.parse_args()
+
+    service = GPSService(port=args.port, baudrate=args.baudrate, socket_path=args.socket)
+    if not service.start():
+        print("Failed to start GPS service")
+        return
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\nShutting down...")
+    finally:
+        service.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+HTTP Caching for the Dashboards
+ETags derived from the data version, 304 answers to conditional GETs,
+gzip for large responses, and a production WSGI server mode
+"""
+
+import gzip
+import hashlib
+import json
+import threading
+import zlib
+from collections import OrderedDict
+
+from flask import Response, request
+
+# Only compress responses larger than this (bytes)
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 5
+
+# Serialized responses kept per (URL, version)
+MAX_CACHED_BODIES = 64
+
+_bodies = OrderedDict()
+_bodies_lock = threading.Lock()
+
+
+def make_etag(version):
+    """Strong ETag for a data version (any repr-able value)"""
+    return hashlib.sha1(repr(version).encode('utf-8')).hexdigest()[:20]
+
+
+def accepts_gzip():
+    """Check if the client accepts gzip responses"""
+    return 'gzip' in request.headers.get('Accept-Encoding', '').lower()
+
+
+def etag_for(version):
+    """ETag for the current URL at a data version"""
+    return make_etag((request.full_path, version))
+
+
+def cached_json(version, build):
+    """JSON response for data identified by version
+
+    build() is only called when the client does not already have this
+    version (If-None-Match) and no other request has serialized it yet;
+    the serialized (and gzipped) body is shared between clients.
+    """
+    etag = etag_for(version)
+
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    with _bodies_lock:
+        entry = _bodies.get(etag)
+        if entry is not None:
+            _bodies.move_to_end(etag)
+
+    if entry is None:
+        body = json.dumps(build(), separators=(',', ':')).encode('utf-8')
+        entry = {'body': body, 'gzip': None}
+        with _bodies_lock:
+            _bodies[etag] = entry
+            if len(_bodies) > MAX_CACHED_BODIES:
+                _bodies.popitem(last=False)
+
+    body = entry['body']
+    encoding = None
+    if len(body) >= GZIP_MIN_SIZE and accepts_gzip():
+        if entry['gzip'] is None:
+            entry['gzip'] = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        body = entry['gzip']
+        encoding = 'gzip'
+
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def streamed(chunks, version=None, mimetype='application/json'):
+    """Chunked response from a generator of str chunks
+
+    Memory use stays flat however large the body is; gzip is applied chunk
+    by chunk. With a version the response gets an ETag and conditional GETs
+    are answered with 304 before the generator runs.
+    """
+    etag = etag_for(version) if version is not None else None
+    if etag and etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    encoding = None
+    body = (chunk.encode('utf-8') for chunk in chunks)
+    if accepts_gzip():
+        body = _gzip_chunks(body)
+        encoding = 'gzip'
+
+    response = Response(body, mimetype=mimetype)
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def _gzip_chunks(chunks):
+    """Gzip a stream of byte chunks"""
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def compress_response(response):
+    """Gzip large responses for clients that accept it (after_request hook)"""
+    if (response.direct_passthrough or response.is_streamed or
+            response.status_code != 200 or 'Content-Encoding' in response.headers or
+            not accepts_gzip()):
+        return response
+
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+
+    response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Content-Length'] = str(len(response.get_data()))
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_app(app):
+    """Enable response compression for a Flask app"""
+    app.after_request(compress_response)
+
+
+def run_server(app, host='0.0.0.0', port=5000, debug=False, threads=16):
+    """Run with waitress when installed, otherwise the threaded Flask server
+
+    Streaming endpoints (server-sent events) hold one thread per client, so
+    threads should cover the expected number of open dashboards.
+    """
+    if debug:
+        app.run(host=host, port=port, debug=True, threaded=True)
+        return
+
+    try:
+        from waitress import serve
+    except ImportError:
+        print("waitress not installed (pip install waitress); using threaded Flask server")
+        app.run(host=host, port=port, debug=False, threaded=True)
+        return
+
+    print(f"Serving with waitress ({threads} threads)")
+    serve(app, host=host, port=port, threads=threads)
@@ -11,16 +11,35 @@ import argparse
 import json
 import sys
 import os
+import hmac
+import socket
+import shutil
+import threading
+from collections import Counter
+
+from detection_store import DetectionStore
+from frame_share import FramePublisher
+from model_reload import ModelReloader
+from thermal import ThermalGovernor, ThermalMonitor, apply_threads, default_levels
 
 # Add GPS module to path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'gps'))
 
 try:
     from gps_parser import GPSReader
-    GPS_AVAILABLE = True
+    GPS_SERIAL_AVAILABLE = True
+except ImportError:
+    GPS_SERIAL_AVAILABLE = False
+
+try:
+    from gps_service import GPSServiceClient
+    GPS_SERVICE_AVAILABLE = True
 except ImportError:
+    GPS_SERVICE_AVAILABLE = False
+
+GPS_AVAILABLE = GPS_SERIAL_AVAILABLE or GPS_SERVICE_AVAILABLE
+if not GPS_AVAILABLE:
     print("WARNING: GPS module not available. Location tracking disabled.")
-    GPS_AVAILABLE = False
 
 try:
     import RPi.GPIO as GPIO
@@ -44,6 +63,12 @@ LED_PINS = {
     'lalat_buah': 22       # Blue LED
 }
 
+# Classes reported by the detector
+VALID_CLASSES = ['antraknosa', 'cabai_normal', 'lalat_buah']
+
+# Seconds between MQTT heartbeats (FPS, counts and thermal state)
+HEARTBEAT_INTERVAL = 30
+
 def setup_leds():
     """Initialize GPIO pins for LED control"""
     if not GPIO_AVAILABLE:
@@ -92,8 +117,14 @@ def cleanup_leds():
         except:
             pass
 
-def setup_mqtt(broker="broker.hivemq.com", port=1883, client_id=None):
-    """Setup MQTT client for remote monitoring"""
+def setup_mqtt(broker="broker.hivemq.com", port=1883, client_id=None, status_topic=None,
+               control_topics=None, on_control=None):
+    """Setup MQTT client for remote monitoring
+
+    status_topic gets a retained "online" message, and "offline" as the last
+    will when the connection drops, so the fleet dashboard knows which Pis
+    are alive. JSON messages on control_topics are passed to on_control.
+    """
     if not MQTT_AVAILABLE:
         return None
     
@@ -109,8 +140,30 @@ def setup_mqtt(broker="broker.hivemq.com", port=1883, client_id=None):
             # Fall back to old API (paho-mqtt < 2.0)
             client = mqtt.Client(client_id)
         
+        if status_topic:
+            client.will_set(status_topic, 'offline', qos=1, retain=True)
+        
+        if control_topics and on_control:
+            def on_connect(client, userdata, flags, rc):
+                # (Re)subscribe on every connect
+                for topic in control_topics:
+                    client.subscribe(topic, qos=1)
+            
+            def on_message(client, userdata, msg):
+                try:
+                    command = json.loads(msg.payload.decode('utf-8'))
+                except ValueError:
+                    print(f"Ignoring malformed control message on {msg.topic}")
+                    return
+                if isinstance(command, dict):
+                    on_control(command)
+            
+            client.on_connect = on_connect
+            client.on_message = on_message
         client.connect(broker, port, 60)
         client.loop_start()
+        if status_topic:
+            client.publish(status_topic, 'online', qos=1, retain=True)
         print(f"MQTT connected to {broker}:{port}")
         print(f"Client ID: {client_id}")
         return client
@@ -127,6 +180,33 @@ def publish_detection(mqtt_client, topic, detection_data):
         except Exception as e:
             print(f"MQTT publish error: {e}")
 
+class SessionLog:
+    """Detections of the running session, appended as JSON lines
+
+    dashboard_server.py parses only the lines added since its last read, so
+    each detection costs one short write however long the session runs,
+    and only the per-class counts are kept in memory.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.class_counts = Counter()
+        self._file = None
+    
+    def append(self, detection):
+        if self._file is None:
+            self._file = open(self.path, 'w')
+        self._file.write(json.dumps(detection) + '\n')
+        self._file.flush()
+        self.count += 1
+        self.class_counts[detection['class']] += 1
+    
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
 def setup_camera(width=416, height=416, fps=30):
     """Initialize camera with specified settings"""
     # Try different camera indices (0 for USB, sometimes 1 for Pi Camera)
@@ -143,17 +223,35 @@ def setup_camera(width=416, height=416, fps=30):
     return None
 
 def run_inference(model_path, show_display=True, save_video=False, frame_skip=1,
-                  enable_mqtt=False, mqtt_broker="broker.hivemq.com", mqtt_topic="chili/detections",
-                  enable_gps=False):
-    """Run real-time inference on camera feed"""
+                  enable_mqtt=False, mqtt_broker="broker.hivemq.com", mqtt_topic=None,
+                  enable_gps=False, db_path='detections.db', device_id=None, enable_preview=True,
+                  imgsz=416, enable_thermal=True, thermal_root='/', low_res_model=None,
+                  low_res_imgsz=320, enable_reload=True, max_latency_ms=None, control_token=None):
+    """Run real-time inference on camera feed
+
+    With enable_thermal, inference slows down (rate, threads, then
+    resolution) as the SoC heats up, before the firmware throttles it.
+    Resolution is only lowered for .pt models (which run at any size) or
+    when low_res_model, an export at low_res_imgsz, is given.
+
+    With enable_reload, a new model written to model_path (or requested
+    over MQTT) is loaded in the background and swapped in between frames.
+    MQTT control messages are only accepted when control_token is set, and
+    must carry it: the default broker is public.
+    """
     
     print("=" * 60)
     print("Chili Disease Detection - Raspberry Pi")
     print("=" * 60)
     print(f"Model: {model_path}")
+    print(f"Image size: {imgsz}")
     print(f"Frame skip: {frame_skip} (process every {frame_skip} frame(s))")
     print(f"MQTT: {'Enabled' if enable_mqtt else 'Disabled'}")
     print(f"GPS: {'Enabled' if enable_gps else 'Disabled'}")
+    print(f"Database: {db_path if db_path else 'Disabled'}")
+    print(f"Remote preview: {'Enabled' if enable_preview else 'Disabled'}")
+    print(f"Thermal governor: {'Enabled' if enable_thermal else 'Disabled'}")
+    print(f"Hot model reload: {'Enabled' if enable_reload else 'Disabled'}")
     print(f"Press 'q' to quit")
     print("=" * 60)
     
@@ -163,23 +261,67 @@ def run_inference(model_path, show_display=True, save_video=False, frame_skip=1,
         os.remove(session_file)
         print(f"\nCleared previous session data")
     
+    # Open the detection database (queried by the dashboard)
+    detection_store = None
+    # The backup written at the end (detections_<start>.json) is named after
+    # this session, so detection_store.py won't import it a second time
+    session_start = int(time.time())
+    session_name = f"session_{session_start}"
+    if db_path:
+        try:
+            detection_store = DetectionStore(db_path)
+        except Exception as e:
+            print(f"Failed to open detection database: {e}")
+    
     # Load the TFLite model
     print("\nLoading model...")
     model = YOLO(model_path, task='detect')
+    models = {imgsz: model}
+    
+    # Thermal governor: trades rate, threads and resolution for temperature
+    governor = None
+    low_imgsz = low_res_imgsz if model_path.endswith('.pt') or low_res_model else None
+    # The TFLite interpreter's thread count is fixed when the model is loaded
+    scale_threads = not model_path.endswith('.tflite')
+    if enable_thermal:
+        monitor = ThermalMonitor(thermal_root)
+        if monitor.available():
+            levels = default_levels(imgsz, low_imgsz=low_imgsz, scale_threads=scale_threads)
+            governor = ThermalGovernor(monitor, levels)
+            print(f"Thermal governor: {len(levels)} levels, "
+                  f"step down at {governor.high_temp:.0f}C, up below {governor.low_temp:.0f}C")
+            if not scale_threads:
+                print("Thermal governor: TFLite model, thread count fixed (rate and resolution steps only)")
+        else:
+            print(f"Thermal governor disabled: no thermal zone at {monitor.temp_path}")
+    settings = governor.settings if governor else {'max_fps': None, 'imgsz': imgsz}
+    if governor:
+        apply_threads(settings['threads'])
     
     # Setup GPS
     gps_reader = None
-    if enable_gps and GPS_AVAILABLE:
+    gps_stop = None
+    gps_thread = None
+    if enable_gps and GPS_SERVICE_AVAILABLE and GPSServiceClient.service_available():
+        # Share the serial port with other consumers through gps_service.py
+        print("\nSetting up GPS (shared GPS service)...")
+        gps_reader = GPSServiceClient()
+        if gps_reader.connect():
+            print("GPS service connected successfully")
+        else:
+            gps_reader = None
+    
+    if enable_gps and gps_reader is None and GPS_SERIAL_AVAILABLE:
         print("\nSetting up GPS...")
+        print("(Run gps/gps_service.py to share the GPS with other processes)")
         gps_reader = GPSReader()
         if gps_reader.connect():
             print("GPS connected successfully")
             # Start reading GPS data in background
-            import threading
-            gps_thread_running = True
+            gps_stop = threading.Event()
             
             def gps_background_reader():
-                while gps_thread_running:
+                while not gps_stop.is_set():
                     gps_reader.read_gps_data()
                     time.sleep(0.1)
             
@@ -193,11 +335,50 @@ def run_inference(model_path, show_display=True, save_video=False, frame_skip=1,
     
     # Setup MQTT
     mqtt_client = None
+    reloader = None
+    
+    def handle_control(command):
+        """MQTT control message: reload_model (path, imgsz) or rollback_model"""
+        if not hmac.compare_digest(str(command.get('token', '')), control_token):
+            print(f"Ignoring control message without a valid token: {command.get('action')}")
+            return
+        if reloader is None:
+            return
+        action = command.get('action')
+        if action == 'reload_model':
+            reloader.request(command.get('path'), command.get('imgsz'))
+        elif action == 'rollback_model':
+            reloader.request_rollback()
+    
     if enable_mqtt:
         print("\nSetting up MQTT...")
-        mqtt_client = setup_mqtt(broker=mqtt_broker)
+        # Each Pi publishes on its own topics: chili/<device>/detections
+        device_id = device_id or socket.gethostname()
+        if not mqtt_topic:
+            mqtt_topic = f"chili/{device_id}/detections"
+        heartbeat_topic = f"chili/{device_id}/heartbeat"
+        # Control topics are opt-in: anyone can publish on a public broker
+        control_topics = [f"chili/{device_id}/control", "chili/all/control"] if control_token else None
+        mqtt_client = setup_mqtt(broker=mqtt_broker, client_id=f"chili_{device_id}",
+                                 status_topic=f"chili/{device_id}/status",
+                                 control_topics=control_topics,
+                                 on_control=handle_control)
         if mqtt_client:
             print(f"Publishing to topic: {mqtt_topic}")
+            if control_topics:
+                print(f"Accepting control messages on: {', '.join(control_topics)}")
+    
+    # Hot model reload: watch the model file and MQTT control messages
+    if enable_reload:
+        def on_model_event(event):
+            if mqtt_client:
+                publish_detection(mqtt_client, f"chili/{device_id}/model", event)
+        
+        reloader = ModelReloader(lambda path: YOLO(path, task='detect'), model, model_path, imgsz,
+                                 expected_classes=VALID_CLASSES, max_latency_ms=max_latency_ms,
+                                 on_event=on_model_event)
+        reloader.start()
+        print(f"\nWatching {model_path} for model updates")
     
     # Setup LEDs
     print("\nSetting up LEDs...")
@@ -212,6 +393,14 @@ def run_inference(model_path, show_display=True, save_video=False, frame_skip=1,
         cleanup_leds()
         return
     
+    # Remote preview: frames are only copied while the dashboard is watching
+    preview = None
+    if enable_preview:
+        try:
+            preview = FramePublisher()
+        except Exception as e:
+            print(f"Remote preview unavailable: {e}")
+    
     # Video writer setup (if saving)
     video_writer = None
     if save_video:
@@ -223,9 +412,11 @@ def run_inference(model_path, show_display=True, save_video=False, frame_skip=1,
     inference_count = 0
     start_time = time.time()
     fps_display = 0
+    last_inference = 0
+    last_heartbeat = 0
     
     # Detection tracking
-    detections_log = []
+    session_log = SessionLog(session_file)
     
     print("\nStarting inference...\n")
     
@@ -238,8 +429,35 @@ def run_inference(model_path, show_display=True, save_video=False, frame_skip=1,
             
             frame_count += 1
             
-            # Skip frames to improve FPS
-            if frame_count % frame_skip != 0:
+            # Step inference settings with the SoC temperature
+            if governor and governor.update():
+                settings = governor.settings
+                apply_threads(settings['threads'])
+                if settings['imgsz'] not in models:
+                    models[settings['imgsz']] = YOLO(low_res_model, task='detect') if low_res_model else model
+                temp = governor.state['temp_c']
+                threads = f"{settings['threads']} threads, " if settings['threads'] else ''
+                print(f"Thermal: {f'{temp:.1f}C' if temp is not None else 'throttled'} -> level {governor.level} "
+                      f"(max {settings['max_fps'] or 'unlimited'} FPS, {threads}{settings['imgsz']}px)")
+            
+            # Swap in a reloaded model (or roll back a bad one) between frames
+            if reloader:
+                swap = reloader.poll()
+                if swap:
+                    old_model = model
+                    model, imgsz = swap
+                    models = {size: m for size, m in models.items() if m is not old_model}
+                    models[imgsz] = model
+                    if governor and governor.levels[0]['imgsz'] != imgsz:
+                        governor.set_levels(default_levels(imgsz, low_imgsz=low_imgsz,
+                                                           scale_threads=scale_threads))
+                    settings = governor.settings if governor else {'max_fps': None, 'imgsz': imgsz}
+                    if settings['imgsz'] not in models:
+                        models[settings['imgsz']] = YOLO(low_res_model, task='detect') if low_res_model else model
+            
+            # Skip frames to improve FPS (and to keep the rate the governor allows)
+            min_interval = 1.0 / settings['max_fps'] if settings['max_fps'] else 0
+            if frame_count % frame_skip != 0 or time.time() - last_inference < min_interval:
                 if show_display:
                     cv2.imshow('Chili Disease Detection', frame)
                 if cv2.waitKey(1) & 0xFF == ord('q'):
@@ -250,15 +468,26 @@ def run_inference(model_path, show_display=True, save_video=False, frame_skip=1,
             
             # Run inference
             inference_start = time.time()
-            results = model.predict(
-                source=frame,
-                imgsz=416,
-                conf=0.5,  # Confidence threshold
-                iou=0.45,  # NMS threshold
-                verbose=False,
-                device='cpu'  # Raspberry Pi uses CPU
-            )
+            last_inference = inference_start
+            active_model = models[settings['imgsz']]
+            try:
+                results = active_model.predict(
+                    source=frame,
+                    imgsz=settings['imgsz'],
+                    conf=0.5,  # Confidence threshold
+                    iou=0.45,  # NMS threshold
+                    verbose=False,
+                    device='cpu'  # Raspberry Pi uses CPU
+                )
+            except Exception as e:
+                # A freshly reloaded model is rolled back before the next frame
+                if reloader and active_model is model and reloader.fail(e):
+                    continue
+                raise
             inference_time = time.time() - inference_start
+            if reloader and active_model is model:
+                reloader.record_latency(inference_time)
+                reloader.sample = frame
             
             # Get annotated frame
             annotated_frame = results[0].plot()
@@ -278,14 +507,11 @@ def run_inference(model_path, show_display=True, save_video=False, frame_skip=1,
             detections = results[0].boxes
             detected_classes = set()
             
-            # Define valid disease classes to detect
-            VALID_CLASSES = ['antraknosa', 'cabai_normal', 'lalat_buah']
-            
             if len(detections) > 0:
                 for box in detections:
                     cls_id = int(box.cls[0])
                     conf = float(box.conf[0])
-                    class_name = model.names[cls_id]
+                    class_name = active_model.names[cls_id]
                     
                     # Only process detections from our 3 target classes
                     if class_name not in VALID_CLASSES:
@@ -314,15 +540,17 @@ def run_inference(model_path, show_display=True, save_video=False, frame_skip=1,
                             'confidence': float(conf),
                             'location': gps_coords
                         }
-                        detections_log.append(detection_info)
-                        
-                        # Save to current_session.json immediately for real-time dashboard
                         try:
-                            with open(session_file, 'w') as f:
-                                json.dump(detections_log, f, indent=2)
+                            session_log.append(detection_info)
                         except Exception as e:
                             print(f"Failed to save session file: {e}")
                         
+                        if detection_store:
+                            try:
+                                detection_store.add(detection_info, session_name)
+                            except Exception as e:
+                                print(f"Failed to store detection: {e}")
+                        
                         # Print detection
                         location_str = ""
                         if gps_coords:
@@ -340,13 +568,31 @@ def run_inference(model_path, show_display=True, save_video=False, frame_skip=1,
             if show_display:
                 cv2.imshow('Chili Disease Detection', annotated_frame)
             
+            # Share frame with the dashboard's live preview
+            if preview:
+                preview.publish(annotated_frame)
+            
             # Save video
             if save_video and video_writer:
                 video_writer.write(annotated_frame)
             
             # Print stats every 5 seconds
             if inference_count % (5 * fps_display) == 0 and inference_count > 0:
-                print(f"Stats - FPS: {fps_display:.2f}, Total detections: {len(detections_log)}")
+                thermal_str = ""
+                if governor and governor.state['temp_c'] is not None:
+                    thermal_str = f", Temp: {governor.state['temp_c']:.1f}C, Level: {governor.level}"
+                print(f"Stats - FPS: {fps_display:.2f}, Total detections: {session_log.count}{thermal_str}")
+            
+            # Heartbeat for the fleet dashboard
+            if mqtt_client and time.time() - last_heartbeat >= HEARTBEAT_INTERVAL:
+                last_heartbeat = time.time()
+                publish_detection(mqtt_client, heartbeat_topic, {
+                    'timestamp': last_heartbeat,
+                    'fps': fps_display,
+                    'inferences': inference_count,
+                    'detections': session_log.count,
+                    'thermal': governor.snapshot() if governor else None
+                })
             
             # Check for quit
             if cv2.waitKey(1) & 0xFF == ord('q'):
@@ -365,34 +611,28 @@ def run_inference(model_path, show_display=True, save_video=False, frame_skip=1,
         print(f"Inferences run: {inference_count}")
         print(f"Total time: {total_time:.2f}s")
         print(f"Average FPS: {fps_display:.2f}")
-        print(f"Total detections: {len(detections_log)}")
+        print(f"Total detections: {session_log.count}")
+        
+        if governor and governor.max_temp is not None:
+            print(f"\nThermal: max {governor.max_temp:.1f}C, "
+                  f"{governor.throttle_events} throttling event(s), {governor.level_changes} level change(s)")
+            for level, seconds in enumerate(governor.level_times()):
+                if seconds:
+                    print(f"  - Level {level} {governor.levels[level]}: {seconds:.0f}s")
         
         # Disease distribution
-        if detections_log:
+        if session_log.count:
             print("\nDetection Summary:")
-            disease_counts = {}
-            for det in detections_log:
-                disease_counts[det['class']] = disease_counts.get(det['class'], 0) + 1
-            
-            for disease, count in disease_counts.items():
+            for disease, count in session_log.class_counts.items():
                 print(f"  - {disease}: {count}")
         
-        # Save detections log to JSON
-        if detections_log:
-            # Save to current_session.json for real-time dashboard
-            session_file = "current_session.json"
+        # current_session.json stays for the dashboard; keep a timestamped backup
+        session_log.close()
+        if session_log.count:
+            print(f"\nSession detections: {session_file}")
+            log_file = f"detections_{session_start}.json"
             try:
-                with open(session_file, 'w') as f:
-                    json.dump(detections_log, f, indent=2)
-                print(f"\nSession detections: {session_file}")
-            except Exception as e:
-                print(f"Failed to save session file: {e}")
-            
-            # Also save timestamped backup
-            log_file = f"detections_{int(time.time())}.json"
-            try:
-                with open(log_file, 'w') as f:
-                    json.dump(detections_log, f, indent=2)
+                shutil.copyfile(session_file, log_file)
                 print(f"Backup saved to: {log_file}")
             except Exception as e:
                 print(f"Failed to save backup: {e}")
@@ -405,10 +645,24 @@ def run_inference(model_path, show_display=True, save_video=False, frame_skip=1,
         cv2.destroyAllWindows()
         
         if mqtt_client and MQTT_AVAILABLE:
-            mqtt_client.loop_stop()
+            # A clean disconnect doesn't send the last will, so say goodbye first
+            mqtt_client.publish(f"chili/{device_id}/status", 'offline', qos=1, retain=True)
             mqtt_client.disconnect()
+            mqtt_client.loop_stop()
             print("MQTT disconnected")
         
+        if reloader:
+            reloader.stop()
+        
+        if detection_store:
+            detection_store.close()
+        
+        if preview:
+            preview.close()
+        
+        if gps_stop:
+            gps_stop.set()
+            gps_thread.join(timeout=2)
         if gps_reader:
             gps_reader.close()
             print("GPS disconnected")
@@ -419,6 +673,8 @@ def main():
     parser = argparse.ArgumentParser(description='Chili Disease Detection on Raspberry Pi')
     parser.add_argument('--model', type=str, required=True,
                        help='Path to TFLite model file')
+    parser.add_argument('--imgsz', type=int, default=416,
+                       help='Model input size (see recommended_imgsz in exports/manifest.json)')
     parser.add_argument('--no-display', action='store_true',
                        help='Run without display (headless mode)')
     parser.add_argument('--save-video', action='store_true',
@@ -429,10 +685,31 @@ def main():
                        help='Enable MQTT publishing for remote monitoring')
     parser.add_argument('--mqtt-broker', type=str, default='broker.hivemq.com',
                        help='MQTT broker address (default: broker.hivemq.com)')
-    parser.add_argument('--mqtt-topic', type=str, default='chili/detections',
-                       help='MQTT topic for publishing detections (default: chili/detections)')
+    parser.add_argument('--mqtt-topic', type=str, default=None,
+                       help='MQTT topic for publishing detections (default: chili/<device-id>/detections)')
+    parser.add_argument('--no-preview', action='store_true',
+                       help='Disable the live preview shared with dashboard_server.py')
+    parser.add_argument('--device-id', type=str, default=None,
+                       help='Device name used in MQTT topics (default: hostname)')
     parser.add_argument('--gps', action='store_true',
                        help='Enable GPS location tracking for detections')
+    parser.add_argument('--no-thermal', action='store_true',
+                       help='Disable the thermal governor (slows down before the Pi throttles)')
+    parser.add_argument('--thermal-root', type=str, default='/',
+                       help='Root of the sysfs tree read by the thermal governor (default: /)')
+    parser.add_argument('--low-res-model', type=str, default=None,
+                       help='Lower resolution export the thermal governor may switch to')
+    parser.add_argument('--low-res-imgsz', type=int, default=320,
+                       help='Input size of --low-res-model, or of .pt models when hot (default: 320)')
+    parser.add_argument('--no-model-reload', action='store_true',
+                       help="Don't watch --model for updates or accept reload control messages")
+    parser.add_argument('--max-latency-ms', type=float, default=None,
+                       help='Roll back reloaded models slower than this (median over probation)')
+    parser.add_argument('--control-token', type=str, default=os.environ.get('CHILI_CONTROL_TOKEN'),
+                       help='Accept MQTT control messages (reload/rollback) carrying this token '
+                            '(default: $CHILI_CONTROL_TOKEN; off when unset)')
+    parser.add_argument('--db', type=str, default='detections.db',
+                       help='SQLite database for detections (default: detections.db, "" to disable)')
     
     args = parser.parse_args()
     
@@ -444,7 +721,18 @@ def main():
         enable_mqtt=args.mqtt,
         mqtt_broker=args.mqtt_broker,
         mqtt_topic=args.mqtt_topic,
-        enable_gps=args.gps
+        enable_gps=args.gps,
+        db_path=args.db,
+        device_id=args.device_id,
+        enable_preview=not args.no_preview,
+        imgsz=args.imgsz,
+        enable_thermal=not args.no_thermal,
+        thermal_root=args.thermal_root,
+        low_res_model=args.low_res_model,
+        low_res_imgsz=args.low_res_imgsz,
+        enable_reload=not args.no_model_reload,
+        max_latency_ms=args.max_latency_ms,
+        control_token=args.control_token
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,271 @@
+"""
+Hot Model Reload
+Loads a new model into a running inference_pi.py without stopping the
+camera, GPS, MQTT or the session. A background thread watches the model
+file (or takes reload requests from MQTT control messages), loads and warms
+up the new model, checks it, and hands it over; the inference loop swaps it
+in between two frames. A swapped-in model is on probation for its first
+frames and is rolled back if it fails or is much slower than the old one.
+"""
+
+import hashlib
+import os
+import queue
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+POLL_INTERVAL = 2.0       # seconds between checks of the watched file
+WARMUP_RUNS = 2           # untimed runs after loading
+CHECK_RUNS = 5            # timed runs, reported with the swap
+LATENCY_FACTOR = 1.5      # max slowdown vs. the replaced model
+PROBATION_FRAMES = 50     # frames a new model runs before it is kept
+LATENCY_WINDOW = 50       # recent inference times kept for the baseline
+
+
+def file_signature(path):
+    """(mtime, size, inode) of a file, or None if it doesn't exist"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size, st.st_ino
+
+
+def file_digest(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ModelReloader:
+    """Background loading, checking and hand-over of new models
+
+    load_model(path) returns a model with predict() and names, like
+    ultralytics' YOLO. The inference loop calls poll() between frames and
+    switches to the (model, imgsz) it returns, reports each inference time
+    with record_latency() and a failed inference with fail(). Events
+    (loaded, swapped, rejected, rolled_back) go to on_event(dict).
+
+    Control requests may only name files in the watched model's directory.
+    """
+
+    def __init__(self, load_model, model, model_path, imgsz, watch=True,
+                 expected_classes=None, max_latency_ms=None, on_event=None,
+                 poll_interval=POLL_INTERVAL):
+        self.load_model = load_model
+        self.model_path = os.path.abspath(model_path)
+        self.model_dir = os.path.dirname(self.model_path)
+        self.watch = watch
+        self.expected_classes = set(expected_classes or [])
+        self.max_latency_ms = max_latency_ms
+        self.on_event = on_event
+        self.poll_interval = poll_interval
+        self.sample = None
+
+        digest = file_digest(self.model_path) if os.path.isfile(self.model_path) else None
+        # (model, path, imgsz, content digest) of the running and the
+        # replaced model
+        self._active = (model, self.model_path, imgsz, digest)
+        self._previous = None
+        self._pending = None
+        self._signature = file_signature(self.model_path)
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._baseline = None
+        self._probation = 0
+        self._requests = queue.Queue()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._snapshots = tempfile.TemporaryDirectory(prefix='chili_models_')
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._requests.put(None)
+        self._thread.join(timeout=5)
+        self._snapshots.cleanup()
+
+    @property
+    def on_probation(self):
+        return self._probation > 0
+
+    def _emit(self, event, **info):
+        info.update(event=event, timestamp=time.time())
+        print(f"Model reload: {event} " + ', '.join(f"{k}={v}" for k, v in info.items()
+                                                  if k not in ('event', 'timestamp')))
+        if self.on_event:
+            try:
+                self.on_event(info)
+            except Exception as e:
+                print(f"Model event handler error: {e}")
+
+    # Requests (any thread)
+
+    def request(self, path=None, imgsz=None):
+        """Load path (the watched model by default), optionally at a new imgsz"""
+        path = os.path.abspath(path or self.model_path)
+        if os.path.dirname(path) != self.model_dir:
+            self._emit('rejected', path=path, reason=f"not in {self.model_dir}")
+            return False
+        self._requests.put(('load', path, imgsz))
+        return True
+
+    def request_rollback(self):
+        self._requests.put(('rollback', None, None))
+
+    # Inference loop side
+
+    def record_latency(self, seconds):
+        """Report one inference time of the active model"""
+        self._latencies.append(seconds)
+        if self._probation:
+            self._probation -= 1
+            if not self._probation:
+                self._end_probation()
+
+    def fail(self, reason):
+        """The active model failed an inference: roll back if it is on
+        probation; returns True when a rollback is coming"""
+        if not self._probation:
+            return False
+        return self._rollback(f"inference failed: {reason}")
+
+    def poll(self):
+        """(model, imgsz) to switch to, or None; call between frames"""
+        with self._lock:
+            pending, self._pending = self._pending, None
+        if pending is None:
+            return None
+
+        kind, candidate, check_ms = pending
+        if kind == 'rollback':
+            self._active = candidate
+            self._previous = None
+            self._probation = 0
+        else:
+            recent = list(self._latencies)
+            self._baseline = statistics.median(recent) if recent else None
+            self._previous = self._active
+            self._active = candidate
+            self._probation = PROBATION_FRAMES
+            self._emit('swapped', path=candidate[1], imgsz=candidate[2], check_ms=round(check_ms, 1))
+        self._latencies.clear()
+        model, _, imgsz, _ = self._active
+        return model, imgsz
+
+    def _latency_limit(self, baseline):
+        limits = []
+        if self.max_latency_ms:
+            limits.append(self.max_latency_ms / 1000.0)
+        if baseline:
+            limits.append(baseline * LATENCY_FACTOR)
+        return min(limits) if limits else None
+
+    def _end_probation(self):
+        median = statistics.median(self._latencies) if self._latencies else 0
+        limit = self._latency_limit(self._baseline)
+        if limit and median > limit:
+            self._rollback(f"median latency {median * 1000:.0f} ms over {limit * 1000:.0f} ms")
+        else:
+            # The replaced model stays available for a manual rollback
+            self._emit('kept', path=self._active[1], latency_ms=round(median * 1000, 1))
+
+    def _rollback(self, reason):
+        previous = self._previous
+        if previous is None:
+            return False
+        self._probation = 0
+        with self._lock:
+            self._pending = ('rollback', previous, 0)
+        self._emit('rolled_back', path=self._active[1], restored=previous[1], reason=reason)
+        return True
+
+    # Loader thread
+
+    def _run(self):
+        pending_signature = None
+        while not self._stop.is_set():
+            try:
+                item = self._requests.get(timeout=self.poll_interval)
+            except queue.Empty:
+                item = ('watch', None, None)
+            if item is None:
+                break
+            action, path, imgsz = item
+
+            if action == 'rollback':
+                if not self._rollback('rollback requested'):
+                    self._emit('rejected', reason='no previous model to roll back to')
+                continue
+            if action == 'watch':
+                if not self.watch:
+                    continue
+                signature = file_signature(self.model_path)
+                if signature is None or signature == self._signature:
+                    pending_signature = None
+                    continue
+                if signature != pending_signature:
+                    # Wait until the file stops changing (copy in progress)
+                    pending_signature = signature
+                    continue
+                self._signature = signature
+                pending_signature = None
+                path = self.model_path
+
+            try:
+                self._load(path, imgsz or self._active[2])
+            except Exception as e:
+                self._emit('rejected', path=path, reason=str(e))
+
+    def _snapshot(self, path):
+        """Private copy of a model file, so later writes to path can't
+        change a loaded model; directories (saved models) are used as is"""
+        if not os.path.isfile(path):
+            return path, None
+        digest = file_digest(path)
+        snapshot = os.path.join(self._snapshots.name, digest + os.path.splitext(path)[1])
+        if not os.path.exists(snapshot):
+            shutil.copyfile(path, snapshot)
+        return snapshot, digest
+
+    def _load(self, path, imgsz):
+        snapshot, digest = self._snapshot(path)
+        if digest and digest == self._active[3] and imgsz == self._active[2]:
+            return
+
+        start = time.time()
+        model = self.load_model(snapshot)
+        load_s = time.time() - start
+
+        names = set(getattr(model, 'names', {}).values())
+        missing = self.expected_classes - names
+        if missing:
+            raise ValueError(f"model lacks classes: {', '.join(sorted(missing))}")
+
+        # The check runs on this thread while the inference loop keeps the
+        # cores busy, so its timing isn't comparable with the loop's; latency
+        # is judged on probation, with both models timed by the loop
+        frame = self.sample if self.sample is not None else np.full((imgsz, imgsz, 3), 114, np.uint8)
+        times = []
+        for i in range(WARMUP_RUNS + CHECK_RUNS):
+            t0 = time.time()
+            results = model.predict(source=frame, imgsz=imgsz, verbose=False, device='cpu')
+            if i >= WARMUP_RUNS:
+                times.append(time.time() - t0)
+            if not results or not hasattr(results[0], 'boxes'):
+                raise ValueError("model returned no detection results")
+        check = statistics.median(times)
+
+        self._emit('loaded', path=path, imgsz=imgsz, load_s=round(load_s, 2))
+        with self._lock:
+            self._pending = ('swap', (model, path, imgsz, digest), check * 1000)
@@ -1,17 +1,33 @@
 import paho.mqtt.client as mqtt
 import json
 from datetime import datetime
+from fleet_ingest import SUBSCRIPTIONS, parse_topic
 
 def on_connect(client, userdata, flags, rc):
     print(f"Connected! Code: {rc}")
-    client.subscribe("chili/detections")
-    print("Subscribed to: chili/detections")
+    for topic in SUBSCRIPTIONS:
+        client.subscribe(topic)
+    print(f"Subscribed to: {', '.join(SUBSCRIPTIONS)}")
     print("-" * 60)
 
 def on_message(client, userdata, msg):
+    device, kind = parse_topic(msg.topic)
+    if kind == 'status':
+        print(f"[{device}] {msg.payload.decode()}")
+        return
+    if kind == 'heartbeat':
+        try:
+            data = json.loads(msg.payload.decode())
+            thermal = data.get('thermal') or {}
+            temp = f"{thermal['temp_c']:.1f}C" if thermal.get('temp_c') is not None else 'n/a'
+            print(f"[{device}] heartbeat - FPS: {data.get('fps', 0):.1f}, temp: {temp}, "
+                  f"level: {thermal.get('level', 'n/a')}")
+        except Exception:
+            print(f"[{device}] heartbeat: {msg.payload.decode()}")
+        return
     try:
         data = json.loads(msg.payload.decode())
-        print(f"[{data['datetime']}] {data['class']} - Confidence: {data['confidence']:.2f}")
+        print(f"[{data['datetime']}] {device}: {data['class']} - Confidence: {data['confidence']:.2f}")
     except Exception as e:
         print(f"Raw message: {msg.payload.decode()}")
 
@@ -21,4 +37,4 @@ client.on_message = on_message
 
 print("Connecting to broker.hivemq.com...")
 client.connect("broker.hivemq.com", 1883, 60)
-client.loop_forever()
\ No newline at end of file
+client.loop_forever()
@@ -0,0 +1,110 @@
+"""
+Live Camera Preview
+MJPEG stream of the inference process's annotated frames. One encoder thread
+runs while at least one viewer is connected; every viewer shares its JPEGs
+"""
+
+import threading
+import time
+
+try:
+    import cv2
+    from frame_share import FrameReader
+    PREVIEW_AVAILABLE = True
+except ImportError:
+    PREVIEW_AVAILABLE = False
+
+# Frame rate cap for the encoder and default for viewers
+PREVIEW_FPS = 5
+MAX_PREVIEW_FPS = 15
+
+JPEG_QUALITY = 70
+
+# Re-attach to the shared memory if no new frame arrives for this long
+# (the inference process may have been restarted)
+RECONNECT_AFTER = 5.0
+
+BOUNDARY = 'frame'
+
+
+class PreviewStream:
+    """Encodes shared-memory frames to JPEG on demand"""
+
+    def __init__(self, reader=None, max_fps=MAX_PREVIEW_FPS, quality=JPEG_QUALITY):
+        self.reader = reader or (FrameReader() if PREVIEW_AVAILABLE else None)
+        self.max_fps = max_fps
+        self.quality = quality
+        self.viewers = 0
+        self._seq = 0
+        self._jpeg = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._new_frame = threading.Condition(self._lock)
+
+    def available(self):
+        """Check if an inference process is publishing frames
+
+        Read-only: only the encoder, which runs while someone is watching,
+        checks in as a viewer, so publishing doesn't start for a mere check.
+        """
+        with self._lock:
+            return self.reader is not None and self.reader.available()
+
+    def _encoder(self):
+        """Encode new frames while anyone is watching"""
+        last_seq = 0
+        last_frame = time.time()
+        interval = 1.0 / self.max_fps
+
+        while True:
+            started = time.time()
+            with self._lock:
+                if not self.viewers:
+                    # Don't show a stale frame to the next viewer
+                    self._thread = None
+                    self._jpeg = None
+                    return
+                self.reader.check_in()
+                result = self.reader.read(last_seq)
+                if result is None and started - last_frame > RECONNECT_AFTER:
+                    self.reader.reconnect()
+                    last_frame = started
+                    last_seq = 0
+
+            if result is not None:
+                last_seq, _, frame = result
+                last_frame = started
+                ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                if ok:
+                    with self._new_frame:
+                        self._seq += 1
+                        self._jpeg = jpeg.tobytes()
+                        self._new_frame.notify_all()
+
+            time.sleep(max(0.0, interval - (time.time() - started)))
+
+    def frames(self, fps=PREVIEW_FPS):
+        """Generate multipart MJPEG chunks for one viewer at up to fps"""
+        interval = 1.0 / max(0.1, min(fps, self.max_fps))
+        with self._lock:
+            self.viewers += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._encoder, daemon=True)
+                self._thread.start()
+
+        try:
+            seq = 0
+            while True:
+                started = time.time()
+                with self._new_frame:
+                    # Re-send the last frame now and then so a closed
+                    # connection is noticed even when the camera stalls
+                    self._new_frame.wait_for(lambda: self._seq != seq, timeout=RECONNECT_AFTER)
+                    seq, jpeg = self._seq, self._jpeg
+                if jpeg is not None:
+                    yield (f'--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n'
+                           f'Content-Length: {len(jpeg)}\r\n\r\n').encode() + jpeg + b'\r\n'
+                time.sleep(max(0.0, interval - (time.time() - started)))
+        finally:
+            with self._lock:
+                self.viewers -= 1
@@ -0,0 +1,314 @@
+"""
+TFLite Operator Profiler
+Runs an exported model under TensorFlow Lite's benchmark_model tool with
+per-operator profiling, over a sample of letterboxed images, and breaks the
+time down by op type and by YOLOv8 layer. Two models (or saved profiles)
+are diffed side by side, e.g. the dynamic-range INT8 export against the
+full-integer one, to see where quantize/dequantize ops or a layer eat the
+gains.
+
+benchmark_model ships with TensorFlow Lite; prebuilt binaries (including
+linux_aarch64 for the Pi) are published with the TFLite nightly tools.
+"""
+
+import csv
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+from calibration_set import letterbox
+from dataset_cache import list_images
+
+DEFAULT_IMAGES = 'data/valid/images'
+SAMPLE_IMAGES = 8
+RUNS_PER_IMAGE = 20
+WARMUP_RUNS = 5
+
+# YOLOv8 layers (model.<index> in exported tensor names)
+YOLOV8_LAYERS = [
+    'Conv', 'Conv', 'C2f', 'Conv', 'C2f', 'Conv', 'C2f', 'Conv', 'C2f', 'SPPF',
+    'Upsample', 'Concat', 'C2f', 'Upsample', 'Concat', 'C2f', 'Conv', 'Concat',
+    'C2f', 'Conv', 'Concat', 'C2f', 'Detect'
+]
+BACKBONE_END = 9     # layers 0-9
+HEAD_START = 22      # Detect
+
+QUANT_OPS = {'QUANTIZE', 'DEQUANTIZE'}
+
+LAYER_PATTERN = re.compile(r'model\.(\d+)')
+
+# Heading of the per-op section in benchmark_model's profile output
+RUN_PROFILE_MARKER = 'regular benchmark runs'
+
+
+def find_benchmark_binary(path=None):
+    """benchmark_model executable: path, $TFLITE_BENCHMARK_MODEL or on PATH"""
+    for candidate in (path, os.environ.get('TFLITE_BENCHMARK_MODEL'),
+                      shutil.which('benchmark_model'),
+                      shutil.which('linux_aarch64_benchmark_model')):
+        if candidate and os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+
+
+def load_interpreter(model_path):
+    """TFLite interpreter from tflite_runtime or TensorFlow"""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        from tensorflow.lite import Interpreter
+    interpreter = Interpreter(model_path=model_path)
+    interpreter.allocate_tensors()
+    return interpreter
+
+
+def input_tensor(image, detail):
+    """One letterboxed image as the model's input tensor (NHWC or NCHW)"""
+    shape = detail['shape']
+    channels_first = shape[1] == 3
+    size = shape[2] if channels_first else shape[1]
+    x = cv2.cvtColor(letterbox(image, size), cv2.COLOR_BGR2RGB).astype(np.float32) / 255.0
+    if channels_first:
+        x = x.transpose(2, 0, 1)
+    x = x[None]
+
+    dtype = detail['dtype']
+    if np.issubdtype(dtype, np.integer):
+        scale, zero_point = detail['quantization']
+        info = np.iinfo(dtype)
+        x = np.clip(np.round(x / scale + zero_point), info.min, info.max)
+    return x.astype(dtype)
+
+
+def write_inputs(model_path, image_files, output_dir):
+    """Raw input files for benchmark_model; returns (input name, files)"""
+    detail = load_interpreter(model_path).get_input_details()[0]
+    files = []
+    for i, image_path in enumerate(image_files):
+        image = cv2.imread(image_path)
+        if image is None:
+            continue
+        path = os.path.join(output_dir, f'input_{i}.bin')
+        input_tensor(image, detail).tofile(path)
+        files.append(path)
+    return detail['name'], files
+
+
+def parse_op_profile(path):
+    """Per-node rows of benchmark_model's CSV op profile
+
+    The file starts with a profile of initialization (ModifyGraphWithDelegate,
+    AllocateTensors); only the run order table of the regular benchmark runs
+    that follows it is read. Output without that section is read from the top.
+    """
+    with open(path, newline='') as f:
+        lines = list(csv.reader(f))
+    start = next((i for i, row in enumerate(lines)
+                  if row and RUN_PROFILE_MARKER in row[0].lower()), 0)
+
+    rows = []
+    header = None
+    for row in lines[start:]:
+        if header is None:
+            if row and row[0].strip().lower() == 'node type':
+                header = [col.strip().lower() for col in row]
+            continue
+        if not row or not row[0].strip() or row[0].startswith('='):
+            # End of the run order table; the rest are summaries of it
+            break
+        record = dict(zip(header, row))
+        rows.append({
+            'type': record['node type'].strip(),
+            'name': record.get('name', '').strip(),
+            'avg_ms': float(record['avg_ms']),
+            'times_called': int(float(record.get('times called', 1) or 1))
+        })
+    return rows
+
+
+def run_benchmark(binary, model_path, input_name, input_file, threads, runs, output_csv):
+    """Run benchmark_model with op profiling on one input; returns node rows"""
+    command = [binary, f'--graph={model_path}', f'--num_threads={threads}',
+               f'--num_runs={runs}', f'--warmup_runs={WARMUP_RUNS}',
+               '--enable_op_profiling=true', '--op_profiling_output_mode=csv',
+               f'--op_profiling_output_file={output_csv}']
+    if input_file:
+        command.append(f'--input_layer_value_files={input_name}:{input_file}')
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    return parse_op_profile(output_csv)
+
+
+def layer_of(node_name):
+    """'model.<i> <Module>' for a node of the exported YOLOv8, else 'other'"""
+    match = LAYER_PATTERN.search(node_name)
+    if not match:
+        return 'other'
+    index = int(match.group(1))
+    module = YOLOV8_LAYERS[index] if index < len(YOLOV8_LAYERS) else '?'
+    return f'model.{index} {module}'
+
+
+def stage_of(layer):
+    if not layer.startswith('model.'):
+        return 'other'
+    index = int(layer.split()[0].split('.')[1])
+    if index <= BACKBONE_END:
+        return 'backbone'
+    return 'head' if index >= HEAD_START else 'neck'
+
+
+def summarize(model_path, per_image_rows):
+    """Average the node rows of several inputs and aggregate them"""
+    nodes = defaultdict(lambda: {'type': None, 'avg_ms': 0.0})
+    for rows in per_image_rows:
+        for i, row in enumerate(rows):
+            # Nodes keep their run order; the index keeps same-named nodes apart
+            node = nodes[(i, row['name'])]
+            node['type'] = row['type']
+            node['avg_ms'] += row['avg_ms'] * row['times_called'] / len(per_image_rows)
+
+    by_type = defaultdict(lambda: {'count': 0, 'ms': 0.0})
+    by_layer = defaultdict(float)
+    by_stage = defaultdict(float)
+    for (_, name), node in nodes.items():
+        by_type[node['type']]['count'] += 1
+        by_type[node['type']]['ms'] += node['avg_ms']
+        layer = layer_of(name)
+        by_layer[layer] += node['avg_ms']
+        by_stage[stage_of(layer)] += node['avg_ms']
+
+    total = sum(node['avg_ms'] for node in nodes.values())
+    return {
+        'model': os.path.basename(model_path),
+        'images': len(per_image_rows),
+        'total_ms': total,
+        'quant_ms': sum(v['ms'] for t, v in by_type.items() if t in QUANT_OPS),
+        'by_type': dict(by_type),
+        'by_layer': dict(by_layer),
+        'by_stage': dict(by_stage),
+        'top_nodes': sorted(({'name': name, 'type': node['type'], 'ms': node['avg_ms']}
+                             for (_, name), node in nodes.items()),
+                            key=lambda n: -n['ms'])[:15]
+    }
+
+
+def profile_model(model_path, image_files, binary, threads=4, runs=RUNS_PER_IMAGE):
+    """Profile a .tflite model over image_files"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        input_name, inputs = write_inputs(model_path, image_files, work_dir)
+        if not inputs:
+            # No readable images: benchmark_model fills the input with random data
+            inputs = [None]
+        per_image = []
+        for i, input_file in enumerate(inputs):
+            output_csv = os.path.join(work_dir, f'profile_{i}.csv')
+            per_image.append(run_benchmark(binary, model_path, input_name, input_file,
+                                           threads, runs, output_csv))
+    summary = summarize(model_path, per_image)
+    summary['threads'] = threads
+    return summary
+
+
+def load_profile(path, image_files, binary, threads, runs):
+    """A saved profile (.json) or a fresh one for a .tflite model"""
+    if path.endswith('.json'):
+        with open(path) as f:
+            return json.load(f)
+    if binary is None:
+        raise SystemExit("benchmark_model not found: pass --benchmark-binary or set "
+                         "TFLITE_BENCHMARK_MODEL (or profile on the Pi and pass the .json)")
+    print(f"Profiling {path} over {len(image_files)} image(s)...")
+    return profile_model(path, image_files, binary, threads, runs)
+
+
+def print_profile(profile, top=10):
+    total = profile['total_ms'] or 1
+    print("\n" + "=" * 60)
+    print(f"{profile['model']}: {profile['total_ms']:.2f} ms per inference "
+          f"({profile['images']} image(s), {profile.get('threads', '?')} threads)")
+    print("=" * 60)
+    print(f"Quantize/dequantize: {profile['quant_ms']:.2f} ms ({profile['quant_ms'] / total:.1%})")
+    print("Stages: " + ', '.join(f"{stage} {ms:.2f} ms ({ms / total:.0%})"
+                                 for stage, ms in sorted(profile['by_stage'].items(), key=lambda x: -x[1])))
+
+    print(f"\n{'op type':28s} {'count':>6s} {'ms':>9s} {'share':>7s}")
+    for op, stats in sorted(profile['by_type'].items(), key=lambda x: -x[1]['ms'])[:top]:
+        print(f"{op:28s} {stats['count']:6d} {stats['ms']:9.3f} {stats['ms'] / total:7.1%}")
+
+    print(f"\n{'layer':28s} {'ms':>9s} {'share':>7s}")
+    for layer, ms in sorted(profile['by_layer'].items(), key=lambda x: -x[1])[:top]:
+        print(f"{layer:28s} {ms:9.3f} {ms / total:7.1%}")
+
+
+def print_diff(a, b, top=12):
+    """Side-by-side op type and layer times of two profiles"""
+    print("\n" + "=" * 60)
+    print(f"Diff: A = {a['model']}, B = {b['model']}")
+    print("=" * 60)
+    print(f"Total: {a['total_ms']:.2f} -> {b['total_ms']:.2f} ms "
+          f"({b['total_ms'] - a['total_ms']:+.2f} ms)")
+    print(f"Quantize/dequantize: {a['quant_ms']:.2f} -> {b['quant_ms']:.2f} ms")
+
+    for title, key, value in [('op type', 'by_type', lambda v: v['ms'] if isinstance(v, dict) else v),
+                              ('layer', 'by_layer', lambda v: v),
+                              ('stage', 'by_stage', lambda v: v)]:
+        names = set(a[key]) | set(b[key])
+        rows = [(name, value(a[key].get(name, 0.0)), value(b[key].get(name, 0.0))) for name in names]
+        rows.sort(key=lambda r: -abs(r[2] - r[1]))
+        print(f"\n{title:28s} {'A ms':>9s} {'B ms':>9s} {'B - A':>9s}")
+        for name, ms_a, ms_b in rows[:top]:
+            print(f"{name:28s} {ms_a:9.3f} {ms_b:9.3f} {ms_b - ms_a:+9.3f}")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Per-operator profile of TFLite models')
+    parser.add_argument('models', nargs='+',
+                       help='One or two .tflite models or saved .json profiles (two are diffed)')
+    parser.add_argument('--images', type=str, default=DEFAULT_IMAGES,
+                       help=f'Sample image directory (default: {DEFAULT_IMAGES})')
+    parser.add_argument('--count', type=int, default=SAMPLE_IMAGES,
+                       help=f'Images to profile over (default: {SAMPLE_IMAGES})')
+    parser.add_argument('--runs', type=int, default=RUNS_PER_IMAGE,
+                       help=f'Timed runs per image (default: {RUNS_PER_IMAGE})')
+    parser.add_argument('--threads', type=int, default=4,
+                       help='Interpreter threads (default: 4, the Pi 4 cores)')
+    parser.add_argument('--benchmark-binary', type=str, default=None,
+                       help='Path to benchmark_model (default: $TFLITE_BENCHMARK_MODEL or PATH)')
+    parser.add_argument('--save', type=str, nargs='*', default=None,
+                       help='Save the profiles as JSON (one path per model)')
+    args = parser.parse_args()
+
+    if len(args.models) > 2:
+        parser.error('give one model to profile or two to compare')
+
+    image_files = []
+    if os.path.isdir(args.images):
+        all_images = list_images(args.images)
+        # Spread the sample over the directory
+        step = max(1, len(all_images) // max(1, args.count))
+        image_files = all_images[::step][:args.count]
+
+    binary = find_benchmark_binary(args.benchmark_binary)
+    profiles = [load_profile(path, image_files, binary, args.threads, args.runs) for path in args.models]
+    for profile in profiles:
+        print_profile(profile)
+    if len(profiles) == 2:
+        print_diff(*profiles)
+
+    for path, profile in zip(args.save or [], profiles):
+        with open(path, 'w') as f:
+            json.dump(profile, f, indent=2)
+        print(f"\nProfile saved to: {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,514 @@
+"""
+End-to-End Replay Harness
+Runs inference_pi.run_inference on a recorded video (or a folder of images)
+and an NMEA log through fake camera, serial GPS and GPIO backends. Detections
+are published to an in-process MQTT broker stand-in feeding FleetIngestor
+(the dashboard.py path), and the harness follows dashboard_server.py's
+/api/stream like an open dashboard. Every detection is timestamped at each
+hop:
+
+  capture -> detected -> mqtt_published -> led
+          -> ingested   (MQTT -> FleetIngestor -> detection database)
+          -> dashboard  (current_session.json -> /api/stream event)
+
+and the report gives latency percentiles per hop (from capture) and the
+sustained throughput, so a regression in any component shows up.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+from unittest import mock
+
+import cv2
+import numpy as np
+
+import dashboard_server
+import inference_pi
+from detection_store import DetectionStore
+from fleet_ingest import SUBSCRIPTIONS, FleetIngestor
+from fleet_loadgen import LocalBroker
+
+HOPS = ['detected', 'mqtt_published', 'led', 'ingested', 'dashboard']
+
+# Time allowed after the replay ends for detections to reach every hop
+DRAIN_TIMEOUT = 5.0
+
+# Replay starting point when no NMEA log is given
+DEFAULT_ORIGIN = (-7.7956, 110.3695)
+
+
+def nmea_checksum(body):
+    """XOR checksum of an NMEA sentence body (between '$' and '*')"""
+    checksum = 0
+    for ch in body:
+        checksum ^= ord(ch)
+    return f"{checksum:02X}"
+
+
+def synth_nmea(origin=DEFAULT_ORIGIN, count=600, step=0.00001):
+    """GGA sentences walking north-east from origin, one per second"""
+    lines = []
+    for i in range(count):
+        lat, lon = origin[0] + i * step, origin[1] + i * step
+        hhmmss = time.strftime('%H%M%S', time.gmtime(i))
+        lat_deg, lon_deg = int(abs(lat)), int(abs(lon))
+        body = (f"GPGGA,{hhmmss}.00,"
+                f"{lat_deg:02d}{(abs(lat) - lat_deg) * 60:08.5f},{'N' if lat >= 0 else 'S'},"
+                f"{lon_deg:03d}{(abs(lon) - lon_deg) * 60:08.5f},{'E' if lon >= 0 else 'W'},"
+                f"1,08,0.9,100.0,M,0.0,M,,")
+        lines.append(f"${body}*{nmea_checksum(body)}")
+    return lines
+
+
+def read_nmea_log(path):
+    """NMEA sentences of a recorded log, one per line"""
+    with open(path, errors='ignore') as f:
+        return [line.strip() for line in f if line.startswith('$')]
+
+
+class ReplaySerial:
+    """Stands in for serial.Serial: replays NMEA lines at rate lines/s,
+    starting over at the end of the log"""
+
+    def __init__(self, lines, rate=1.0):
+        if not lines:
+            raise ValueError("NMEA log has no sentences")
+        self.lines = lines
+        self.rate = rate
+        self.is_open = True
+        self._start = time.time()
+        self._sent = 0
+
+    @property
+    def in_waiting(self):
+        due = int((time.time() - self._start) * self.rate) + 1
+        return max(0, due - self._sent)
+
+    def readline(self):
+        line = self.lines[self._sent % len(self.lines)]
+        self._sent += 1
+        return (line + '\r\n').encode('ascii')
+
+    def close(self):
+        self.is_open = False
+
+
+class ImageSequence:
+    """cv2.VideoCapture-like reader over a folder of images, each shown for
+    hold frames"""
+
+    def __init__(self, image_dir, hold=1):
+        from dataset_cache import list_images
+
+        self.image_files = list_images(os.path.abspath(image_dir))
+        self.hold = hold
+        self._frame = 0
+
+    def isOpened(self):
+        return bool(self.image_files)
+
+    def grab(self):
+        self._frame += 1
+        return self._frame <= len(self.image_files) * self.hold
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        im = cv2.imread(self.image_files[(self._frame - 1) // self.hold])
+        return im is not None, im
+
+    def get(self, prop):
+        return 0
+
+    def release(self):
+        pass
+
+
+class ReplayCamera:
+    """Plays a recording back like a live camera
+
+    Frames come out in real time (scaled by speed): when inference falls
+    behind, the frames that went by are dropped, as with a real camera, and
+    each frame's capture time is when it would have been captured live.
+    speed=0 replays every frame as fast as it is read. With loop, the
+    recording starts over at its end (until duration is up).
+    """
+
+    def __init__(self, source, fps=None, speed=1.0, duration=None, hold=1, loop=False):
+        # Absolute, so the source can be reopened after the harness chdirs
+        self.source = os.path.abspath(source) if os.path.exists(source) else source
+        self.hold = hold
+        self.capture = self._open()
+        self.fps = fps or self.capture.get(cv2.CAP_PROP_FPS) or 30.0
+        self.speed = speed
+        self.duration = duration
+        self.loop = loop
+        self.loops = 0
+        self.last_capture = None
+        self.frames_read = 0
+        self.frames_dropped = 0
+        self._index = -1
+        self._start = None
+
+    def _open(self):
+        if os.path.isdir(self.source):
+            capture = ImageSequence(self.source, self.hold)
+        else:
+            capture = cv2.VideoCapture(self.source)
+        if not capture.isOpened():
+            raise ValueError(f"Cannot open replay source: {self.source}")
+        return capture
+
+    def _next(self, grab_only=False):
+        """Next frame of the recording, starting over at its end with loop"""
+        for attempt in range(2):
+            if grab_only:
+                ok, frame = self.capture.grab(), None
+            else:
+                ok, frame = self.capture.read()
+            if ok or not self.loop or attempt:
+                return ok, frame
+            self.capture.release()
+            self.capture = self._open()
+            self.loops += 1
+
+    def isOpened(self):
+        return True
+
+    def set(self, prop, value):
+        return True
+
+    def read(self):
+        now = time.time()
+        if self._start is None:
+            self._start = now
+        if self.duration is not None and now - self._start >= self.duration:
+            return False, None
+
+        if self.speed:
+            interval = 1.0 / (self.fps * self.speed)
+            index = max(self._index + 1, int((now - self._start) / interval))
+            delay = self._start + index * interval - now
+            if delay > 0:
+                time.sleep(delay)
+            # Frames that went by while the caller was busy
+            for _ in range(index - self._index - 1):
+                if not self._next(grab_only=True)[0]:
+                    return False, None
+                self.frames_dropped += 1
+            capture_time = self._start + index * interval
+        else:
+            index = self._index + 1
+            capture_time = time.time()
+
+        ok, frame = self._next()
+        if not ok:
+            return False, None
+        self._index = index
+        self.frames_read += 1
+        self.last_capture = capture_time
+        return True, frame
+
+    def release(self):
+        self.capture.release()
+
+
+class HopRecorder:
+    """Per-detection timestamps at each hop, keyed by the detection's
+    timestamp (unique per detection and preserved through JSON)"""
+
+    def __init__(self):
+        self.times = {}
+        self._pending_led = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(det):
+        return repr(float(det['timestamp']))
+
+    def mark(self, key, hop, t=None):
+        with self._lock:
+            hops = self.times.setdefault(key, {})
+            hops.setdefault(hop, time.time() if t is None else t)
+
+    def published(self, det, capture_time):
+        key = self.key(det)
+        now = time.time()
+        self.mark(key, 'capture', capture_time)
+        self.mark(key, 'detected', det['timestamp'])
+        self.mark(key, 'mqtt_published', now)
+        with self._lock:
+            self._pending_led.append((key, det['class']))
+
+    def led_on(self, class_name):
+        now = time.time()
+        with self._lock:
+            pending = [(key, cls) for key, cls in self._pending_led if cls == class_name]
+            self._pending_led = [item for item in self._pending_led if item[1] != class_name]
+        for key, _ in pending:
+            self.mark(key, 'led', now)
+
+    def complete(self, hops):
+        with self._lock:
+            return all(all(hop in t for hop in hops) for t in self.times.values())
+
+    def latencies(self, hop):
+        """Milliseconds from capture to hop, for detections that reached it"""
+        with self._lock:
+            return [(t[hop] - t['capture']) * 1000 for t in self.times.values()
+                    if hop in t and 'capture' in t]
+
+
+class MockGPIO:
+    """RPi.GPIO stand-in that reports LED rising edges to the recorder
+    (when one is given)"""
+    BCM = 11
+    OUT = 0
+    LOW = 0
+    HIGH = 1
+
+    def __init__(self, recorder, led_pins):
+        self.recorder = recorder
+        self.classes = {pin: name for name, pin in led_pins.items()}
+        self.state = {}
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, mode):
+        self.state[pin] = self.LOW
+
+    def output(self, pin, value):
+        if self.recorder and value == self.HIGH and pin in self.classes:
+            self.recorder.led_on(self.classes[pin])
+        self.state[pin] = value
+
+    def cleanup(self):
+        self.state.clear()
+
+
+class ReplayMQTTClient:
+    """paho client stand-in publishing into the in-process broker"""
+
+    def __init__(self, broker, recorder, camera):
+        self.broker = broker
+        self.recorder = recorder
+        self.camera = camera
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        if topic.endswith('/detections'):
+            self.recorder.published(json.loads(payload), self.camera.last_capture)
+        self.broker.publish(topic, payload.encode('utf-8') if isinstance(payload, str) else payload)
+
+    def disconnect(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+
+def follow_stream(recorder, stop):
+    """Read dashboard_server's SSE stream like an open dashboard page"""
+    response = dashboard_server.app.test_client().get('/api/stream', buffered=False)
+    event = None
+    buffer = ''
+    for chunk in response.response:
+        if stop.is_set():
+            break
+        now = time.time()
+        buffer += chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
+        while '\n' in buffer:
+            line, buffer = buffer.split('\n', 1)
+            if line.startswith('event: '):
+                event = line[len('event: '):]
+            elif line.startswith('data: ') and event in ('reset', 'detections'):
+                for det in json.loads(line[len('data: '):])['detections']:
+                    recorder.mark(recorder.key(det), 'dashboard', now)
+
+
+def percentiles(values):
+    """p50/p90/p99/max of a list of milliseconds"""
+    if not values:
+        return None
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {'count': len(values), 'p50': p50, 'p90': p90, 'p99': p99, 'max': max(values)}
+
+
+def replay_gps_patches(nmea_lines, rate=1.0):
+    """inference_pi attributes that make its serial GPS reader replay
+    nmea_lines; empty when gps_parser can't be imported"""
+    if not inference_pi.GPS_SERIAL_AVAILABLE:
+        print("WARNING: gps_parser unavailable (pyserial/pynmea2); replaying without GPS")
+        return {}
+
+    class ReplayGPSReader(inference_pi.GPSReader):
+        def connect(self):
+            self.gps = ReplaySerial(nmea_lines, rate)
+            return True
+
+    return {'GPSReader': ReplayGPSReader, 'GPS_SERVICE_AVAILABLE': False}
+
+
+def run_replay(model_path, source, nmea_lines, imgsz=416, frame_skip=1, fps=None,
+               speed=1.0, duration=None, hold=1, nmea_rate=1.0, thermal_root=None):
+    """Replay source through run_inference; returns the report dict
+
+    The thermal governor only runs with a thermal_root (e.g. a fake sysfs
+    tree), so the host's own temperature doesn't throttle the replay.
+    """
+    recorder = HopRecorder()
+    camera = ReplayCamera(source, fps, speed, duration, hold)
+
+    gps_patches = replay_gps_patches(nmea_lines, nmea_rate)
+    if not gps_patches:
+        print("         so detections won't reach the dashboard stream")
+
+    with tempfile.TemporaryDirectory() as work_dir, ExitStack() as stack:
+        session_file = os.path.join(work_dir, 'current_session.json')
+
+        broker = LocalBroker()
+        ingestor = FleetIngestor(DetectionStore(os.path.join(work_dir, 'fleet.db')), workers=2)
+        ingestor.listeners.append(lambda device, detections: [
+            recorder.mark(recorder.key(det), 'ingested') for det in detections])
+        for pattern in SUBSCRIPTIONS:
+            broker.subscribe(pattern, ingestor.on_message)
+        ingestor.start()
+        client = ReplayMQTTClient(broker, recorder, camera)
+
+        # create=True: RPi.GPIO isn't imported off the Pi
+        stack.enter_context(mock.patch.multiple(
+            inference_pi, create=True,
+            setup_camera=lambda **kwargs: camera,
+            setup_mqtt=lambda **kwargs: client,
+            MQTT_AVAILABLE=True,
+            GPIO=MockGPIO(recorder, inference_pi.LED_PINS),
+            GPIO_AVAILABLE=True,
+            **gps_patches))
+        # Headless: no window events to poll
+        stack.enter_context(mock.patch.object(cv2, 'waitKey', lambda delay=0: -1))
+        stack.enter_context(mock.patch.object(cv2, 'destroyAllWindows', lambda: None))
+        stack.enter_context(mock.patch.object(dashboard_server, 'get_current_session_file',
+                                              lambda: session_file))
+
+        stop = threading.Event()
+        threading.Thread(target=follow_stream, args=(recorder, stop), daemon=True).start()
+
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        start = time.time()
+        try:
+            inference_pi.run_inference(
+                model_path=os.path.join(cwd, model_path),
+                show_display=False,
+                frame_skip=frame_skip,
+                enable_mqtt=True,
+                enable_gps=bool(gps_patches),
+                db_path=os.path.join(work_dir, 'detections.db'),
+                device_id='replay',
+                enable_preview=False,
+                imgsz=imgsz,
+                enable_thermal=thermal_root is not None,
+                thermal_root=os.path.join(cwd, thermal_root or '/'))
+        finally:
+            os.chdir(cwd)
+        replay_time = time.time() - start
+
+        hops = HOPS if gps_patches else [hop for hop in HOPS if hop != 'dashboard']
+        deadline = time.time() + DRAIN_TIMEOUT
+        while time.time() < deadline and not recorder.complete(hops):
+            time.sleep(0.05)
+        stop.set()
+        ingestor.stop()
+
+    detections = len(recorder.times)
+    return {
+        'source': source,
+        'speed': speed,
+        'replay_seconds': replay_time,
+        'frames_read': camera.frames_read,
+        'frames_dropped': camera.frames_dropped,
+        'frames_per_second': camera.frames_read / replay_time if replay_time else 0,
+        'detections': detections,
+        'detections_per_second': detections / replay_time if replay_time else 0,
+        'latency_ms': {hop: percentiles(recorder.latencies(hop)) for hop in HOPS}
+    }
+
+
+def print_report(report):
+    print("\n" + "=" * 60)
+    print("End-to-End Replay Report")
+    print("=" * 60)
+    print(f"Replay: {report['replay_seconds']:.1f}s, {report['frames_read']} frames "
+          f"({report['frames_per_second']:.1f} fps), {report['frames_dropped']} dropped")
+    print(f"Detections: {report['detections']} ({report['detections_per_second']:.2f}/s)")
+    print(f"\nLatency from capture (ms):")
+    print(f"  {'hop':16s} {'count':>6s} {'p50':>8s} {'p90':>8s} {'p99':>8s} {'max':>8s}")
+    for hop, stats in report['latency_ms'].items():
+        if stats:
+            print(f"  {hop:16s} {stats['count']:6d} {stats['p50']:8.1f} {stats['p90']:8.1f} "
+                  f"{stats['p99']:8.1f} {stats['max']:8.1f}")
+        else:
+            print(f"  {hop:16s} {0:6d}  (never reached)")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Replay a recording through the whole detection chain')
+    parser.add_argument('--model', type=str, required=True,
+                       help='Model file passed to inference_pi.py')
+    parser.add_argument('--video', type=str, default='data/test/images',
+                       help='Recorded video, or a folder of images (default: data/test/images)')
+    parser.add_argument('--nmea', type=str, default=None,
+                       help='Recorded NMEA log (default: a synthetic walk)')
+    parser.add_argument('--nmea-rate', type=float, default=1.0,
+                       help='NMEA sentences per second (default: 1)')
+    parser.add_argument('--imgsz', type=int, default=416,
+                       help='Model input size (default: 416)')
+    parser.add_argument('--frame-skip', type=int, default=1,
+                       help='Passed to inference_pi.py (default: 1)')
+    parser.add_argument('--fps', type=float, default=None,
+                       help='Replay frame rate (default: the video\'s, 30 for image folders)')
+    parser.add_argument('--hold', type=int, default=1,
+                       help='Frames each image of a folder is shown for (default: 1)')
+    parser.add_argument('--speed', type=float, default=1.0,
+                       help='Replay speed, 0 = every frame as fast as possible (default: 1)')
+    parser.add_argument('--duration', type=float, default=None,
+                       help='Stop after this many seconds (default: end of the recording)')
+    parser.add_argument('--thermal-root', type=str, default=None,
+                       help='Run the thermal governor against this sysfs root, e.g. a fake tree '
+                            '(default: governor off)')
+    parser.add_argument('--json', type=str, default=None,
+                       help='Also write the report to this file')
+    parser.add_argument('--max-p90-ms', type=float, default=None,
+                       help='Exit with status 1 if capture-to-dashboard p90 exceeds this')
+    args = parser.parse_args()
+
+    nmea_lines = read_nmea_log(args.nmea) if args.nmea else synth_nmea()
+    report = run_replay(args.model, args.video, nmea_lines, args.imgsz, args.frame_skip,
+                        args.fps, args.speed, args.duration, args.hold, args.nmea_rate,
+                        args.thermal_root)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport saved to: {args.json}")
+
+    if args.max_p90_ms is not None:
+        stats = report['latency_ms']['dashboard']
+        if not stats or stats['p90'] > args.max_p90_ms:
+            print(f"\nFAIL: capture-to-dashboard p90 above {args.max_p90_ms:.0f} ms")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
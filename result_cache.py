@@ -0,0 +1,173 @@
+"""
+Content-Addressed Inference Result Cache
+Persistent SQLite cache of raw detections, keyed by the image content hash,
+the model file hash and the inference parameters (imgsz, iou, conf floor),
+so repeated offline runs over the same images only run the model on new or
+changed images. Results are stored at a low confidence floor and filtered
+when read, so sweeping thresholds never needs the model. The least recently
+used entries are evicted when the cache grows past its size limit.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+DEFAULT_CACHE_PATH = os.path.join('cache', 'results.db')
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Confidence at which results are computed and stored; any higher threshold
+# is applied on read
+CONF_FLOOR = 0.001
+
+# Eviction brings the cache down to this fraction of the limit, so it doesn't
+# run again after every insert
+EVICT_TO = 0.9
+
+# Approximate per-row overhead (key, hashes, params, index entries)
+ROW_OVERHEAD = 256
+
+# One stored detection: box corners in original image pixels, confidence,
+# class index
+BOX_DTYPE = np.dtype([('xyxy', '<f4', (4,)), ('conf', '<f4'), ('cls', '<u2')])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    image_hash TEXT NOT NULL,
+    model_hash TEXT NOT NULL,
+    params TEXT NOT NULL,
+    boxes BLOB NOT NULL,
+    height INTEGER,
+    width INTEGER,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_last_used ON results(last_used);
+CREATE INDEX IF NOT EXISTS idx_results_model ON results(model_hash);
+"""
+
+_file_hashes = {}
+
+
+def file_hash(path):
+    """SHA-1 of a file's content, memoized by (path, mtime, size)"""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    digest = _file_hashes.get(memo_key)
+    if digest is None:
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        digest = _file_hashes[memo_key] = h.hexdigest()
+    return digest
+
+
+def pack_boxes(xyxy, conf, cls):
+    """Detections as a BOX_DTYPE array"""
+    boxes = np.zeros(len(conf), dtype=BOX_DTYPE)
+    boxes['xyxy'] = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+    boxes['conf'] = conf
+    boxes['cls'] = cls
+    return boxes
+
+
+def filter_boxes(boxes, conf):
+    """Detections at or above a confidence threshold"""
+    return boxes[boxes['conf'] >= conf]
+
+
+class ResultCache:
+    """Detections per (image, model, parameters), LRU-evicted past max_bytes
+
+    get() and put() don't commit; flush() commits and evicts, so a batch run
+    flushes every few images instead of after every one.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=10)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    @staticmethod
+    def make_key(image_hash, model_hash, params):
+        params = json.dumps(params, sort_keys=True)
+        return hashlib.sha1(f'{image_hash}:{model_hash}:{params}'.encode()).hexdigest()
+
+    def get(self, key):
+        """(boxes, (height, width)) for a key, or None"""
+        row = self.conn.execute('SELECT boxes, height, width FROM results WHERE key = ?',
+                                (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute('UPDATE results SET last_used = ? WHERE key = ?', (time.time(), key))
+        boxes = np.frombuffer(row[0], dtype=BOX_DTYPE)
+        return boxes, (row[1], row[2])
+
+    def put(self, key, image_hash, model_hash, params, boxes, shape):
+        data = np.ascontiguousarray(boxes, dtype=BOX_DTYPE).tobytes()
+        size = len(data) + ROW_OVERHEAD
+        old = self.conn.execute('SELECT size FROM results WHERE key = ?', (key,)).fetchone()
+        self.conn.execute(
+            'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (key, image_hash, model_hash, json.dumps(params, sort_keys=True), data,
+             int(shape[0]), int(shape[1]), size, time.time()))
+        self.total_bytes += size - (old[0] if old else 0)
+
+    def flush(self):
+        """Commit pending writes and evict down to the size limit"""
+        if self.max_bytes and self.total_bytes > self.max_bytes:
+            self.evict(int(self.max_bytes * EVICT_TO))
+        self.conn.commit()
+
+    def evict(self, target_bytes):
+        """Delete least recently used entries until the cache fits target_bytes"""
+        excess = self.total_bytes - target_bytes
+        victims = []
+        for key, size in self.conn.execute('SELECT key, size FROM results ORDER BY last_used'):
+            if excess <= 0:
+                break
+            victims.append((key,))
+            excess -= size
+        self.conn.executemany('DELETE FROM results WHERE key = ?', victims)
+        self.total_bytes = target_bytes + excess
+        self.evicted += len(victims)
+        return len(victims)
+
+    def clear(self):
+        self.conn.execute('DELETE FROM results')
+        self.conn.commit()
+        self.conn.execute('VACUUM')
+        self.total_bytes = 0
+
+    def stats(self):
+        entries, models = self.conn.execute(
+            'SELECT COUNT(*), COUNT(DISTINCT model_hash) FROM results').fetchone()
+        return {
+            'entries': entries,
+            'models': models,
+            'bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evicted': self.evicted
+        }
+
+    def close(self):
+        self.flush()
+        self.conn.close()
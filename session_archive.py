@@ -0,0 +1,237 @@
+"""
+Detection Session Archive
+Compacts detection JSON files into gzip-compressed JSON lines files made of
+independently readable chunks, with a small index of session time ranges
+and counts so archives can be listed and streamed without loading them whole
+"""
+
+import fcntl
+import glob
+import gzip
+import json
+import os
+import shutil
+from collections import Counter
+from contextlib import contextmanager
+
+from detection_cache import DetectionView
+
+# Archive directory (relative to the project root)
+ARCHIVE_DIR = 'detections_archive'
+
+# Index of archived sessions inside ARCHIVE_DIR
+INDEX_FILE = 'index.json'
+
+# Records per compressed chunk; each chunk is a separate gzip member
+CHUNK_RECORDS = 1000
+
+_index_cache = {}
+
+
+def session_name(path):
+    """Archive session name for a detection file"""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+@contextmanager
+def _index_lock(archive_dir):
+    """Serialize index updates between the dashboard and clear_detections.py"""
+    with open(os.path.join(archive_dir, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def load_index(archive_dir=ARCHIVE_DIR):
+    """Load the archive index (cached until the index file changes)"""
+    path = os.path.join(archive_dir, INDEX_FILE)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return {'version': 1, 'sessions': {}}
+
+    cached = _index_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(path, 'r') as f:
+        index = json.load(f)
+    _index_cache[path] = (mtime, index)
+    return index
+
+
+def _write_index(archive_dir, index):
+    """Atomically replace the archive index"""
+    path = os.path.join(archive_dir, INDEX_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _write_chunks(records, data_path):
+    """Write records as gzip members of CHUNK_RECORDS lines; returns chunk info"""
+    chunks = []
+    with open(data_path, 'wb') as f:
+        for i in range(0, len(records), CHUNK_RECORDS):
+            chunk = records[i:i + CHUNK_RECORDS]
+            lines = ''.join(json.dumps(det, separators=(',', ':')) + '\n' for det in chunk)
+            data = gzip.compress(lines.encode('utf-8'))
+            timestamps = [det['timestamp'] for det in chunk if 'timestamp' in det]
+            chunks.append({
+                'offset': f.tell(),
+                'length': len(data),
+                'count': len(chunk),
+                'start': min(timestamps) if timestamps else None,
+                'end': max(timestamps) if timestamps else None
+            })
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return chunks
+
+
+def unparsed_bytes(view):
+    """Bytes of a fully read view's file that weren't parsed as records
+
+    Whitespace and an array's closing bracket don't count, so this is 0
+    only when every record in the file made it into the view.
+    """
+    with open(view.path, 'rb') as f:
+        f.seek(view.offset)
+        rest = f.read().strip()
+    if view.format == 'array' and rest.endswith(b']'):
+        rest = rest[:-1].rstrip()
+    return len(rest)
+
+
+def archive_file(path, archive_dir=ARCHIVE_DIR, remove=True):
+    """Compact one detection file into the archive and return its index entry
+
+    The file is only removed when all of it was archived; otherwise it is
+    kept and entry['leftover_bytes'] says how much couldn't be parsed.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    name = session_name(path)
+    data_file = f"{name}.jsonl.gz"
+
+    view = DetectionView(path)
+    view.refresh(final=True)
+    records = view.records
+    leftover = unparsed_bytes(view)
+
+    chunks = _write_chunks(records, os.path.join(archive_dir, data_file))
+    starts = [c['start'] for c in chunks if c['start'] is not None]
+    ends = [c['end'] for c in chunks if c['end'] is not None]
+
+    entry = {
+        'session': name,
+        'file': data_file,
+        'count': len(records),
+        'start': min(starts) if starts else None,
+        'end': max(ends) if ends else None,
+        'class_counts': dict(Counter(det.get('class', 'unknown') for det in records)),
+        'original_size': os.path.getsize(path),
+        'size': os.path.getsize(os.path.join(archive_dir, data_file)),
+        'leftover_bytes': leftover,
+        'chunks': chunks
+    }
+
+    with _index_lock(archive_dir):
+        index = dict(load_index(archive_dir))
+        index['sessions'] = dict(index.get('sessions', {}))
+        index['sessions'][name] = entry
+        _write_index(archive_dir, index)
+
+    if leftover:
+        print(f"Warning: kept {path}: {leftover} byte(s) after record {len(records)} "
+              f"could not be parsed")
+    elif remove:
+        os.remove(path)
+    return entry
+
+
+def list_sessions(archive_dir=ARCHIVE_DIR):
+    """Archived sessions (index entries without chunk details), newest first"""
+    sessions = []
+    for entry in load_index(archive_dir).get('sessions', {}).values():
+        summary = {k: v for k, v in entry.items() if k != 'chunks'}
+        sessions.append(summary)
+    sessions.sort(key=lambda s: s['start'] or 0, reverse=True)
+    return sessions
+
+
+def iter_session(name, archive_dir=ARCHIVE_DIR, start=None, end=None):
+    """Yield the records of an archived session, one chunk in memory at a time
+
+    Chunks entirely outside [start, end] are skipped without decompressing.
+    """
+    entry = load_index(archive_dir).get('sessions', {}).get(name)
+    if entry is None:
+        raise KeyError(name)
+
+    with open(os.path.join(archive_dir, entry['file']), 'rb') as f:
+        for chunk in entry['chunks']:
+            if start is not None and chunk['end'] is not None and chunk['end'] < start:
+                continue
+            if end is not None and chunk['start'] is not None and chunk['start'] > end:
+                continue
+
+            f.seek(chunk['offset'])
+            lines = gzip.decompress(f.read(chunk['length'])).decode('utf-8')
+            for line in lines.splitlines():
+                det = json.loads(line)
+                timestamp = det.get('timestamp')
+                if start is not None and timestamp is not None and timestamp < start:
+                    continue
+                if end is not None and timestamp is not None and timestamp > end:
+                    continue
+                yield det
+
+
+def compact_legacy(root='.', archive_dir=ARCHIVE_DIR):
+    """Convert old detections_archive_<ts>/ folders into the compressed archive"""
+    converted = 0
+    for folder in sorted(glob.glob(os.path.join(root, 'detections_archive_*'))):
+        if not os.path.isdir(folder) or os.path.abspath(folder) == os.path.abspath(archive_dir):
+            continue
+        for path in sorted(glob.glob(os.path.join(folder, 'detections_*.json'))):
+            if not archive_file(path, archive_dir)['leftover_bytes']:
+                converted += 1
+        if not os.listdir(folder):
+            shutil.rmtree(folder)
+    return converted
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Detection session archive tools')
+    parser.add_argument('command', choices=['list', 'compact'],
+                       help='list: show archived sessions; compact: convert old archive folders')
+    parser.add_argument('--archive-dir', type=str, default=ARCHIVE_DIR,
+                       help=f'Archive directory (default: {ARCHIVE_DIR})')
+    args = parser.parse_args()
+
+    if args.command == 'compact':
+        converted = compact_legacy('.', args.archive_dir)
+        print(f"✓ {converted} file(s) compacted into {args.archive_dir}/")
+        return
+
+    sessions = list_sessions(args.archive_dir)
+    if not sessions:
+        print("No archived sessions.")
+        return
+
+    total_size = sum(s['size'] for s in sessions)
+    total_original = sum(s['original_size'] for s in sessions)
+    for s in sessions:
+        print(f"  {s['session']}: {s['count']} detection(s), {s['size'] / 1024:.1f} KB")
+    print(f"\n{len(sessions)} session(s), {total_size / 1024:.1f} KB "
+          f"(was {total_original / 1024:.1f} KB as JSON)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,474 @@
+"""
+Soak Test
+Runs inference_pi.run_inference for hours on a looping recording, with the
+replay harness' fake camera, serial GPS and GPIO and an MQTT client that
+only counts messages. At every interval it samples the process (RSS,
+Python heap blocks and objects, open file descriptors, threads), the size
+of the files the session writes and per-stage latency percentiles. After a
+warm-up it fits the growth rate of each resource and compares late latency
+windows with early ones; any drift beyond the limits fails the run, so a
+pipeline that passes a few hours stays flat for a week in the field.
+"""
+
+import gc
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import ExitStack
+from unittest import mock
+
+import cv2
+import numpy as np
+
+import inference_pi
+from replay_harness import MockGPIO, ReplayCamera, read_nmea_log, replay_gps_patches, synth_nmea
+
+DEFAULT_HOURS = 4.0
+DEFAULT_INTERVAL = 60.0   # seconds between samples
+DEFAULT_WARMUP = 600.0    # seconds ignored before fitting (caches, allocator)
+
+# Default drift limits
+MAX_RSS_MB_PER_HOUR = 2.0
+MAX_HEAP_BLOCKS_PER_HOUR = 5000
+MAX_OBJECTS_PER_HOUR = 2000
+MAX_DISK_MB_PER_DAY = 200.0
+MAX_FD_GROWTH = 0
+MAX_THREAD_GROWTH = 0
+MAX_LATENCY_RATIO = 1.5   # late vs. early p90 of each stage
+
+# Samples needed after warm-up before growth rates mean anything
+MIN_STEADY_SAMPLES = 4
+
+# Timings a stage needs in a window for its percentiles to count
+MIN_STAGE_COUNT = 10
+
+# Time allowed for run_inference's threads to exit after it returns
+THREAD_EXIT_TIMEOUT = 5.0
+
+
+class StageTimer:
+    """Durations per pipeline stage, summarized and cleared every interval
+    so the soak test itself keeps no growing history"""
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self._window = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self._window[stage].append(seconds)
+            self.counts[stage] += 1
+
+    def drain(self):
+        """{stage: {count, p50_ms, p90_ms, max_ms}} since the last drain"""
+        with self._lock:
+            window, self._window = self._window, defaultdict(list)
+        summary = {}
+        for stage, times in window.items():
+            p50, p90 = np.percentile(times, [50, 90]) * 1000
+            summary[stage] = {'count': len(times), 'p50_ms': float(p50), 'p90_ms': float(p90),
+                              'max_ms': max(times) * 1000}
+        return summary
+
+    def timed(self, stage, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return wrapper
+
+
+class TimedModel:
+    """Model wrapper timing predict() as the 'inference' stage"""
+
+    def __init__(self, model, timer):
+        self._model = model
+        self.predict = timer.timed('inference', model.predict)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+class SoakCamera(ReplayCamera):
+    """Looping replay camera that times each frame's trip through the loop
+    (from handing the frame out to the next read) as the 'frame' stage"""
+
+    def __init__(self, timer, *args, **kwargs):
+        super().__init__(*args, loop=True, **kwargs)
+        self.timer = timer
+        self._returned = None
+
+    def read(self):
+        if self._returned is not None:
+            self.timer.record('frame', time.perf_counter() - self._returned)
+        result = super().read()
+        self._returned = time.perf_counter()
+        return result
+
+
+class CountingMQTTClient:
+    """paho client stand-in that counts messages per topic and drops them"""
+
+    def __init__(self):
+        self.messages = defaultdict(int)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.messages[topic] += 1
+
+    def disconnect(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+
+def rss_mb():
+    """Resident set size of this process in MB (None off Linux)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def open_fds():
+    for fd_dir in ('/proc/self/fd', '/dev/fd'):
+        if os.path.isdir(fd_dir):
+            return len(os.listdir(fd_dir))
+    return None
+
+
+def file_sizes(directory):
+    """Bytes per file written in directory"""
+    sizes = {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            sizes[name] = os.path.getsize(path)
+    return sizes
+
+
+def take_sample(elapsed, timer, camera, session, work_dir):
+    files = file_sizes(work_dir)
+    sample = {
+        't': elapsed,
+        'frames': camera.frames_read,
+        'loops': camera.loops,
+        'inferences': timer.counts['inference'],
+        'detections': session[0].count if session else 0,
+        'rss_mb': rss_mb(),
+        'heap_blocks': sys.getallocatedblocks(),
+        'objects': len(gc.get_objects()),
+        'fds': open_fds(),
+        'threads': threading.active_count(),
+        'disk_bytes': sum(files.values()),
+        'files': files,
+        'stages': timer.drain()
+    }
+    if tracemalloc.is_tracing():
+        sample['traced_mb'] = tracemalloc.get_traced_memory()[0] / 1024**2
+    return sample
+
+
+def per_hour(samples, key):
+    """Least-squares growth rate of a sampled value, per hour"""
+    points = [(s['t'], s[key]) for s in samples if s.get(key) is not None]
+    if len(points) < 2:
+        return None
+    t, values = np.array(points, dtype=float).T
+    return float(np.polyfit(t / 3600.0, values, 1)[0])
+
+
+def stage_p90(samples, stage):
+    """Median p90 of a stage over windows with enough timings"""
+    values = [s['stages'][stage]['p90_ms'] for s in samples
+              if stage in s['stages'] and s['stages'][stage]['count'] >= MIN_STAGE_COUNT]
+    return float(np.median(values)) if values else None
+
+
+def analyze(samples, warmup, limits):
+    """Drift checks over the samples after warm-up
+
+    Returns a list of {check, value, limit, unit, ok}; empty when there are
+    too few samples to judge.
+    """
+    steady = [s for s in samples if s['t'] >= warmup]
+    if len(steady) < MIN_STEADY_SAMPLES:
+        return []
+
+    checks = []
+
+    def check(name, value, limit, unit):
+        if value is not None:
+            checks.append({'check': name, 'value': value, 'limit': limit, 'unit': unit,
+                           'ok': value <= limit})
+
+    check('rss growth', per_hour(steady, 'rss_mb'), limits['rss_mb_per_hour'], 'MB/h')
+    check('heap block growth', per_hour(steady, 'heap_blocks'), limits['heap_blocks_per_hour'], 'blocks/h')
+    check('object growth', per_hour(steady, 'objects'), limits['objects_per_hour'], 'objects/h')
+    disk = per_hour(steady, 'disk_bytes')
+    check('disk growth', disk * 24 / 1024**2 if disk is not None else None,
+          limits['disk_mb_per_day'], 'MB/day')
+    # Counts: floor of the last third vs. the first (a leak raises the floor,
+    # a file or thread that is open for a moment doesn't)
+    third = max(1, len(steady) // 3)
+    if steady[0]['fds'] is not None:
+        check('open fd growth', min(s['fds'] for s in steady[-third:]) -
+              min(s['fds'] for s in steady[:third]), limits['fd_growth'], 'fds')
+    check('thread growth', min(s['threads'] for s in steady[-third:]) -
+          min(s['threads'] for s in steady[:third]), limits['thread_growth'], 'threads')
+
+    # Early vs. late latency
+    stages = sorted({stage for s in steady for stage in s['stages']})
+    for stage in stages:
+        early = stage_p90(steady[:third], stage)
+        late = stage_p90(steady[-third:], stage)
+        if early and late:
+            check(f'{stage} p90 drift', late / early, limits['latency_ratio'], 'x')
+    return checks
+
+
+def run_soak(model_path, source, nmea_lines, hours=DEFAULT_HOURS, interval=DEFAULT_INTERVAL,
+             imgsz=416, frame_skip=1, fps=None, speed=1.0, hold=1, trace=False, on_sample=None):
+    """Run inference on a looping replay for hours; returns (samples, info)"""
+    timer = StageTimer()
+    camera = SoakCamera(timer, source, fps, speed, hours * 3600, hold)
+    client = CountingMQTTClient()
+    gps_patches = replay_gps_patches(nmea_lines)
+    session = []
+
+    real_yolo = inference_pi.YOLO
+    real_session_log = inference_pi.SessionLog
+    real_store = inference_pi.DetectionStore
+
+    class TimedSessionLog(real_session_log):
+        def __init__(self, path):
+            super().__init__(path)
+            self.append = timer.timed('session_write', self.append)
+            session.append(self)
+
+    class TimedDetectionStore(real_store):
+        def __init__(self, path):
+            super().__init__(path)
+            self.add = timer.timed('db_insert', self.add)
+
+    # Samples go to a file, so the soak test's own memory doesn't grow
+    samples_file = tempfile.TemporaryFile('w+')
+    stop = threading.Event()
+    start = time.time()
+
+    with tempfile.TemporaryDirectory() as work_dir, ExitStack() as stack:
+        # create=True: RPi.GPIO isn't imported off the Pi
+        stack.enter_context(mock.patch.multiple(
+            inference_pi, create=True,
+            YOLO=lambda path, **kwargs: TimedModel(real_yolo(path, **kwargs), timer),
+            SessionLog=TimedSessionLog,
+            DetectionStore=TimedDetectionStore,
+            publish_detection=timer.timed('mqtt_publish', inference_pi.publish_detection),
+            control_leds=timer.timed('leds', inference_pi.control_leds),
+            setup_camera=lambda **kwargs: camera,
+            setup_mqtt=lambda **kwargs: client,
+            MQTT_AVAILABLE=True,
+            GPIO=MockGPIO(None, inference_pi.LED_PINS),
+            GPIO_AVAILABLE=True,
+            **gps_patches))
+        stack.enter_context(mock.patch.object(cv2, 'waitKey', lambda delay=0: -1))
+        stack.enter_context(mock.patch.object(cv2, 'destroyAllWindows', lambda: None))
+
+        if trace:
+            tracemalloc.start(10)
+
+        def sampler():
+            while not stop.wait(interval):
+                sample = take_sample(time.time() - start, timer, camera, session, work_dir)
+                samples_file.write(json.dumps(sample) + '\n')
+                samples_file.flush()
+                if on_sample:
+                    on_sample(sample)
+
+        threads_before = set(threading.enumerate())
+        sampler_thread = threading.Thread(target=sampler, daemon=True)
+        sampler_thread.start()
+
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            inference_pi.run_inference(
+                model_path=os.path.join(cwd, model_path),
+                show_display=False,
+                frame_skip=frame_skip,
+                enable_mqtt=True,
+                enable_gps=bool(gps_patches),
+                db_path=os.path.join(work_dir, 'detections.db'),
+                device_id='soak',
+                enable_preview=False,
+                imgsz=imgsz,
+                enable_thermal=False)
+        finally:
+            os.chdir(cwd)
+            stop.set()
+            sampler_thread.join()
+
+        # Threads run_inference started and didn't stop
+        lingering = []
+        deadline = time.time() + THREAD_EXIT_TIMEOUT
+        while time.time() < deadline:
+            lingering = [t.name for t in threading.enumerate()
+                         if t not in threads_before and t is not sampler_thread and t.is_alive()]
+            if not lingering:
+                break
+            time.sleep(0.1)
+
+        top_allocations = []
+        if trace:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            top_allocations = [str(stat) for stat in snapshot.statistics('lineno')[:10]]
+
+        info = {
+            'seconds': time.time() - start,
+            'frames': camera.frames_read,
+            'frames_dropped': camera.frames_dropped,
+            'loops': camera.loops,
+            'inferences': timer.counts['inference'],
+            'detections': session[0].count if session else 0,
+            'mqtt_messages': dict(client.messages),
+            'lingering_threads': lingering,
+            'top_allocations': top_allocations
+        }
+
+    samples_file.seek(0)
+    samples = [json.loads(line) for line in samples_file]
+    samples_file.close()
+    return samples, info
+
+
+def print_sample(sample):
+    stages = sample['stages']
+    inference = stages.get('inference')
+    print(f"[soak {sample['t'] / 60:7.1f} min] rss {sample['rss_mb'] or 0:7.1f} MB  "
+          f"blocks {sample['heap_blocks']:8d}  fds {sample['fds']}  threads {sample['threads']}  "
+          f"disk {sample['disk_bytes'] / 1024**2:6.2f} MB  detections {sample['detections']}  "
+          f"inference p90 {inference['p90_ms'] if inference else 0:.0f} ms")
+
+
+def print_report(samples, info, checks, warmup):
+    print("\n" + "=" * 60)
+    print("Soak Test Report")
+    print("=" * 60)
+    print(f"Ran {info['seconds'] / 3600:.2f} h: {info['frames']} frames "
+          f"({info['loops']} loops, {info['frames_dropped']} dropped), "
+          f"{info['inferences']} inferences, {info['detections']} detections")
+    print(f"MQTT messages: {sum(info['mqtt_messages'].values())}")
+    if samples:
+        first, last = samples[0], samples[-1]
+        print(f"\n{'':14s} {'first':>12s} {'last':>12s}")
+        for key in ('rss_mb', 'heap_blocks', 'objects', 'fds', 'threads', 'disk_bytes'):
+            if first.get(key) is not None:
+                print(f"{key:14s} {first[key]:12.1f} {last[key]:12.1f}")
+        print("\nFiles at the end:")
+        for name, size in last['files'].items():
+            print(f"  {name:28s} {size / 1024:10.1f} KB")
+
+    if info['lingering_threads']:
+        print(f"\nThreads still running after shutdown: {', '.join(info['lingering_threads'])}")
+    if info['top_allocations']:
+        print("\nLargest live allocations at the end (tracemalloc):")
+        for line in info['top_allocations']:
+            print(f"  {line}")
+
+    print(f"\nDrift after {warmup / 60:.1f} min warm-up:")
+    if not checks:
+        print(f"  not enough samples (need {MIN_STEADY_SAMPLES} after warm-up)")
+    for c in checks:
+        print(f"  {'ok  ' if c['ok'] else 'FAIL'} {c['check']:26s} {c['value']:10.2f} {c['unit']:9s} "
+              f"(limit {c['limit']:g})")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Soak-test the inference loop for memory and latency drift')
+    parser.add_argument('--model', type=str, required=True,
+                       help='Model file passed to inference_pi.py')
+    parser.add_argument('--video', type=str, default='data/test/images',
+                       help='Recorded video or image folder, played in a loop (default: data/test/images)')
+    parser.add_argument('--nmea', type=str, default=None,
+                       help='Recorded NMEA log (default: a synthetic walk)')
+    parser.add_argument('--hours', type=float, default=DEFAULT_HOURS,
+                       help=f'Run time (default: {DEFAULT_HOURS})')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                       help=f'Seconds between samples (default: {DEFAULT_INTERVAL:.0f})')
+    parser.add_argument('--warmup', type=float, default=DEFAULT_WARMUP,
+                       help=f'Seconds before drift is measured, at most a quarter of the run '
+                            f'(default: {DEFAULT_WARMUP:.0f})')
+    parser.add_argument('--imgsz', type=int, default=416,
+                       help='Model input size (default: 416)')
+    parser.add_argument('--frame-skip', type=int, default=1,
+                       help='Passed to inference_pi.py (default: 1)')
+    parser.add_argument('--fps', type=float, default=None,
+                       help='Replay frame rate (default: the video\'s, 30 for image folders)')
+    parser.add_argument('--hold', type=int, default=1,
+                       help='Frames each image of a folder is shown for (default: 1)')
+    parser.add_argument('--speed', type=float, default=1.0,
+                       help='Replay speed, 0 = every frame as fast as possible (default: 1)')
+    parser.add_argument('--tracemalloc', action='store_true',
+                       help='Trace Python allocations and list the largest at the end (slower)')
+    parser.add_argument('--max-rss-mb-per-hour', type=float, default=MAX_RSS_MB_PER_HOUR)
+    parser.add_argument('--max-heap-blocks-per-hour', type=float, default=MAX_HEAP_BLOCKS_PER_HOUR)
+    parser.add_argument('--max-objects-per-hour', type=float, default=MAX_OBJECTS_PER_HOUR)
+    parser.add_argument('--max-disk-mb-per-day', type=float, default=MAX_DISK_MB_PER_DAY)
+    parser.add_argument('--max-fd-growth', type=int, default=MAX_FD_GROWTH)
+    parser.add_argument('--max-thread-growth', type=int, default=MAX_THREAD_GROWTH)
+    parser.add_argument('--max-latency-ratio', type=float, default=MAX_LATENCY_RATIO,
+                       help=f'Max late/early p90 of each stage (default: {MAX_LATENCY_RATIO})')
+    parser.add_argument('--json', type=str, default=None,
+                       help='Also write samples, run info and checks to this file')
+    args = parser.parse_args()
+
+    limits = {
+        'rss_mb_per_hour': args.max_rss_mb_per_hour,
+        'heap_blocks_per_hour': args.max_heap_blocks_per_hour,
+        'objects_per_hour': args.max_objects_per_hour,
+        'disk_mb_per_day': args.max_disk_mb_per_day,
+        'fd_growth': args.max_fd_growth,
+        'thread_growth': args.max_thread_growth,
+        'latency_ratio': args.max_latency_ratio
+    }
+    warmup = min(args.warmup, args.hours * 3600 / 4)
+
+    nmea_lines = read_nmea_log(args.nmea) if args.nmea else synth_nmea()
+    samples, info = run_soak(args.model, args.video, nmea_lines, args.hours, args.interval,
+                             args.imgsz, args.frame_skip, args.fps, args.speed, args.hold,
+                             args.tracemalloc, on_sample=print_sample)
+    checks = analyze(samples, warmup, limits)
+    print_report(samples, info, checks, warmup)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'info': info, 'limits': limits, 'warmup': warmup,
+                       'checks': checks, 'samples': samples}, f, indent=2)
+        print(f"\nReport saved to: {args.json}")
+
+    failed = [c['check'] for c in checks if not c['ok']]
+    if info['lingering_threads']:
+        failed.append('lingering threads')
+    if failed:
+        print(f"\nFAIL: {', '.join(failed)}")
+        sys.exit(1)
+    print("\n✓ No drift beyond the limits")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+import os
+
+import profile_tflite
+
+SAMPLE = os.path.join(os.path.dirname(__file__), 'data', 'benchmark_op_profile.csv')
+
+
+def test_parse_op_profile_reads_run_order_of_benchmark_runs():
+    rows = profile_tflite.parse_op_profile(SAMPLE)
+
+    assert [row['type'] for row in rows] == [
+        'QUANTIZE', 'CONV_2D', 'LOGISTIC', 'CONV_2D', 'CONCATENATION', 'DEQUANTIZE']
+    assert rows[1] == {'type': 'CONV_2D', 'name': 'model.0/conv/Conv2D',
+                       'avg_ms': 3.084, 'times_called': 1}
+    assert rows[-1]['times_called'] == 2
+
+
+def test_parse_op_profile_without_init_section(tmp_path):
+    with open(SAMPLE) as f:
+        text = f.read()
+    path = tmp_path / 'profile.csv'
+    path.write_text(text[text.index('Operator-wise'):].split('\n', 1)[1])
+
+    rows = profile_tflite.parse_op_profile(str(path))
+
+    assert len(rows) == 6
+    assert rows[0]['type'] == 'QUANTIZE'
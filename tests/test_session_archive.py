@@ -0,0 +1,45 @@
+import json
+
+import session_archive
+
+
+def records(n):
+    return [{'timestamp': 1700000000 + i, 'class': 'sehat'} for i in range(n)]
+
+
+def test_jsonl_without_final_newline_is_archived_whole(tmp_path):
+    path = tmp_path / 'detections_1700000000.json'
+    path.write_text('\n'.join(json.dumps(det) for det in records(5)))
+    archive_dir = str(tmp_path / 'archive')
+
+    entry = session_archive.archive_file(str(path), archive_dir)
+
+    assert entry['count'] == 5
+    assert entry['leftover_bytes'] == 0
+    assert not path.exists()
+    assert len(list(session_archive.iter_session(entry['session'], archive_dir))) == 5
+
+
+def test_array_with_corrupt_record_keeps_source(tmp_path):
+    dets = [json.dumps(det) for det in records(5)]
+    dets[2] = '{"timestamp": 1700000002, "class": '
+    path = tmp_path / 'detections_1700000000.json'
+    content = '[\n' + ',\n'.join(dets) + '\n]\n'
+    path.write_text(content)
+
+    entry = session_archive.archive_file(str(path), str(tmp_path / 'archive'))
+
+    assert entry['count'] == 2
+    assert entry['leftover_bytes'] > 0
+    assert path.read_text() == content
+
+
+def test_complete_array_is_removed(tmp_path):
+    path = tmp_path / 'detections_1700000000.json'
+    path.write_text(json.dumps(records(5), indent=2) + '\n')
+
+    entry = session_archive.archive_file(str(path), str(tmp_path / 'archive'))
+
+    assert entry['count'] == 5
+    assert entry['leftover_bytes'] == 0
+    assert not path.exists()
@@ -0,0 +1,270 @@
+"""
+Thermal Monitor and Inference Governor
+Reads the SoC temperature, CPU frequency and firmware throttling flags from
+sysfs, and steps inference down a ladder of cheaper settings (lower
+processing rate, fewer threads, lower resolution) before the firmware starts
+throttling, then back up once the Pi has cooled down. Sustained throughput
+over hours beats a fast first minute followed by a throttled CPU.
+
+All paths are relative to a root directory, so the monitor can be pointed
+at a tree of fake sysfs files.
+"""
+
+import os
+import time
+
+TEMP_PATH = 'sys/class/thermal/thermal_zone0/temp'
+THROTTLED_PATH = 'sys/devices/platform/soc/soc:firmware/get_throttled'
+FREQ_PATH = 'sys/devices/system/cpu/cpu0/cpufreq/scaling_cur_freq'
+
+# get_throttled bits (same as `vcgencmd get_throttled`); the "occurred"
+# bits are the same flags shifted by 16
+THROTTLE_FLAGS = {
+    0: 'under_voltage',
+    1: 'freq_capped',
+    2: 'throttled',
+    3: 'soft_temp_limit'
+}
+OCCURRED_SHIFT = 16
+
+# The Pi 4 firmware soft-throttles at 80C: step down before that, step back
+# up only well below it
+HIGH_TEMP = 75.0
+LOW_TEMP = 65.0
+
+CHECK_INTERVAL = 2.0     # seconds between sysfs reads
+STEP_INTERVAL = 15.0     # minimum time between two step-downs
+RESTORE_AFTER = 60.0     # time below LOW_TEMP before stepping back up
+
+
+def read_number(path, base=10):
+    """Integer content of a sysfs file, or None if it can't be read"""
+    try:
+        with open(path) as f:
+            return int(f.read().strip(), base)
+    except (OSError, ValueError):
+        return None
+
+
+class ThermalMonitor:
+    """Reads the Pi's thermal state from sysfs under root"""
+
+    def __init__(self, root='/'):
+        self.root = root
+        self.temp_path = os.path.join(root, TEMP_PATH)
+        self.throttled_path = os.path.join(root, THROTTLED_PATH)
+        self.freq_path = os.path.join(root, FREQ_PATH)
+
+    def available(self):
+        return os.path.exists(self.temp_path)
+
+    def read(self):
+        """Current state: temp_c, cpu_mhz, throttled (active flags) and
+        throttled_since_boot (flags that occurred); None where unknown"""
+        millidegrees = read_number(self.temp_path)
+        khz = read_number(self.freq_path)
+        bits = read_number(self.throttled_path, base=16)
+        state = {
+            'temp_c': millidegrees / 1000.0 if millidegrees is not None else None,
+            'cpu_mhz': khz // 1000 if khz is not None else None,
+            'throttled': [],
+            'throttled_since_boot': []
+        }
+        if bits is not None:
+            state['throttled'] = [name for bit, name in THROTTLE_FLAGS.items() if bits >> bit & 1]
+            state['throttled_since_boot'] = [name for bit, name in THROTTLE_FLAGS.items()
+                                             if bits >> (bit + OCCURRED_SHIFT) & 1]
+        return state
+
+
+def default_levels(imgsz, threads=None, low_imgsz=None, scale_threads=True):
+    """Settings ladder from full speed to coolest
+
+    Each level is a dict of max_fps (None = as fast as possible), threads
+    and imgsz. The rate is lowered first since it saves the most heat per
+    lost detection; resolution steps are only included when low_imgsz is
+    given (a model that can run at it). Without scale_threads (TFLite
+    models, whose interpreter thread count is fixed when loaded) threads
+    is None at every level and thread steps are left out.
+    """
+    threads = threads or os.cpu_count() or 1
+    half = max(1, threads // 2)
+    if not scale_threads:
+        threads = half = None
+    low = low_imgsz or imgsz
+    levels = [
+        {'max_fps': None, 'threads': threads, 'imgsz': imgsz},
+        {'max_fps': 6, 'threads': threads, 'imgsz': imgsz},
+        {'max_fps': 4, 'threads': half, 'imgsz': imgsz},
+        {'max_fps': 4, 'threads': half, 'imgsz': low},
+        {'max_fps': 2, 'threads': 1 if scale_threads else None, 'imgsz': low}
+    ]
+    # Drop levels that don't change anything (no low resolution model)
+    ladder = []
+    for level in levels:
+        if not ladder or level != ladder[-1]:
+            ladder.append(level)
+    return ladder
+
+
+class ThermalGovernor:
+    """Chooses the inference settings level from the thermal state
+
+    Steps one level cooler when the SoC reaches high_temp or the firmware
+    reports throttling, at most once per step_interval, and one level back
+    up after restore_after seconds below low_temp.
+    """
+
+    def __init__(self, monitor, levels, high_temp=HIGH_TEMP, low_temp=LOW_TEMP,
+                 check_interval=CHECK_INTERVAL, step_interval=STEP_INTERVAL,
+                 restore_after=RESTORE_AFTER):
+        self.monitor = monitor
+        self.levels = levels
+        self.high_temp = high_temp
+        self.low_temp = low_temp
+        self.check_interval = check_interval
+        self.step_interval = step_interval
+        self.restore_after = restore_after
+        self.level = 0
+        self.state = {'temp_c': None, 'cpu_mhz': None, 'throttled': [], 'throttled_since_boot': []}
+        self.max_temp = None
+        self.throttle_events = 0
+        self.level_changes = 0
+        self.time_at_level = [0.0] * len(levels)
+        self._last_check = None
+        self._level_since = None
+        self._last_step = None
+        self._cool_since = None
+
+    @property
+    def settings(self):
+        return self.levels[self.level]
+
+    def set_levels(self, levels):
+        """Replace the ladder (e.g. for a model of another size), keeping
+        the current level where it still exists"""
+        now = time.time()
+        if self._level_since is not None:
+            self.time_at_level[self.level] += now - self._level_since
+            self._level_since = now
+        self.levels = levels
+        self.level = min(self.level, len(levels) - 1)
+        self.time_at_level = (self.time_at_level + [0.0] * len(levels))[:len(levels)]
+
+    @staticmethod
+    def _thermal_flags(state):
+        # Under-voltage alone isn't a thermal problem; the others are
+        return [flag for flag in state['throttled'] if flag != 'under_voltage']
+
+    def _is_hot(self, state):
+        temp = state['temp_c']
+        return bool(self._thermal_flags(state)) or (temp is not None and temp >= self.high_temp)
+
+    def _is_cool(self, state):
+        temp = state['temp_c']
+        return not self._thermal_flags(state) and temp is not None and temp <= self.low_temp
+
+    def update(self, now=None):
+        """Re-read the thermal state if due; returns True when the level changed"""
+        now = now or time.time()
+        if self._last_check is not None and now - self._last_check < self.check_interval:
+            return False
+        self._last_check = now
+        if self._level_since is None:
+            self._level_since = now
+
+        state = self.monitor.read()
+        if state['throttled'] and not self.state['throttled']:
+            self.throttle_events += 1
+        self.state = state
+        if state['temp_c'] is not None:
+            self.max_temp = max(self.max_temp or state['temp_c'], state['temp_c'])
+
+        level = self.level
+        if self._is_hot(state):
+            self._cool_since = None
+            if level < len(self.levels) - 1 and (
+                    self._last_step is None or now - self._last_step >= self.step_interval):
+                level += 1
+        elif self._is_cool(state):
+            if self._cool_since is None:
+                self._cool_since = now
+            elif level > 0 and now - self._cool_since >= self.restore_after:
+                level -= 1
+                # Each further step up needs another cool period
+                self._cool_since = now
+        else:
+            self._cool_since = None
+
+        if level == self.level:
+            return False
+        self.time_at_level[self.level] += now - self._level_since
+        self._level_since = now
+        self.level = level
+        self._last_step = now
+        self.level_changes += 1
+        return True
+
+    def level_times(self, now=None):
+        """Seconds spent at each level so far"""
+        times = list(self.time_at_level)
+        if self._level_since is not None:
+            times[self.level] += (now or time.time()) - self._level_since
+        return times
+
+    def snapshot(self):
+        """Thermal state and current settings, for stats and heartbeats"""
+        return {
+            'temp_c': self.state['temp_c'],
+            'max_temp_c': self.max_temp,
+            'cpu_mhz': self.state['cpu_mhz'],
+            'throttled': self.state['throttled'],
+            'throttled_since_boot': self.state['throttled_since_boot'],
+            'throttle_events': self.throttle_events,
+            'level': self.level,
+            'settings': dict(self.settings)
+        }
+
+
+def apply_threads(threads):
+    """Limit OpenCV and (when used) PyTorch to this many threads; None
+    leaves them alone"""
+    if threads is None:
+        return
+    import cv2
+    cv2.setNumThreads(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Show the Pi thermal state')
+    parser.add_argument('--root', type=str, default='/',
+                       help='sysfs root, for testing against fake files (default: /)')
+    parser.add_argument('--interval', type=float, default=CHECK_INTERVAL,
+                       help=f'Seconds between reads (default: {CHECK_INTERVAL})')
+    args = parser.parse_args()
+
+    monitor = ThermalMonitor(args.root)
+    if not monitor.available():
+        print(f"No thermal zone at {monitor.temp_path}")
+        return
+    try:
+        while True:
+            state = monitor.read()
+            flags = ', '.join(state['throttled']) or 'none'
+            temp = f"{state['temp_c']:.1f}C" if state['temp_c'] is not None else '?C'
+            print(f"{time.strftime('%H:%M:%S')}  {temp}  "
+                  f"{state['cpu_mhz'] or '?'} MHz  throttling: {flags}")
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
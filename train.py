@@ -4,11 +4,61 @@ Optimized for deployment on Raspberry Pi 4
 """
 
 from ultralytics import YOLO
+from ultralytics.data.dataset import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer
 import torch
+import argparse
 import os
 from datetime import datetime
 
+from dataset_cache import open_cache
+
+IMGSZ = 416
+
+class CachedYOLODataset(YOLODataset):
+    """YOLODataset reading resized images from the memory-mapped dataset cache"""
+
+    image_cache = None
+
+    def load_image(self, i, rect_mode=True):
+        index = self.image_cache.index_of(self.im_files[i]) if self.image_cache else None
+        if self.ims[i] is not None or not rect_mode or index is None:
+            return super().load_image(i, rect_mode)
+
+        im, (h0, w0) = self.image_cache.image(index)
+        # Same mosaic buffer bookkeeping as BaseDataset.load_image
+        if self.augment:
+            self.ims[i], self.im_hw0[i], self.im_hw[i] = im, (h0, w0), im.shape[:2]
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                j = self.buffer.pop(0)
+                if self.cache != 'ram':
+                    self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+        return im, (h0, w0), im.shape[:2]
+
+class CachedDetectionTrainer(DetectionTrainer):
+    """DetectionTrainer whose training dataset reads from the dataset cache
+
+    Only the augmented training set: ultralytics downscales validation images
+    with INTER_AREA instead of the cache's INTER_LINEAR, and validation must
+    see the same pixels with and without the cache (mAP picks best.pt).
+    """
+
+    def build_dataset(self, img_path, mode='train', batch=None):
+        dataset = super().build_dataset(img_path, mode, batch)
+        if mode == 'train' and type(dataset) is YOLODataset and dataset.im_files:
+            dataset.__class__ = CachedYOLODataset
+            dataset.image_cache = open_cache(dataset.im_files, dataset.imgsz)
+        return dataset
+
 def main():
+    parser = argparse.ArgumentParser(description='Train YOLOv8 for chili disease detection')
+    parser.add_argument('--data', type=str, default='data/data.yaml',
+                       help='Dataset yaml (default: data/data.yaml; data_dedup/data.yaml after dedup_dataset.py)')
+    parser.add_argument('--no-dataset-cache', action='store_true',
+                       help='Decode JPEGs every epoch instead of using the memory-mapped cache')
+    args = parser.parse_args()
+    
     # Check available device
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
     print(f"=" * 60)
@@ -30,21 +80,23 @@ def main():
     print(f"  - Epochs: 100")
     print(f"  - Batch size: {'16' if device == 'cuda' else '4'}")
     print(f"  - Classes: antraknosa, cabai_normal, lalat_buah")
+    print(f"  - Dataset: {args.data}")
+    print(f"  - Dataset cache: {'Disabled' if args.no_dataset_cache else 'Enabled'}")
     print(f"=" * 60)
     
     results = model.train(
         # Data
-        data='data/data.yaml',
+        data=args.data,
         
         # Training parameters
         epochs=100,
-        imgsz=416,  # Smaller size for Raspberry Pi (320, 416, or 640)
+        imgsz=IMGSZ,  # Smaller size for Raspberry Pi (320, 416, or 640)
         batch=16 if device == 'cuda' else 4,  # Adjust based on GPU/CPU
         device=device,
         
         # Optimization
         workers=8 if device == 'cuda' else 4,  # Number of data loading workers
-        cache=False,  # Cache images to RAM for faster training
+        cache=False,  # RAM cache off; resized images come from the on-disk dataset cache
         amp=True if device == 'cuda' else False,  # Automatic Mixed Precision for GPU
         
         # Output
@@ -60,6 +112,9 @@ def main():
         # Visualization
         plots=True,
         
+        # Read preprocessed images from the memory-mapped cache
+        trainer=None if args.no_dataset_cache else CachedDetectionTrainer,
+        
         # Augmentation (default is good for most cases)
         hsv_h=0.015,  # Image HSV-Hue augmentation
         hsv_s=0.7,    # Image HSV-Saturation augmentation
@@ -82,7 +137,7 @@ def main():
     # Validate the best model
     print("\nValidating best model...")
     best_model = YOLO(f"{results.save_dir}/weights/best.pt")
-    val_results = best_model.val(data='data/data.yaml', imgsz=416)
+    val_results = best_model.val(data=args.data, imgsz=416)
     
     print("\nValidation Results:")
     print(f"  - mAP50: {val_results.box.map50:.4f}")